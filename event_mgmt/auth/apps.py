@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AuthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'auth'
+    #django.contrib.auth already uses the 'auth' label
+    label = 'user_auth'
+
+    def ready(self):
+        #connects the user cache invalidation signals
+        from . import signals
@@ -0,0 +1,117 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from event.cache import get_versions, versions_shared
+
+
+def user_scope(pk):
+    return 'user:%s' % pk
+
+
+class UserCache:
+    """
+    Bounded LRU cache of users keyed by primary key, local to the process. Entries expire after a timeout
+    and are only used while the version stamp of their user (see event.cache) is the one they were stored
+    with, so a change made through any worker invalidates them everywhere the stamp is shared.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pk, stamp):
+        """
+        Method to return the cached user, None when it is missing, expired or stale.
+        """
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is None:
+                return None
+            user, version, expires = entry
+            if version != stamp or expires < time.monotonic():
+                del self._entries[pk]
+                return None
+            self._entries.move_to_end(pk)
+            return user
+
+    def set(self, pk, user, stamp):
+        """
+        Method to cache a user, evicting the least recently used ones beyond the size of the cache.
+        """
+        with self._lock:
+            self._entries[pk] = (user, stamp, time.monotonic() + self.timeout)
+            self._entries.move_to_end(pk)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def evict(self, pk):
+        with self._lock:
+            self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = (None, None)
+_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    """
+    Method to return the user cache of this process, configured from settings
+    (AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TIMEOUT).
+    Output:
+        UserCache instance
+    """
+    global _cache
+    config = (getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000), getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 300))
+    with _cache_lock:
+        if _cache[0] != config:
+            _cache = (config, UserCache(*config))
+        return _cache[1]
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication resolving the user of the token from the process local user cache, so that
+    authenticated requests do not query the user table in steady state. Users are evicted when they are
+    saved or deleted (profile / password changes, deactivation, see auth/signals.py) and after
+    AUTH_USER_CACHE_TIMEOUT seconds at the latest (e.g. after queryset updates, which send no signals).
+    The cache is only used when the version stamps are shared by every worker (see event.cache.versions_shared).
+    """
+
+    def get_user(self, validated_token):
+        """
+        Method to return the active user the token was issued to.
+        Input:
+            validated_token => decoded access token
+        Output:
+            user instance (a copy of the cached one, requests never share it)
+        """
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if not versions_shared():
+            #other workers could not evict their copies of a changed or deactivated user, load it every time
+            return super().get_user(validated_token)
+
+        #read before the user is loaded, a change in between makes the stored entry stale rather than wrong
+        stamp = get_versions(user_scope(user_id))[user_scope(user_id)]
+        cache = get_user_cache()
+        user = cache.get(user_id, stamp)
+        if user is None:
+            #raises for unknown and inactive users, which are never cached
+            user = super().get_user(validated_token)
+            cache.set(user_id, user, stamp)
+        return copy.copy(user)
@@ -0,0 +1,232 @@
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from event.cache import bump_versions, get_versions
+
+
+#version scope bumped whenever tokens are blacklisted, workers sharing the cache sync their filter on change
+BLACKLIST_SCOPE = 'token-blacklist'
+
+
+class BloomFilter:
+    """
+    Bloom filter of strings: no false negatives, false positives at a rate set by its size and number of hashes.
+    """
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class BlacklistFilter:
+    """
+    Process local Bloom filter of the jtis of the blacklisted refresh tokens, so that checking a token which is
+    not blacklisted (nearly every check) does not query the database. It is built on first use, tokens
+    blacklisted in this process are added right away, the ones blacklisted elsewhere are read incrementally
+    (rows blacklisted since the last sync, see refresh) when the blacklist version stamp changes or every
+    sync_interval seconds, and the filter is rebuilt every rebuild_interval seconds to drop the tokens deleted since.
+    Filters are built outside the lock and swapped in whole: the first one by the request that needs it (the
+    others check the database meanwhile), the next ones in a background thread while the current one serves.
+    """
+
+    def __init__(self, bits, hashes, sync_interval, rebuild_interval, sync_margin):
+        self.bits = bits
+        self.hashes = hashes
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.sync_margin = sync_margin
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._building = False
+        #jtis added while a filter is being built, replayed into it before the swap
+        self._added = []
+        self._since = None
+        self._stamp = None
+        self._built = self._synced = 0
+
+    def might_contain(self, jti):
+        """
+        Method to check a jti against the filter, False means the token is certainly not blacklisted.
+        """
+        self.refresh()
+        bloom = self._bloom
+        #no filter yet (another request is building it): the database is asked
+        return bloom is None or jti in bloom
+
+    def add(self, jtis):
+        """
+        Method to add the jtis of tokens just blacklisted in this process.
+        """
+        with self._lock:
+            if self._bloom is not None:
+                for jti in jtis:
+                    self._bloom.add(jti)
+            if self._building:
+                self._added.extend(jtis)
+
+    def refresh(self):
+        """
+        Method to build, sync or rebuild the filter when it is due.
+        """
+        #read before the rows, a token blacklisted in between triggers another sync
+        stamp = get_versions(BLACKLIST_SCOPE)[BLACKLIST_SCOPE]
+        now = time.monotonic()
+        with self._lock:
+            first = self._bloom is None
+            build = not self._building and (first or now - self._built >= self.rebuild_interval)
+            sync = not first and (stamp != self._stamp or now - self._synced >= self.sync_interval)
+            if build:
+                self._building = True
+                self._added = []
+            if sync:
+                #blacklisted_at is set before the row commits, a row may become visible after the sync that
+                #followed its timestamp: rows are read from sync_margin seconds (the longest transaction
+                #blacklisting tokens) before the previous sync started
+                since = self._since - timedelta(seconds=self.sync_margin)
+                self._stamp, self._synced = stamp, now
+                started = timezone.now()
+        if build and first:
+            self._rebuild(stamp)
+        elif build:
+            threading.Thread(target=self._rebuild_in_background, args=(stamp,), daemon=True).start()
+        if sync:
+            self.add(list(self._read(BlacklistedToken.objects.filter(blacklisted_at__gte=since))))
+            with self._lock:
+                self._since = max(self._since, started)
+
+    def _rebuild(self, stamp):
+        try:
+            started = timezone.now()
+            bloom = BloomFilter(self.bits, self.hashes)
+            for jti in self._read(BlacklistedToken.objects.all()):
+                bloom.add(jti)
+            with self._lock:
+                for jti in self._added:
+                    bloom.add(jti)
+                if self._bloom is None:
+                    self._stamp, self._synced = stamp, time.monotonic()
+                #the rows committed after the read are found by the next sync, from before the read started
+                self._bloom = bloom
+                self._since = started
+                self._built = time.monotonic()
+        finally:
+            with self._lock:
+                self._building = False
+                self._added = []
+
+    def _rebuild_in_background(self, stamp):
+        try:
+            self._rebuild(stamp)
+        finally:
+            connection.close()
+
+    def _read(self, queryset):
+        return queryset.values_list('token__jti', flat=True).iterator()
+
+
+_filter = (None, None)
+_filter_lock = threading.Lock()
+
+
+def get_blacklist_filter():
+    """
+    Method to return the blacklist filter of this process, configured from settings (AUTH_BLACKLIST_FILTER_*).
+    Output:
+        BlacklistFilter instance
+    """
+    global _filter
+    config = (getattr(settings, 'AUTH_BLACKLIST_FILTER_BITS', 1 << 23),
+              getattr(settings, 'AUTH_BLACKLIST_FILTER_HASHES', 7),
+              getattr(settings, 'AUTH_BLACKLIST_FILTER_SYNC_INTERVAL', 5),
+              getattr(settings, 'AUTH_BLACKLIST_FILTER_REBUILD_INTERVAL', 3600),
+              getattr(settings, 'AUTH_BLACKLIST_FILTER_SYNC_MARGIN', 60))
+    with _filter_lock:
+        if _filter[0] != config:
+            _filter = (config, BlacklistFilter(*config))
+        return _filter[1]
+
+
+def tokens_blacklisted(jtis):
+    """
+    Method to publish newly blacklisted tokens: they are added to the filter of this process and the other
+    processes are told to sync theirs. Blacklisting through the ORM does it via signals, bulk inserts
+    must call it themselves.
+    Input:
+        jtis => iterable of token ids
+    Output:
+        None
+    """
+    get_blacklist_filter().add(jtis)
+    bump_versions(BLACKLIST_SCOPE)
+
+
+def blacklist_user_tokens(user):
+    """
+    Method to blacklist every refresh token of a user that has not expired yet, with one select and one
+    insert ignoring the tokens already blacklisted.
+    Input:
+        user => user logging out everywhere
+    Output:
+        number of tokens of the user (blacklisted now or before)
+    """
+    tokens = list(OutstandingToken.objects.filter(user=user, expires_at__gt=timezone.now()).values_list('pk', 'jti'))
+    BlacklistedToken.objects.bulk_create([BlacklistedToken(token_id=pk) for pk, _ in tokens], ignore_conflicts=True)
+    #bulk inserts send no signals
+    tokens_blacklisted([jti for _, jti in tokens])
+    return len(tokens)
+
+
+def compact_tokens(batch_size, pause=0):
+    """
+    Method to delete the expired outstanding tokens and their blacklist entries (expired tokens are rejected
+    anyway), oldest first in batches of batch_size rows, each in its own short transaction.
+    Input:
+        batch_size => tokens deleted per transaction
+        pause => seconds to sleep between batches
+    Output:
+        number of outstanding tokens deleted
+    """
+    now = timezone.now()
+    deleted = 0
+    while True:
+        pks = list(OutstandingToken.objects.filter(expires_at__lte=now).order_by('expires_at')
+                   .values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        with transaction.atomic():
+            BlacklistedToken.objects.filter(token_id__in=pks).delete()
+            OutstandingToken.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+        if pause:
+            time.sleep(pause)
+
+
+class FilteredRefreshToken(RefreshToken):
+    """
+    Refresh token checked against the blacklist filter first, the database is only asked about the tokens
+    the filter reports as possibly blacklisted.
+    """
+
+    def check_blacklist(self):
+        if get_blacklist_filter().might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
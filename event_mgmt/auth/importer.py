@@ -0,0 +1,163 @@
+import codecs
+import csv
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from .serializers import UserImportSerializer
+
+
+IMPORT_FIELDS = ('username', 'email', 'password', 'first_name', 'last_name')
+
+
+def read_rows(stream, format):
+    """
+    Method to read the users of an import file one at a time.
+    Input:
+        stream => binary file object
+        format => 'csv' (with a header line) or 'ndjson' (one JSON object per line)
+    Output:
+        generator of (line number, row dictionary or None when the line cannot be parsed)
+    """
+    lines = codecs.getreader('utf-8-sig')(stream)
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'ndjson':
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError('Unknown import format %r' % format)
+
+
+def guess_format(name):
+    """
+    Method to tell the format of an import file from its name, None if it cannot be told.
+    """
+    extension = os.path.splitext(name or '')[1].lower()
+    return {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}.get(extension)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class UserImporter:
+    """
+    Imports users in bulk: rows are validated one chunk at a time, usernames / emails taken are looked up
+    once per chunk, the passwords are hashed on a process pool (so import time scales with the number
+    of cores) and every chunk is inserted with a single bulk_create in its own transaction.
+    """
+
+    def __init__(self, workers=None, chunk_size=None, progress=None, start_method=None):
+        self.workers = workers or os.cpu_count() or 1
+        #"spawn" starts the pool from a clean interpreter, needed when the caller runs threads (web workers)
+        self.start_method = start_method
+        self.chunk_size = chunk_size or getattr(settings, 'AUTH_USER_IMPORT_CHUNK', 1000)
+        self.progress = progress
+        self.created = 0
+        self.errors = []
+        #usernames / lowercased emails of the lines accepted so far, later lines cannot reuse them
+        self.accepted = {'username': set(), 'email': set()}
+
+    def run(self, rows):
+        """
+        Method to import users.
+        Input:
+            rows => iterable of (line number, row dictionary) such as read_rows() returns
+        Output:
+            dictionary with the number of users created and the errors of the rejected lines
+        """
+        context = multiprocessing.get_context(self.start_method) if self.start_method else None
+        #spawned processes do not inherit the loaded apps, django.setup loads them (forked ones already have them,
+        #loading them again is a no op). It cannot be a function of this module, which needs the apps to import
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=django.setup) as pool:
+            for chunk in _chunks(rows, self.chunk_size):
+                valid = self.validate(chunk)
+                passwords = pool.map(make_password, [row['password'] for _, row in valid],
+                                     chunksize=max(1, len(valid) // (self.workers * 4)))
+                users = [User(password=password, **{field: row[field] for field in IMPORT_FIELDS if field != 'password'})
+                         for (_, row), password in zip(valid, passwords)]
+                self.insert(valid, users)
+                if self.progress is not None:
+                    self.progress(self.created, len(self.errors))
+        return {"created": self.created, "errors": self.errors}
+
+    def validate(self, chunk):
+        """
+        Method to validate the rows of a chunk, recording the errors of the invalid ones.
+        Input:
+            chunk => list of (line number, row dictionary)
+        Output:
+            list of (line number, validated row)
+        """
+        valid = []
+        for line, row in chunk:
+            serializer = UserImportSerializer(data=row) if row is not None else None
+            if serializer is None or not serializer.is_valid():
+                self.errors.append({"line": line, "errors": serializer.errors if serializer else "Invalid line"})
+            else:
+                valid.append((line, serializer.validated_data))
+
+        taken = {
+            'username': set(User.objects.filter(username__in={row['username'] for _, row in valid})
+                            .values_list('username', flat=True)),
+            #emails are unique ignoring case, looked up on the lower(email) index
+            'email': set(User.objects.annotate(email_lower=Lower('email'))
+                         .filter(email_lower__in={row['email'].lower() for _, row in valid})
+                         .exclude(email='')
+                         .values_list('email_lower', flat=True)),
+        }
+
+        accepted = []
+        for line, row in valid:
+            keys = {'username': row['username'], 'email': row['email'].lower()}
+            duplicates = [field for field in ('username', 'email')
+                          if keys[field] in taken[field] or keys[field] in self.accepted[field]]
+            if duplicates:
+                self.errors.append({"line": line, "errors": {field: ["A user with that %s already exists." % field]
+                                                             for field in duplicates}})
+                continue
+            for field in ('username', 'email'):
+                self.accepted[field].add(keys[field])
+            accepted.append((line, row))
+        return accepted
+
+    def insert(self, valid, users):
+        """
+        Method to insert the users of a chunk. When another registration raced with the chunk the users are
+        inserted one at a time instead, so that only the conflicting lines are rejected.
+        """
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+            self.created += len(users)
+        except IntegrityError:
+            for (line, _), user in zip(valid, users):
+                #bulk_create may have set primary keys before the rollback
+                user.pk, user._state.adding = None, True
+                try:
+                    with transaction.atomic():
+                        user.save()
+                    self.created += 1
+                except IntegrityError:
+                    self.errors.append({"line": line, "errors": "A user with that username or email already exists."})
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from auth.blacklist import compact_tokens
+
+
+class Command(BaseCommand):
+    """
+    Command to delete expired refresh tokens from the outstanding / blacklisted token tables. Meant to be run
+    daily (e.g. from cron), it deletes in short batches so it never holds locks for long.
+    """
+    help = 'Deletes expired outstanding and blacklisted tokens in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'AUTH_TOKEN_COMPACT_BATCH', 1000),
+                            help='tokens deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        deleted = compact_tokens(options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS('Deleted %d expired token(s)' % deleted))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from auth.importer import UserImporter, guess_format, read_rows
+
+
+class Command(BaseCommand):
+    """
+    Command to create users in bulk from a CSV (with a header line) or NDJSON file with username, email,
+    password, first_name and last_name per user. Passwords are hashed on a process pool.
+    """
+    help = 'Imports users from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='file to import')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='told from the file extension by default')
+        parser.add_argument('--workers', type=int, help='password hashing processes, one per core by default')
+        parser.add_argument('--chunk-size', type=int, help='users validated and inserted at a time')
+
+    def handle(self, *args, **options):
+        format = options['format'] or guess_format(options['path'])
+        if format is None:
+            raise CommandError('Cannot tell the format of %s, use --format' % options['path'])
+
+        def progress(created, rejected):
+            self.stdout.write('%d user(s) created, %d line(s) rejected' % (created, rejected))
+
+        importer = UserImporter(options['workers'], options['chunk_size'], progress)
+        with open(options['path'], 'rb') as stream:
+            result = importer.run(read_rows(stream, format))
+
+        for error in result['errors']:
+            self.stderr.write('line %d: %s' % (error['line'], error['errors']))
+        self.stdout.write(self.style.SUCCESS('Imported %d user(s), %d line(s) rejected' % (
+            result['created'], len(result['errors']))))
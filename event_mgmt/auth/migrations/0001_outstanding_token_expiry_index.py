@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        #compact_tokens walks the expired tokens oldest first, simplejwt only indexes jti and user
+        migrations.RunSQL(
+            'CREATE INDEX user_auth_outstandingtoken_expires_idx ON token_blacklist_outstandingtoken (expires_at)',
+            'DROP INDEX user_auth_outstandingtoken_expires_idx',
+        ),
+    ]
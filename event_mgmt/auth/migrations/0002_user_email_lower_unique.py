@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('user_auth', '0001_outstanding_token_expiry_index'),
+    ]
+
+    operations = [
+        #emails are unique ignoring case, registration and profile updates look them up on lower(email)
+        #users without an email (e.g. created by createsuperuser) are left out
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX user_auth_user_email_lower_uniq ON auth_user (LOWER(email)) WHERE email <> ''",
+            'DROP INDEX user_auth_user_email_lower_uniq',
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_auth', '0002_user_email_lower_unique'),
+    ]
+
+    operations = [
+        #the blacklist filters read the tokens blacklisted since their last sync, simplejwt does not index blacklisted_at
+        migrations.RunSQL(
+            'CREATE INDEX user_auth_blacklistedtoken_at_idx ON token_blacklist_blacklistedtoken (blacklisted_at)',
+            'DROP INDEX user_auth_blacklistedtoken_at_idx',
+        ),
+    ]
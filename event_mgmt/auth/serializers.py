@@ -1,7 +1,26 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from rest_framework.validators import UniqueValidator
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.contrib.auth.password_validation import validate_password
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from .blacklist import FilteredRefreshToken
+
+
+def users_with_email(email, exclude=None):
+    """
+    Method to look up the users having an email, compared case insensitively on lower(email) so that the
+    lookup uses the unique index of auth/migrations/0002_user_email_lower_unique.
+    Input:
+        email ==> email to look up
+        exclude ==> primary key of a user to leave out (the one being updated)
+    Output:
+        queryset of users
+    """
+    #the index leaves out empty emails, the query has to as well for the planner to use it
+    users = User.objects.annotate(email_lower=Lower('email')).filter(email_lower=email.lower()).exclude(email='')
+    return users.exclude(pk=exclude) if exclude is not None else users
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -9,11 +28,8 @@ class RegisterSerializer(serializers.ModelSerializer):
     Serializer class for registering users
     
     """
-    #make sure email is a valid field and unique
-    email = serializers.EmailField(
-            required=True,
-            validators=[UniqueValidator(queryset=User.objects.all())]
-            )
+    #make sure email is a valid field, unique (ignoring case) is checked by validate_email
+    email = serializers.EmailField(required=True)
 
     #validates the password against the django password requirements
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
@@ -40,25 +56,58 @@ class RegisterSerializer(serializers.ModelSerializer):
 
         return attrs
 
+    def validate_email(self, value):
+        """
+        Method to validate that no user already has the email, whatever its case.
+        Input:
+            value ==> email entered by user
+        Output:
+            same as input if no validation error else validation error
+        """
+        if users_with_email(value).exists():
+            raise serializers.ValidationError("This field must be unique.")
+        return value
+
     def create(self, validated_data):
         """
-        Method to create the user.
+        Method to create the user (one insert, the password is hashed before).
         Input:
             validated_data ==> input data that meets the necessary validations.
         Output:
             user object (new user that just got created)
         """
-        user = User.objects.create(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            first_name=validated_data['first_name'],
-            last_name=validated_data['last_name']
-        )
-
-        user.set_password(validated_data['password'])
-        user.save()
+        try:
+            #a concurrent registration with the same username / email is rejected by the unique indexes
+            with transaction.atomic():
+                return User.objects.create_user(
+                    username=validated_data['username'],
+                    email=validated_data['email'],
+                    password=validated_data['password'],
+                    first_name=validated_data['first_name'],
+                    last_name=validated_data['last_name']
+                )
+        except IntegrityError:
+            if users_with_email(validated_data['email']).exists():
+                raise serializers.ValidationError({"email": ["This field must be unique."]})
+            raise serializers.ValidationError({"username": ["A user with that username already exists."]})
+
+
+class UserImportSerializer(serializers.ModelSerializer):
+    """
+    Serializer class validating one user of a bulk import. Usernames / emails already taken are looked up
+    for a whole chunk of users at once by auth.importer, not per user.
+    """
+    email = serializers.EmailField(required=True)
+    password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
 
-        return user
+    class Meta:
+        model = User
+        fields = ('username', 'email', 'password', 'first_name', 'last_name')
+        extra_kwargs = {
+            'username': {'validators': [UnicodeUsernameValidator()]},
+            'first_name': {'required': True},
+            'last_name': {'required': True}
+        }
 
 
 class ChangePasswordSerializer(serializers.ModelSerializer):
@@ -143,7 +192,8 @@ class UpdateUserSerializer(serializers.ModelSerializer):
             same as input if no validation error else validation error
         """
         user = self.context['request'].user
-        if User.objects.exclude(pk=user.pk).filter(email=value).exists():
+        #emails are unique ignoring case
+        if users_with_email(value, exclude=user.pk).exists():
             raise serializers.ValidationError({"email": "This email is already in use."})
         return value
 
@@ -180,6 +230,21 @@ class UpdateUserSerializer(serializers.ModelSerializer):
         instance.email = validated_data['email']
         instance.username = validated_data['username']
 
-        instance.save()
+        try:
+            #another user taking the username / email meanwhile is rejected by the unique indexes
+            with transaction.atomic():
+                instance.save()
+        except IntegrityError:
+            if users_with_email(instance.email, exclude=instance.pk).exists():
+                raise serializers.ValidationError({"email": "This email is already in use."})
+            raise serializers.ValidationError({"username": "This username is already in use."})
 
         return instance
+
+
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Serializer to refresh an access token, the refresh token is checked against the blacklist filter
+    before the database.
+    """
+    token_class = FilteredRefreshToken
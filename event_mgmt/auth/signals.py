@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from event.cache import bump_versions
+from .authentication import get_user_cache, user_scope
+from .blacklist import tokens_blacklisted
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    """
+    Evicts a saved / deleted user (profile or password change, deactivation) from the user cache of the
+    authentication, in this process right away and in the others through the version stamp of the user
+    """
+    get_user_cache().evict(instance.pk)
+    bump_versions(user_scope(instance.pk))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def publish_blacklisted_token(sender, instance, created, **kwargs):
+    """
+    Adds a newly blacklisted refresh token to the blacklist filters (see auth/blacklist.py)
+    """
+    if created:
+        tokens_blacklisted([instance.token.jti])
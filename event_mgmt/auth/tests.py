@@ -1,15 +1,48 @@
+import datetime
 import json
-
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
 
-from .views import LogoutView, ChangePasswordView, UpdateProfileView
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from event.cache import get_version_cache
+from event.throttling import get_throttle_store
+from .authentication import CachedJWTAuthentication, UserCache, get_user_cache
+from .blacklist import BlacklistFilter, BloomFilter, FilteredRefreshToken
+from .serializers import RegisterSerializer
+from . import views as auth_views
+from .views import LogoutView, LogoutAllView, ChangePasswordView, UpdateProfileView, ImportUsersView
+
+#throttle buckets of the tests, clearing them must not refill the buckets of a server running on the host
+THROTTLE_FILE = os.path.join(tempfile.mkdtemp(), "throttle.bin")
+
 
+@override_settings(EVENT_THROTTLE_FILE=THROTTLE_FILE)
 class RegisterViewAPITestCase(APITestCase):
     url = reverse("auth_register")
 
+    def setUp(self):
+        #start with full throttle buckets
+        get_throttle_store().clear()
+
     def test_password_confirmpassword_different(self):
         """
         Test to verify that a register user fails if password and confirm are different
@@ -114,10 +147,42 @@ class RegisterViewAPITestCase(APITestCase):
        
         self.assertEqual(400, response.status_code)
         self.assertEqual("This field must be unique.", response_content['email'][0])
+
+    def test_email_uniqueness_ignores_case(self):
+        """
+        Test to verify that an email differing only by case from a registered one is rejected, by the check
+        and by the unique index when another registration takes it in between
+        """
+        User.objects.create_user("testuser", "TestUser@Test.com", "test123@")
+        user_data = {
+            "username":"testuser1",
+            "email":"testuser@test.COM",
+            "first_name":"test1",
+            "last_name":"user",
+            "password":"test123@",
+            "confirmpassword":"test123@"
+        }
+        response = self.client.post(self.url, user_data)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual("This field must be unique.", json.loads(response.content.decode())['email'][0])
+
+        serializer = RegisterSerializer(data=dict(user_data, email="other@test.com"))
+        self.assertTrue(serializer.is_valid())
+        User.objects.create_user("testuser2", "OTHER@test.com", "test123@")
+        with self.assertRaises(ValidationError) as raised:
+            serializer.save()
+        self.assertIn("email", raised.exception.detail)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user("testuser3", "Other@Test.com", "test123@")
+        #users without an email are not concerned
+        User.objects.create_user("noemail1", "", "test123@")
+        User.objects.create_user("noemail2", "", "test123@")
     
+@override_settings(EVENT_THROTTLE_FILE=THROTTLE_FILE)
 class LoginAPIViewTestCase(APITestCase):
     url = reverse("token_obtain_pair")
     def setUp(self):
+        get_throttle_store().clear()
         self.username = "tester"
         self.password = "tester123@"
         self.first_name = "test"
@@ -151,9 +216,23 @@ class LoginAPIViewTestCase(APITestCase):
         self.assertTrue("access" in response_content)
         self.assertTrue("refresh" in response_content)
 
+    def test_login_is_throttled_per_ip(self):
+        """
+        Test to verify that logins from one IP get 429 once the token bucket of the IP is empty
+        """
+        with self.settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={"auth.ip": "2/min"})):
+            statuses = [self.client.post(self.url, {"username": self.username, "password": "I_know"}).status_code
+                        for _ in range(3)]
+            self.assertEqual([401, 401, 429], statuses)
+            response = self.client.post(self.url, {"username": self.username, "password": self.password})
+            self.assertEqual(429, response.status_code)
+            self.assertTrue(int(response["Retry-After"]) > 0)
+
+@override_settings(EVENT_THROTTLE_FILE=THROTTLE_FILE)
 class LogoutAPIViewTestCase(APITestCase):
     url = reverse("auth_logout")
     def setUp(self):
+        get_throttle_store().clear()
         self.username = "tester"
         self.password = "tester123@"
         self.first_name = "test"
@@ -193,10 +272,127 @@ class LogoutAPIViewTestCase(APITestCase):
         
         self.assertEqual(205, response.status_code)
 
+    def test_refresh_checks_blacklist_filter_before_database(self):
+        """
+        Test to verify that refreshing with a valid token does not query the blacklist, and that a token
+        blacklisted by logout is rejected here and reaches the filters of other processes
+        """
+        response = self.client.post(reverse("token_obtain_pair"), {"username": self.username, "password": self.password})
+        refresh = json.loads(response.content.decode())["refresh"]
+        other_process = BlacklistFilter(1 << 16, 7, 3600, 3600, 60)
+        other_process.refresh()
+
+        self.assertEqual(200, self.client.post(reverse("token_refresh"), {"refresh": refresh}).status_code)
+        with self.assertNumQueries(0):
+            self.assertEqual(200, self.client.post(reverse("token_refresh"), {"refresh": refresh}).status_code)
+
+        request = self.factory.post(self.url, data={"refresh_token": refresh})
+        force_authenticate(request, user=self.user)
+        self.assertEqual(205, LogoutView.as_view()(request).status_code)
+
+        self.assertEqual(401, self.client.post(reverse("token_refresh"), {"refresh": refresh}).status_code)
+        self.assertTrue(other_process.might_contain(FilteredRefreshToken(refresh, verify=False)["jti"]))
 
+    def test_filter_sync_reads_tokens_committed_late(self):
+        """
+        Test to verify that a sync finds tokens whose blacklisting committed after the previous sync, whatever their
+        ids (a large transaction may commit low ids after many higher ones are visible)
+        """
+        tokens = OutstandingToken.objects.bulk_create([OutstandingToken(jti="token%d" % i, token="", expires_at=timezone.now())
+                                                       for i in range(1201)])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(pk=10000 + i, token=token) for i, token in enumerate(tokens[1:])])
+        blacklist_filter = BlacklistFilter(1 << 16, 7, 0, 3600, 60)
+        blacklist_filter.refresh()
+        self.assertFalse(blacklist_filter.might_contain("token0"))
+
+        #stamped before the previous sync, visible only now
+        BlacklistedToken.objects.create(pk=5, token=tokens[0])
+        BlacklistedToken.objects.filter(pk=5).update(blacklisted_at=timezone.now() - datetime.timedelta(seconds=30))
+        self.assertTrue(blacklist_filter.might_contain("token0"))
+
+    def test_filter_is_rebuilt_outside_the_lock(self):
+        """
+        Test to verify that the periodic rebuild reads the tokens in the background while the current filter
+        keeps answering, and that tokens blacklisted meanwhile are in the filter swapped in
+        """
+        blacklist_filter = BlacklistFilter(1 << 16, 7, 3600, 3600, 60)
+        with mock.patch.object(BlacklistFilter, "_read", return_value=iter(["token0"])):
+            blacklist_filter.refresh()
+        blacklist_filter._built -= 3600
+        reading, release = threading.Event(), threading.Event()
+
+        def slow_read(queryset):
+            reading.set()
+            release.wait(10)
+            return iter(["token1"])
+
+        with mock.patch.object(BlacklistFilter, "_read", side_effect=slow_read):
+            self.assertTrue(blacklist_filter.might_contain("token0"))
+            self.assertTrue(reading.wait(10))
+            self.assertTrue(blacklist_filter._lock.acquire(blocking=False))
+            blacklist_filter._lock.release()
+            self.assertTrue(blacklist_filter.might_contain("token0"))
+            blacklist_filter.add(["token2"])
+            release.set()
+            for _ in range(1000):
+                if not blacklist_filter._building:
+                    break
+                time.sleep(0.01)
+
+        self.assertFalse(blacklist_filter.might_contain("token0"))
+        self.assertTrue(blacklist_filter.might_contain("token1"))
+        self.assertTrue(blacklist_filter.might_contain("token2"))
+
+    def test_logout_all_blacklists_every_token_in_one_insert(self):
+        """
+        Test to verify that logging out everywhere blacklists all the live tokens of the user with a fixed number of queries
+        """
+        tokens = [FilteredRefreshToken.for_user(self.user) for _ in range(20)]
+        tokens[0].blacklist()
+        other = FilteredRefreshToken.for_user(User.objects.create_user("other", "", self.password))
+
+        request = self.factory.post(reverse("auth_logout_all"))
+        force_authenticate(request, user=self.user)
+        with self.assertNumQueries(2):
+            self.assertEqual(205, LogoutAllView.as_view()(request).status_code)
+
+        self.assertEqual(20, BlacklistedToken.objects.filter(token__user=self.user).count())
+        self.assertEqual(401, self.client.post(reverse("token_refresh"), {"refresh": str(tokens[5])}).status_code)
+        self.assertEqual(200, self.client.post(reverse("token_refresh"), {"refresh": str(other)}).status_code)
+
+    def test_compact_tokens_deletes_expired_tokens_in_batches(self):
+        """
+        Test to verify that the compaction job deletes expired outstanding and blacklisted tokens only
+        """
+        tokens = [FilteredRefreshToken.for_user(self.user) for _ in range(10)]
+        for token in tokens[:4]:
+            token.blacklist()
+        expired = [token["jti"] for token in tokens[2:9]]
+        OutstandingToken.objects.filter(jti__in=expired).update(expires_at=timezone.now() - datetime.timedelta(days=1))
+
+        out = StringIO()
+        call_command("compact_tokens", "--batch-size", "3", stdout=out)
+        self.assertIn("Deleted 7 expired token(s)", out.getvalue())
+        self.assertEqual({tokens[0]["jti"], tokens[1]["jti"], tokens[9]["jti"]},
+                         set(OutstandingToken.objects.values_list("jti", flat=True)))
+        self.assertEqual(2, BlacklistedToken.objects.count())
+
+    def test_bloom_filter_has_few_false_positives(self):
+        """
+        Test to verify that the Bloom filter finds every added value and rarely reports others
+        """
+        bloom = BloomFilter(1 << 16, 7)
+        for i in range(5000):
+            bloom.add("added%d" % i)
+        self.assertTrue(all("added%d" % i in bloom for i in range(5000)))
+        self.assertLess(sum("other%d" % i in bloom for i in range(10000)), 100)
+
+
+@override_settings(EVENT_THROTTLE_FILE=THROTTLE_FILE)
 class ChangePasswordViewAPITestCase(APITestCase):
     
     def setUp(self):
+        get_throttle_store().clear()
         self.username = "tester"
         self.password = "tester123@"
         self.first_name = "test"
@@ -277,9 +473,11 @@ class ChangePasswordViewAPITestCase(APITestCase):
         
         self.assertEqual(200, response.status_code)
 
+@override_settings(EVENT_THROTTLE_FILE=THROTTLE_FILE)
 class UpdateProfileViewAPITestCase(APITestCase):
     
     def setUp(self):
+        get_throttle_store().clear()
         self.username = "tester"
         self.password = "tester123@"
         self.first_name = "test"
@@ -315,6 +513,31 @@ class UpdateProfileViewAPITestCase(APITestCase):
         force_authenticate(request, user=self.user, token=contents["access"])
 
         
+        view = UpdateProfileView.as_view()
+        response = view(request, pk=self.user.pk)
+        
+        self.assertEqual(400, response.status_code)
+
+    def test_update_profile_with_existing_email_in_another_case(self):
+        """
+        Test to verify that update profile fails if new email already exists in database in another case
+        """
+
+
+        user_data = {
+            "username":"user101",
+            "email":self.dummyemail.upper(),
+            "first_name":"yatharth",
+            "last_name":"sant"
+        }
+        
+        response = self.client.post(reverse("token_obtain_pair"), {"username": self.username, "password": self.password})
+        contents = json.loads(response.content.decode())
+        
+        request = self.factory.put(self.url, data=user_data)
+        force_authenticate(request, user=self.user, token=contents["access"])
+
+        
         view = UpdateProfileView.as_view()
         response = view(request, pk=self.user.pk)
         
@@ -370,4 +593,162 @@ class UpdateProfileViewAPITestCase(APITestCase):
         
         self.assertEqual(200, response.status_code)
     
-    
\ No newline at end of file
+    
+@override_settings(EVENT_THROTTLE_FILE=THROTTLE_FILE)
+class CachedJWTAuthenticationTestCase(APITestCase):
+
+    def setUp(self):
+        get_throttle_store().clear()
+        get_user_cache().clear()
+        self.username = "tester"
+        self.password = "tester123@"
+        self.user = User.objects.create_user(self.username, "test@test.com", self.password)
+        response = self.client.post(reverse("token_obtain_pair"), {"username": self.username, "password": self.password})
+        self.access = json.loads(response.content.decode())["access"]
+        self.factory = APIRequestFactory()
+
+    def authenticate(self):
+        request = self.factory.get("/event/", HTTP_AUTHORIZATION="Bearer " + self.access)
+        return CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_users_are_resolved_from_cache(self):
+        """
+        Test to verify that only the first authentication of a user queries the database
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(self.user.pk, self.authenticate().pk)
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual(self.username, user.username)
+        #requests get their own copy
+        self.assertIsNot(user, self.authenticate())
+
+    def test_profile_update_and_deactivation_evict_the_user(self):
+        """
+        Test to verify that the cached user is reloaded after a profile update and rejected once deactivated
+        """
+        self.authenticate()
+        request = self.factory.put(reverse("auth_update_profile", kwargs={"pk": self.user.pk}),
+                                   {"username": "renamed", "email": "renamed@test.com", "first_name": "re", "last_name": "named"},
+                                   HTTP_AUTHORIZATION="Bearer " + self.access)
+        self.assertEqual(200, UpdateProfileView.as_view()(request, pk=self.user.pk).status_code)
+        self.assertEqual("renamed", self.authenticate().username)
+
+        self.user.refresh_from_db()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_users_are_loaded_every_time_without_shared_stamps(self):
+        """
+        Test to verify that users are not cached while the version stamps are local to the process (another worker
+        could not evict them), and that with shared stamps a lost stamp reloads the user
+        """
+        with override_settings(EVENT_VERSIONS_SHARED=False):
+            self.authenticate()
+            with self.assertNumQueries(1):
+                self.authenticate()
+            #deactivated through another worker, rejected at once
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate()
+            User.objects.filter(pk=self.user.pk).update(is_active=True)
+
+        self.authenticate()
+        with self.assertNumQueries(0):
+            self.authenticate()
+        get_version_cache().delete("version:user:%s" % self.user.pk)
+        with self.assertNumQueries(1):
+            self.authenticate()
+
+    def test_cache_is_bounded(self):
+        """
+        Test to verify that the least recently used users are evicted beyond the size of the cache
+        """
+        cache = UserCache(size=2, timeout=60)
+        for pk in (1, 2, 3):
+            cache.set(pk, "user%d" % pk, "stamp")
+        self.assertEqual([None, "user2", "user3"], [cache.get(pk, "stamp") for pk in (1, 2, 3)])
+        self.assertIsNone(cache.get(2, "another stamp"))
+
+@override_settings(EVENT_THROTTLE_FILE=THROTTLE_FILE)
+class ImportUsersTestCase(APITestCase):
+
+    def setUp(self):
+        get_throttle_store().clear()
+        self.password = "Imp0rted-pass"
+        self.admin = User.objects.create_superuser("admin", "admin@test.com", self.password)
+        self.factory = APIRequestFactory()
+
+    def row(self, username, email=None):
+        return {"username": username, "email": email or "%s@test.com" % username, "password": self.password,
+                "first_name": "first", "last_name": "last"}
+
+    def test_import_users_from_ndjson(self):
+        """
+        Test to verify that the import command creates the valid users of a file and reports the rejected lines
+        """
+        lines = [json.dumps(self.row("user1")), json.dumps(self.row("user2")), "not json",
+                 json.dumps(self.row("user3", "invalid")), json.dumps(self.row("admin", "new@test.com")),
+                 json.dumps(self.row("user1", "other@test.com")), json.dumps(self.row("user5", "ADMIN@test.com")),
+                 json.dumps(self.row("user6", "User2@Test.com")), json.dumps(self.row("user4"))]
+        path = os.path.join(tempfile.mkdtemp(), "users.ndjson")
+        with open(path, "w") as stream:
+            stream.write("\n".join(lines))
+
+        out, err = StringIO(), StringIO()
+        call_command("import_users", path, "--workers", "2", "--chunk-size", "3", stdout=out, stderr=err)
+        self.assertIn("Imported 3 user(s), 6 line(s) rejected", out.getvalue())
+        self.assertEqual(["line 3", "line 4", "line 5", "line 6", "line 7", "line 8"], [line.split(":")[0] for line in err.getvalue().splitlines()])
+        users = User.objects.filter(username__startswith="user").order_by("username")
+        self.assertEqual(["user1", "user2", "user4"], [user.username for user in users])
+        self.assertTrue(all(user.check_password(self.password) for user in users))
+
+    def test_only_admin_can_import_users_from_csv(self):
+        """
+        Test to verify that admins can upload a CSV file of users and other users cannot
+        """
+        content = "username,email,password,first_name,last_name\n" + "".join(
+            "user%d,user%d@test.com,%s,first,last\n" % (i, i, self.password) for i in range(5))
+        view = ImportUsersView.as_view()
+
+        request = self.factory.post(reverse("auth_import_users"), {"file": SimpleUploadedFile("users.csv", content.encode())})
+        force_authenticate(request, user=User.objects.create_user("someone", "", self.password))
+        self.assertEqual(401, view(request).status_code)
+
+        request = self.factory.post(reverse("auth_import_users"), {"file": SimpleUploadedFile("users.csv", content.encode())})
+        force_authenticate(request, user=self.admin)
+        response = view(request)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"created": 5, "errors": []}, response.data["data"])
+        self.assertEqual(5, User.objects.filter(username__startswith="user").count())
+
+    def test_web_imports_are_bounded(self):
+        """
+        Test to verify that uploads above AUTH_USER_IMPORT_MAX_SIZE are refused and that one import runs at a time
+        """
+        content = "username,email,password,first_name,last_name\nuser0,user0@test.com,%s,first,last\n" % self.password
+        view = ImportUsersView.as_view()
+
+        with override_settings(AUTH_USER_IMPORT_MAX_SIZE=len(content) - 1):
+            request = self.factory.post(reverse("auth_import_users"), {"file": SimpleUploadedFile("users.csv", content.encode())})
+            force_authenticate(request, user=self.admin)
+            self.assertEqual(413, view(request).status_code)
+
+        with auth_views._import_lock:
+            request = self.factory.post(reverse("auth_import_users"), {"file": SimpleUploadedFile("users.csv", content.encode())})
+            force_authenticate(request, user=self.admin)
+            self.assertEqual(409, view(request).status_code)
+        self.assertFalse(User.objects.filter(username="user0").exists())
+
+    def test_registration_writes_the_user_once(self):
+        """
+        Test to verify that registering a user stores it (with its hashed password) in a single write
+        """
+        data = dict(self.row("newuser"), confirmpassword=self.password)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(201, self.client.post(reverse("auth_register"), data).status_code)
+        writes = [query["sql"] for query in queries.captured_queries if query["sql"].startswith(("INSERT", "UPDATE"))]
+        self.assertEqual(1, len(writes))
+        self.assertTrue(User.objects.get(username="newuser").check_password(self.password))
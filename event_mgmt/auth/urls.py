@@ -1,15 +1,16 @@
 from django.urls import path
-from auth.views import RegisterView, ChangePasswordView, UpdateProfileView, LogoutView, LogoutAllView
-from rest_framework_simplejwt.views import TokenRefreshView, TokenObtainPairView
+from auth.views import (LoginView, LoginRefreshView, RegisterView, ChangePasswordView, UpdateProfileView, LogoutView,
+                        LogoutAllView, ImportUsersView)
 
 
 urlpatterns = [
-    path('login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('login/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('login/', LoginView.as_view(), name='token_obtain_pair'),
+    path('login/refresh/', LoginRefreshView.as_view(), name='token_refresh'),
     path('register/', RegisterView.as_view(), name='auth_register'),
     path('change_password/<int:pk>/', ChangePasswordView.as_view(), name='auth_change_password'),
     path('update_profile/<int:pk>/', UpdateProfileView.as_view(), name='auth_update_profile'),
     path('logout/', LogoutView.as_view(), name='auth_logout'),
     path('logout_all/', LogoutAllView.as_view(), name='auth_logout_all'),
+    path('import/', ImportUsersView.as_view(), name='auth_import_users'),
 ]
 
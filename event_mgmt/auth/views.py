@@ -1,12 +1,32 @@
-from .serializers import RegisterSerializer, ChangePasswordSerializer, UpdateUserSerializer
+from .serializers import RegisterSerializer, ChangePasswordSerializer, UpdateUserSerializer, FilteredTokenRefreshSerializer
+from .blacklist import FilteredRefreshToken, blacklist_user_tokens
+from .importer import UserImporter, guess_format, read_rows
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework import generics
+import threading
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from event.throttling import AUTH_THROTTLES
+
+
+class LoginView(TokenObtainPairView):
+    """
+    View to obtain an access / refresh token pair with username and password, throttled per IP.
+    """
+    throttle_classes = AUTH_THROTTLES
+
+
+class LoginRefreshView(TokenRefreshView):
+    """
+    View to obtain a new access token with a refresh token, throttled per IP. Refresh tokens are
+    checked against the blacklist filter so that valid ones do not query the blacklist.
+    """
+    throttle_classes = AUTH_THROTTLES
+    serializer_class = FilteredTokenRefreshSerializer
 
 
 class RegisterView(generics.CreateAPIView):
@@ -15,6 +35,7 @@ class RegisterView(generics.CreateAPIView):
     """
     queryset = User.objects.all()
     permission_classes = (AllowAny,)
+    throttle_classes = AUTH_THROTTLES
     serializer_class = RegisterSerializer
 
 
@@ -24,6 +45,7 @@ class ChangePasswordView(generics.UpdateAPIView):
     """
     queryset = User.objects.all()
     permission_classes = (IsAuthenticated,)
+    throttle_classes = AUTH_THROTTLES
     serializer_class = ChangePasswordSerializer
 
 
@@ -33,6 +55,7 @@ class UpdateProfileView(generics.UpdateAPIView):
     """
     queryset = User.objects.all()
     permission_classes = (IsAuthenticated,)
+    throttle_classes = AUTH_THROTTLES
     serializer_class = UpdateUserSerializer
 
 
@@ -41,6 +64,7 @@ class LogoutView(APIView):
     View to logout the user. Only authenticated user can access this endpoint.
     """
     permission_classes = (IsAuthenticated,)
+    throttle_classes = AUTH_THROTTLES
 
     def post(self, request):
         """
@@ -52,7 +76,7 @@ class LogoutView(APIView):
         """
         try:
             refresh_token = request.data["refresh_token"]
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()
 
             return Response(status=status.HTTP_205_RESET_CONTENT)
@@ -65,17 +89,64 @@ class LogoutAllView(APIView):
     View to in validate all the tokens for the given user id. Only authenticated user can access this endpoint
     """
     permission_classes = (IsAuthenticated,)
+    throttle_classes = AUTH_THROTTLES
 
     def post(self, request):
         """
-        This method finds all the outstanding tokens for current user id and one by one blacklists them
+        This method blacklists all the outstanding tokens of the current user in one insert
         Input:
             request => incoming request object
         Output:
             HTTP status code 205
         """
-        tokens = OutstandingToken.objects.filter(user_id=request.user.id)
-        for token in tokens:
-            t, _ = BlacklistedToken.objects.get_or_create(token=token)
+        blacklist_user_tokens(request.user)
 
         return Response(status=status.HTTP_205_RESET_CONTENT)
+
+
+#one import at a time per process, the web endpoint is for small files (import_users handles large ones)
+_import_lock = threading.Lock()
+
+
+class ImportUsersView(APIView):
+    """
+    View to create users in bulk from an uploaded CSV or NDJSON file. Only superuser/admin can access this endpoint.
+    Uploads are limited to AUTH_USER_IMPORT_MAX_SIZE bytes and hashed on a pool of AUTH_USER_IMPORT_WEB_WORKERS
+    processes, larger imports are left to "python manage.py import_users".
+    """
+    permission_classes = (IsAuthenticated,)
+    throttle_classes = AUTH_THROTTLES
+
+    def post(self, request):
+        """
+        This method validates the users of the file, hashes their passwords on a process pool and inserts
+        them in chunks.
+        Input:
+            request => incoming request with "file" (username, email, password, first_name, last_name per user)
+                       and optionally "format" (csv or ndjson, told from the file name otherwise)
+        Output:
+            HTTP response with the number of users created and the errors of the rejected lines
+        """
+        #check to ensure only admin is able to import users
+        if request.user.is_superuser == False or request.user.is_staff == False:
+            return Response({"status":"error", "data":"You don't have permission to import users"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        upload = request.FILES.get("file")
+        format = request.data.get("format") or guess_format(getattr(upload, "name", None))
+        if upload is None or format not in ("csv", "ndjson"):
+            return Response({"status":"error", "data":"file must be a CSV or NDJSON upload"}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_size = getattr(settings, 'AUTH_USER_IMPORT_MAX_SIZE', 5 * 1024 * 1024)
+        if upload.size > max_size:
+            return Response({"status":"error", "data":"file is larger than %d bytes, use the import_users command" % max_size},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        if not _import_lock.acquire(blocking=False):
+            return Response({"status":"error", "data":"Another import is running, retry later"}, status=status.HTTP_409_CONFLICT)
+        try:
+            #the pool is spawned, forking a threaded server process is unsafe
+            importer = UserImporter(getattr(settings, 'AUTH_USER_IMPORT_WEB_WORKERS', 2), start_method='spawn')
+            result = importer.run(read_rows(upload, format))
+        finally:
+            _import_lock.release()
+        return Response({"status":"success", "data":result}, status=status.HTTP_200_OK)
@@ -1,18 +1,57 @@
 from email.headerregistry import Group
 from django.contrib import admin
-from .models import Event, Ticket, Image, Category
+from django.db import transaction
+from .models import Event, Ticket, Image, Category, WaitlistEntry
+from .booking import cancel_ticket, cancel_tickets, distribute_seats, promote_waitlist, sync_locked_counters
 from django.contrib.auth.models import Group
 
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'name', 'description', )
+    list_display = ('pk', 'name', 'description', 'seats', 'capacity', 'tickets_sold', )
     list_filter = ('category', )
+    #counters are maintained by bookings, seats is the number of seats left
+    readonly_fields = ('capacity', 'tickets_sold', 'seats_held', 'shard_count', )
+
+    def save_model(self, request, obj, form, change):
+        """
+        Method to save an event edited in the admin. The row is re-read under a lock so that bookings made
+        while the form was open are kept (seats left is only overwritten when it was edited).
+        """
+        if not change:
+            return super().save_model(request, obj, form, change)
+
+        with transaction.atomic():
+            locked = Event.objects.select_for_update().get(pk=obj.pk)
+            seats = sync_locked_counters(locked)
+            obj.tickets_sold, obj.seats_held = locked.tickets_sold, locked.seats_held
+            obj.shard_count = locked.shard_count
+            if 'seats' not in form.changed_data:
+                obj.seats = seats
+            super().save_model(request, obj, form, change)
+            if obj.shard_count and 'seats' in form.changed_data:
+                distribute_seats(obj, obj.shard_count, obj.seats)
+            promote_waitlist([obj.pk])
+
+@admin.register(Ticket)
+class TicketAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'event', 'user', 'created', )
+
+    def delete_model(self, request, obj):
+        #deleting a ticket cancels it, the seat goes back to the event / its waitlist
+        cancel_ticket(obj)
+
+    def delete_queryset(self, request, queryset):
+        cancel_tickets(queryset.values_list('pk', flat=True))
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'event', 'user', 'created', )
+    list_filter = ('event', )
 
 # Register your models here.
-admin.site.register(Ticket)
 admin.site.unregister(Group)
 
 admin.site.register(Image)
 admin.site.register(Category)
 
-admin.site.site_header = "Event Admin"
\ No newline at end of file
+admin.site.site_header = "Event Admin"
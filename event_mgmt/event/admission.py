@@ -0,0 +1,167 @@
+import math
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class Admission:
+    """
+    Outcome of an admission check: whether the request may go on to book, its position in the queue of
+    the event and how many seconds to wait before retrying when it may not.
+    """
+    __slots__ = ('admitted', 'position', 'retry_after')
+
+    def __init__(self, admitted, position=None, retry_after=0):
+        self.admitted = admitted
+        self.position = position
+        self.retry_after = retry_after
+
+
+def get_admission_cache():
+    """
+    Method to return the cache holding the queues of the waiting room (EVENT_ADMISSION_CACHE_ALIAS). It must
+    not evict entries before they expire, a lost counter or opening time would reorder the queue.
+    """
+    return caches[getattr(settings, 'EVENT_ADMISSION_CACHE_ALIAS', 'event_admission')]
+
+
+def _start_counter(cache, prefix, rate):
+    """
+    Method to create the position counter of a queue. A new queue starts from 0. When the counter is missing
+    while the queue is running (its opening time is still there) users may be waiting with positions up to
+    the lost value, which is unknown: the counter restarts after the last position that can still be used
+    (positions expire after EVENT_ADMISSION_POSITION_TIMEOUT), so that newcomers never get ahead of them.
+    """
+    opened = cache.get(prefix + ':opened')
+    start = 0
+    if opened is not None:
+        timeout = getattr(settings, 'EVENT_ADMISSION_POSITION_TIMEOUT', 3600)
+        start = max(0, math.ceil((time.time() + timeout - opened) * rate))
+    cache.add(prefix + ':issued', start, timeout=None)
+
+
+def _position(cache, prefix, user, rate):
+    """
+    Method to return the queue position of a user, issuing the next one on the first visit.
+    Retries of the same user keep their position instead of taking a new one.
+    Output:
+        tuple of (position, whether it was issued now)
+    """
+    user_key = '%s:user:%s' % (prefix, user.pk)
+    position = cache.get(user_key)
+    if position is not None:
+        return position, False
+
+    try:
+        position = cache.incr(prefix + ':issued')
+    except ValueError:
+        _start_counter(cache, prefix, rate)
+        position = cache.incr(prefix + ':issued')
+    cache.add(user_key, position, timeout=getattr(settings, 'EVENT_ADMISSION_POSITION_TIMEOUT', 3600))
+    issued = position
+    position = cache.get(user_key, position)
+    return position, position == issued
+
+
+def admit(user, pk):
+    """
+    Method to check whether a user may book the event specified by pk now (virtual waiting room).
+    Every user gets a queue position per event and positions are admitted at EVENT_ADMISSION_RATE per
+    second, the first EVENT_ADMISSION_BURST of a wave at once (rate limiting in the style of GCRA).
+    The queue lives in the admission cache, only atomic add / incr are used so that it can be shared by
+    every worker process, and no database query is made.
+    Input:
+        user => authenticated user
+        pk => primary key of the event
+    Output:
+        Admission instance
+    """
+    rate = float(getattr(settings, 'EVENT_ADMISSION_RATE', 0))
+    if rate <= 0:
+        return Admission(True)
+    burst = max(1, getattr(settings, 'EVENT_ADMISSION_BURST', 1))
+
+    cache = get_admission_cache()
+    prefix = 'admission:%s' % pk
+    position, issued = _position(cache, prefix, user, rate)
+    now = time.time()
+
+    #position p is due at opened + p / rate
+    cache.add(prefix + ':opened', now - (position - 1) / rate, timeout=None)
+    opened = cache.get(prefix + ':opened', now - (position - 1) / rate)
+    due = opened + position / rate
+    if issued and due < now + 1 / rate:
+        #the queue has drained, admissions left unused while it was idle are not saved up beyond the burst
+        opened = now - (position - 1) / rate
+        cache.set(prefix + ':opened', opened, timeout=None)
+        due = now + 1 / rate
+
+    wait = due - now - burst / rate
+    if wait <= 0:
+        return Admission(True, position)
+    return Admission(False, position, max(1, math.ceil(wait)))
+
+
+_slots = (None, None)
+_slots_lock = threading.Lock()
+
+
+def get_booking_slots():
+    """
+    Method to return the semaphore limiting the bookings running at the same time in this process
+    (EVENT_ADMISSION_CONCURRENCY), so that a spike of bookings cannot take every database connection.
+    Output:
+        threading.BoundedSemaphore, or None when the limit is turned off
+    """
+    global _slots
+    size = getattr(settings, 'EVENT_ADMISSION_CONCURRENCY', 0)
+    with _slots_lock:
+        if _slots[0] != size:
+            _slots = (size, threading.BoundedSemaphore(size) if size > 0 else None)
+        return _slots[1]
+
+
+def _retry_later(data, retry_after):
+    response = Response({"status":"error", "data":data}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def admission_control(methods=('GET', 'POST')):
+    """
+    Decorator putting a booking view (taking the pk of an event) behind the waiting room of the event.
+    Requests that are not admitted yet, or that find every booking slot of the process busy, are answered
+    at once with 429 and a Retry-After header instead of queueing up on the database.
+    Input:
+        methods => HTTP methods of the view that take seats
+    Output:
+        decorator
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, pk, *args, **kwargs):
+            #anonymous requests are turned away by the view itself
+            if request.method not in methods or request.user.is_authenticated == False:
+                return view(request, pk, *args, **kwargs)
+
+            admission = admit(request.user, pk)
+            if not admission.admitted:
+                return _retry_later({"detail":"Registration queue is full, retry later",
+                                     "position":admission.position, "retry_after":admission.retry_after},
+                                    admission.retry_after)
+
+            slots = get_booking_slots()
+            if slots is not None and not slots.acquire(timeout=getattr(settings, 'EVENT_ADMISSION_SLOT_WAIT', 0.1)):
+                return _retry_later({"detail":"Too many registrations in progress, retry later",
+                                     "position":admission.position, "retry_after":1}, 1)
+            try:
+                return view(request, pk, *args, **kwargs)
+            finally:
+                if slots is not None:
+                    slots.release()
+        return wrapper
+    return decorator
@@ -0,0 +1,527 @@
+import datetime
+import random
+from collections import Counter
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, Exists, F, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from .models import Event, EventSeatShard, SeatHold, Ticket, WaitlistEntry
+from .cache import invalidate_events
+
+
+#event columns needed to validate a booking and to build the booking response
+BOOKING_FIELDS = ('name', 'description', 'expiration', 'seats', 'shard_count')
+
+
+class BookingError(Exception):
+    """
+    Raised when a seat cannot be booked. The message is meant to be returned to the client as is.
+    """
+
+
+def check_bookable(event):
+    """
+    Method to validate that registration for the event is open.
+    Input:
+        event => event instance or None if it does not exist
+    Output:
+        None or BookingError if the event cannot be booked
+    """
+    #check if event with the given pk exists
+    if event is None:
+        raise BookingError("Event does not exists")
+
+    #if event expiration date is today or has already gone
+    if event.expiration <= datetime.datetime.now().date():
+        raise BookingError("Event already over or ongoing. Cannot register now")
+
+
+def book_seat(user, pk):
+    """
+    Method to book one seat of the event specified by pk for the given user.
+    The seat is taken with a single conditional update and the ticket is inserted in the same
+    transaction, so concurrent bookings (even across processes) can never overbook an event.
+    Input:
+        user => user the ticket is issued to
+        pk => primary key of the event
+    Output:
+        ticket (newly created ticket) or BookingError if the seat cannot be booked
+    """
+    event = Event.objects.filter(pk=pk).only(*BOOKING_FIELDS).first()
+    check_bookable(event)
+
+    #if event has no seats left (cheap early exit, the conditional update below is the real guard).
+    #seats of sharded events is only reconciled lazily so it cannot be trusted here
+    if not event.shard_count and event.seats <= 0:
+        raise BookingError("Event registration full")
+
+    try:
+        with transaction.atomic():
+            if not take_seat(event):
+                raise BookingError("Event registration full")
+
+            #the unique (user, event) constraint rejects duplicate registrations and rolls back the seat
+            ticket = Ticket.objects.create(user=user, event=event)
+    except IntegrityError:
+        raise BookingError("Event already regsitered")
+
+    return ticket
+
+
+def take_seat(event, counter='tickets_sold'):
+    """
+    Method to take one seat of the event inside the current transaction. Seats are decremented
+    in the database only if there is still one left.
+    Input:
+        event => event to take the seat from (only pk and shard_count are used)
+        counter => event column the seat moves to (tickets_sold for bookings, seats_held for seat holds)
+    Output:
+        True if a seat was taken else False
+    """
+    if not event.shard_count:
+        return Event.objects.filter(pk=event.pk, seats__gt=0).update(
+            seats=F('seats') - 1, **{counter: F(counter) + 1}) == 1
+
+    #start on a random shard so that concurrent bookings spread over different rows.
+    #the event row is not touched, its counters are reconciled lazily
+    shards = EventSeatShard.objects.filter(event_id=event.pk, seats__gt=0)
+    if shards.filter(shard=random.randrange(event.shard_count)).update(seats=F('seats') - 1):
+        return True
+
+    #the chosen shard ran dry, fall back to the shards that still have seats left
+    remaining = list(shards.values_list('shard', flat=True))
+    random.shuffle(remaining)
+    for shard in remaining:
+        if shards.filter(shard=shard).update(seats=F('seats') - 1):
+            return True
+    return False
+
+
+def distribute_seats(event, shard_count, seats):
+    """
+    Method to (re)split the remaining seats of an event over shard_count shards. A shard count of 0
+    turns sharding off and keeps all seats on the event row. The caller must hold the event row lock.
+    Input:
+        event => event to shard (locked with select_for_update)
+        shard_count => number of shards
+        seats => remaining seats to distribute
+    Output:
+        None
+    """
+    EventSeatShard.objects.filter(event=event).delete()
+
+    if shard_count:
+        per_shard, extra = divmod(seats, shard_count)
+        EventSeatShard.objects.bulk_create([
+            EventSeatShard(event=event, shard=shard, seats=per_shard + (1 if shard < extra else 0))
+            for shard in range(shard_count)
+        ])
+
+    event.shard_count = shard_count
+    event.seats = seats
+    event.save(update_fields=['shard_count', 'seats'])
+
+
+def locked_remaining_seats(event):
+    """
+    Method to read the remaining seats of an event while blocking concurrent bookings.
+    The caller must hold the event row lock and be inside a transaction.
+    Input:
+        event => event (locked with select_for_update)
+    Output:
+        number of seats left
+    """
+    if not event.shard_count:
+        return event.seats
+    return sum(EventSeatShard.objects.select_for_update().filter(event=event).values_list('seats', flat=True))
+
+
+def sync_locked_counters(event):
+    """
+    Method to bring seats, tickets_sold and seats_held of a locked event up to date before it is saved
+    (sharded events only keep them up to date lazily).
+    Input:
+        event => event (locked with select_for_update)
+    Output:
+        number of seats left
+    """
+    seats = locked_remaining_seats(event)
+    if event.shard_count:
+        event.seats_held = SeatHold.objects.filter(event=event).count()
+        event.tickets_sold = event.capacity - seats - event.seats_held
+        event.seats = seats
+    return seats
+
+
+def reconcile_seats():
+    """
+    Method to copy the shard totals of every sharded event back to Event.seats (and the matching
+    seats_held and tickets_sold) with a single update.
+    Output:
+        number of events reconciled
+    """
+    shard_total = Coalesce(Subquery(EventSeatShard.objects.filter(event=OuterRef('pk'))
+                                     .values('event').annotate(total=Sum('seats')).values('total')), 0)
+    held = Coalesce(Subquery(SeatHold.count_by_event()), 0)
+    with transaction.atomic():
+        pks = list(Event.objects.filter(shard_count__gt=0).values_list('pk', flat=True))
+        reconciled = Event.objects.filter(pk__in=pks).update(
+            seats=shard_total, seats_held=held, tickets_sold=F('capacity') - shard_total - held)
+        #queryset updates send no signals, cached lists and details still show the old counters
+        invalidate_events(pks)
+    return reconciled
+
+
+def release_seats(counts, counter='tickets_sold'):
+    """
+    Method to give seats back to their events (after tickets were cancelled or holds released) inside the
+    current transaction, with one update per event. Sharded events get them back on a random shard.
+    Input:
+        counts => dictionary of event pk to number of seats to give back
+        counter => event column the seats come from (tickets_sold or seats_held)
+    Output:
+        None
+    """
+    for event in Event.objects.filter(pk__in=list(counts)).only('shard_count').order_by('pk'):
+        count = counts[event.pk]
+        if event.shard_count:
+            (EventSeatShard.objects.filter(event=event, shard=random.randrange(event.shard_count))
+             .update(seats=F('seats') + count))
+        else:
+            Event.objects.filter(pk=event.pk).update(seats=F('seats') + count, **{counter: F(counter) - count})
+
+
+def cancel_ticket(ticket):
+    """
+    Method to cancel a ticket: the ticket is deleted, its seat given back and offered to the waitlist
+    in one transaction.
+    Input:
+        ticket => ticket to cancel
+    Output:
+        True if the ticket was cancelled, False if it was already gone
+    """
+    return cancel_tickets([ticket.pk]) == 1
+
+
+def cancel_tickets(ticket_pks):
+    """
+    Method to cancel many tickets at once (e.g. a group dropping out) in a single transaction: the tickets are
+    deleted with one query, the seats given back with one update per event and the freed seats handed to
+    the waitlists with set based bookings (see promote_waitlist).
+    Input:
+        ticket_pks => primary keys of the tickets to cancel
+    Output:
+        number of tickets cancelled
+    """
+    with transaction.atomic():
+        tickets = Ticket.objects.filter(pk__in=list(ticket_pks))
+        #events are locked in pk order before anything else, like bookings do
+        event_ids = set(tickets.values_list('event_id', flat=True))
+        list(Event.objects.select_for_update().filter(pk__in=event_ids).order_by('pk').values_list('pk'))
+
+        #read again under the locks, tickets cancelled concurrently are gone by now
+        tickets = list(tickets.values_list('pk', 'event_id', 'user_id'))
+        Ticket.objects.filter(pk__in=[pk for pk, _, _ in tickets]).delete()
+        counts = Counter(event_id for _, event_id, _ in tickets)
+        release_seats(counts)
+        promote_waitlist(counts)
+        #queryset updates send no signals, invalidate the cached events here
+        invalidate_events(counts, {user_id for _, _, user_id in tickets})
+    return len(tickets)
+
+
+def promote_waitlist(event_pks):
+    """
+    Method to turn the heads of the waitlists of the given events into tickets, as many as each event has
+    seats left. The chosen users are booked together with book_many (so in one set based transaction)
+    and their entries removed.
+    Input:
+        event_pks => primary keys of the events that got seats back
+    Output:
+        list of tickets created
+    """
+    with transaction.atomic():
+        registrations = []
+        events = Event.objects.select_for_update().filter(pk__in=list(event_pks)).only(*BOOKING_FIELDS).order_by('pk')
+        for event in events:
+            available = locked_remaining_seats(event)
+            if available <= 0:
+                continue
+            #users who registered on their own in the meantime just leave the queue
+            registered = Ticket.objects.filter(event=event, user=OuterRef('user'))
+            WaitlistEntry.objects.filter(Exists(registered), event=event).delete()
+            registrations.extend((user_id, event.pk) for user_id in WaitlistEntry.objects.filter(event=event)
+                                 .order_by('pk').values_list('user_id', flat=True)[:available])
+        if not registrations:
+            return []
+
+        results = book_many(registrations)
+        promoted = {}
+        for (user_id, event_id), result in zip(registrations, results):
+            if not isinstance(result, BookingError):
+                promoted.setdefault(event_id, []).append(user_id)
+        entries = Q()
+        for event_id, user_ids in promoted.items():
+            entries |= Q(event_id=event_id, user_id__in=user_ids)
+        if promoted:
+            WaitlistEntry.objects.filter(entries).delete()
+    return [result for result in results if not isinstance(result, BookingError)]
+
+
+def join_waitlist(user, pk):
+    """
+    Method to put the user in the waitlist of a sold out event.
+    Input:
+        user => user joining the waitlist
+        pk => primary key of the event
+    Output:
+        position of the user in the waitlist (1 is next) or BookingError if the user cannot wait for the event
+    """
+    event = Event.objects.filter(pk=pk).only(*BOOKING_FIELDS).first()
+    check_bookable(event)
+    if Ticket.objects.filter(user=user, event=event).exists():
+        raise BookingError("Event already regsitered")
+    if event.remaining_seats > 0:
+        raise BookingError("Event still has seats left, register instead")
+
+    entry, _ = WaitlistEntry.objects.get_or_create(user=user, event=event)
+    return WaitlistEntry.objects.filter(event=event, pk__lte=entry.pk).count()
+
+
+def hold_seat(user, pk):
+    """
+    Method to hold one seat of the event for the user for EVENT_SEAT_HOLD_SECONDS (checkout). The seat is taken
+    like a booking, so held seats can never be sold twice, and moved to seats_held until the hold is confirmed
+    or released. Holding again while a hold is active returns the active hold.
+    Input:
+        user => user the seat is held for
+        pk => primary key of the event
+    Output:
+        seat hold or BookingError if the seat cannot be held
+    """
+    event = Event.objects.filter(pk=pk).only(*BOOKING_FIELDS).first()
+    check_bookable(event)
+    if Ticket.objects.filter(user=user, event=event).exists():
+        raise BookingError("Event already regsitered")
+
+    now = timezone.now()
+    hold = SeatHold.objects.filter(user=user, event=event).first()
+    if hold is not None:
+        if hold.expires_at > now:
+            return hold
+        #expired but not swept yet, give the seat back before holding a new one
+        release_holds([hold.pk])
+
+    if not event.shard_count and event.seats <= 0:
+        raise BookingError("Event registration full")
+
+    seconds = getattr(settings, 'EVENT_SEAT_HOLD_SECONDS', 600)
+    try:
+        with transaction.atomic():
+            if not take_seat(event, counter='seats_held'):
+                raise BookingError("Event registration full")
+            hold = SeatHold.objects.create(user=user, event=event, expires_at=now + datetime.timedelta(seconds=seconds))
+            invalidate_events([event.pk])
+    except IntegrityError:
+        #held concurrently by another request of the same user, the seat taken here was rolled back
+        hold = SeatHold.objects.filter(user=user, event=event).first()
+        if hold is None:
+            #and already released or swept again
+            raise BookingError("Seat hold changed meanwhile, retry")
+    return hold
+
+
+def confirm_hold(user, pk):
+    """
+    Method to turn the active seat hold of the user into a ticket.
+    Input:
+        user => user holding the seat
+        pk => primary key of the event
+    Output:
+        ticket (newly created ticket) or BookingError if there is no active hold
+    """
+    try:
+        with transaction.atomic():
+            hold = SeatHold.objects.select_for_update().filter(user=user, event_id=pk).first()
+            if hold is None:
+                raise BookingError("No seat held for this event")
+            if hold.expires_at <= timezone.now():
+                raise BookingError("Seat hold expired")
+            event = Event.objects.only(*BOOKING_FIELDS).get(pk=pk)
+            check_bookable(event)
+
+            hold.delete()
+            if not event.shard_count:
+                Event.objects.filter(pk=pk).update(seats_held=F('seats_held') - 1, tickets_sold=F('tickets_sold') + 1)
+            ticket = Ticket.objects.create(user=user, event=event)
+    except IntegrityError:
+        raise BookingError("Event already regsitered")
+    return ticket
+
+
+def release_hold(user, pk):
+    """
+    Method to give back the seat held by the user for the event.
+    Output:
+        True if a hold was released else False
+    """
+    return release_holds(SeatHold.objects.filter(user=user, event_id=pk).values_list('pk', flat=True)) == 1
+
+
+def release_holds(hold_pks):
+    """
+    Method to release many seat holds in one transaction: the holds are deleted with one query, the seats
+    given back with one update per event and offered to the waitlists.
+    Input:
+        hold_pks => primary keys of the holds to release
+    Output:
+        number of holds released
+    """
+    with transaction.atomic():
+        #locked (and read again) so that a hold confirmed or released concurrently is not given back twice
+        holds = list(SeatHold.objects.select_for_update().filter(pk__in=list(hold_pks)).order_by('pk')
+                     .values_list('pk', 'event_id'))
+        if not holds:
+            return 0
+        SeatHold.objects.filter(pk__in=[pk for pk, _ in holds]).delete()
+        counts = Counter(event_id for _, event_id in holds)
+        release_seats(counts, counter='seats_held')
+        promote_waitlist(counts)
+        invalidate_events(counts)
+    return len(holds)
+
+
+def sweep_seat_holds(batch_size=1000):
+    """
+    Method to reclaim the seats of expired holds, batch_size holds per transaction. Each batch is picked from the
+    expires_at index with SKIP LOCKED, so concurrent sweepers and confirmations do not wait for each other.
+    Input:
+        batch_size => number of holds released per transaction
+    Output:
+        number of holds released
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = list(SeatHold.objects.select_for_update(skip_locked=True)
+                           .filter(expires_at__lte=timezone.now()).order_by('expires_at')
+                           .values_list('pk', flat=True)[:batch_size])
+            count = release_holds(expired)
+        released += count
+        if len(expired) < batch_size:
+            return released
+
+
+def verify_event_counters(repair=False):
+    """
+    Method to check tickets_sold, seats_held and capacity of every event against the tickets and seat holds
+    tables (and the shard totals of sharded events), optionally repairing the events that drifted with a single update.
+    Input:
+        repair => rewrite the counters of the events that do not match
+    Output:
+        list of primary keys of the events whose counters did not match
+    """
+    sold = Coalesce(Subquery(Ticket.objects.filter(event=OuterRef('pk')).order_by()
+                             .values('event').annotate(total=Count('pk')).values('total')), 0)
+    held = Coalesce(Subquery(SeatHold.count_by_event()), 0)
+    consistent = (Q(shard_count=0, tickets_sold=F('counted'), seats_held=F('held'),
+                    capacity=F('seats') + F('tickets_sold') + F('seats_held'))
+                  #counters of sharded events are reconciled lazily, capacity - shard total - holds is what counts
+                  | Q(shard_count__gt=0, capacity=F('shard_seats') + F('counted') + F('held')))
+    pks = list(Event.objects.with_remaining_seats().annotate(counted=sold, held=held).exclude(consistent)
+               .order_by('pk').values_list('pk', flat=True))
+
+    if repair and pks:
+        shard_total = Coalesce(Subquery(EventSeatShard.objects.filter(event=OuterRef('pk'))
+                                         .values('event').annotate(total=Sum('seats')).values('total')), 0)
+        remaining = Case(When(shard_count=0, then=F('seats')), default=shard_total)
+        with transaction.atomic():
+            #counted under the row locks so that bookings running meanwhile are not lost
+            list(Event.objects.select_for_update().filter(pk__in=pks).order_by('pk').values_list('pk'))
+            Event.objects.filter(pk__in=pks).update(seats=remaining, tickets_sold=sold, seats_held=held,
+                                                    capacity=remaining + sold + held)
+            invalidate_events(pks)
+    return pks
+
+
+def book_many(registrations):
+    """
+    Method to book many (user, event) registrations in a single transaction with set based queries:
+    one query locks the events, one finds the existing tickets, seats are decremented once per event
+    and all tickets are inserted with bulk_create.
+    Input:
+        registrations => list of (user pk, event pk) tuples
+    Output:
+        list with one entry per registration, either the created ticket or a BookingError
+    """
+    results = [None] * len(registrations)
+    event_ids = {event_id for _, event_id in registrations}
+    user_ids = {user_id for user_id, _ in registrations}
+
+    with transaction.atomic():
+        #events are locked in pk order so that concurrent batches cannot deadlock
+        events = {event.pk: event for event in
+                  Event.objects.select_for_update().filter(pk__in=event_ids).only(*BOOKING_FIELDS).order_by('pk')}
+        shards = {}
+        for shard in EventSeatShard.objects.select_for_update().filter(
+                event__in=[pk for pk, event in events.items() if event.shard_count]).order_by('event', 'shard'):
+            shards.setdefault(shard.event_id, []).append(shard)
+        remaining = {pk: sum(shard.seats for shard in shards.get(pk, [])) if event.shard_count else event.seats
+                     for pk, event in events.items()}
+
+        users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        booked = set(Ticket.objects.filter(user__in=user_ids, event__in=list(events)).values_list('user', 'event'))
+
+        tickets = []
+        for index, (user_id, event_id) in enumerate(registrations):
+            event = events.get(event_id)
+            try:
+                check_bookable(event)
+                if user_id not in users:
+                    raise BookingError("User does not exists")
+                if (user_id, event_id) in booked:
+                    raise BookingError("Event already regsitered")
+                if remaining[event_id] <= 0:
+                    raise BookingError("Event registration full")
+            except BookingError as e:
+                results[index] = e
+                continue
+
+            remaining[event_id] -= 1
+            booked.add((user_id, event_id))
+            results[index] = Ticket(user_id=user_id, event=event)
+            tickets.append(results[index])
+
+        #one seat update per event (or per touched shard) for the whole batch
+        taken = Counter(ticket.event_id for ticket in tickets)
+        for pk, count in taken.items():
+            if events[pk].shard_count:
+                _take_shard_seats(shards[pk], count)
+            else:
+                Event.objects.filter(pk=pk).update(seats=F('seats') - count, tickets_sold=F('tickets_sold') + count)
+
+        Ticket.objects.bulk_create(tickets, batch_size=1000)
+        #bulk inserts and queryset updates send no signals, invalidate the cached events here
+        invalidate_events(taken, {ticket.user_id for ticket in tickets})
+
+    return results
+
+
+def _take_shard_seats(shards, count):
+    """
+    Method to take count seats from locked shard rows, emptying shards one after the other.
+    Input:
+        shards => shard rows of one event (locked with select_for_update)
+        count => number of seats to take
+    Output:
+        None
+    """
+    for shard in shards:
+        if count == 0:
+            break
+        taken = min(shard.seats, count)
+        if taken:
+            EventSeatShard.objects.filter(pk=shard.pk).update(seats=F('seats') - taken)
+            count -= taken
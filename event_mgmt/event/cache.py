@@ -0,0 +1,149 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework.response import Response
+
+
+def get_cache():
+    """
+    Method to return the cache holding catalog responses (EVENT_CACHE_ALIAS).
+    """
+    return caches[getattr(settings, 'EVENT_CACHE_ALIAS', 'event_catalog')]
+
+
+def get_version_cache():
+    """
+    Method to return the cache holding the version stamps (EVENT_VERSION_CACHE_ALIAS). Stamps are tiny and the
+    cache is sized not to cull them, a culled stamp comes back with a new value and invalidates everything
+    built from the old one.
+    """
+    return caches[getattr(settings, 'EVENT_VERSION_CACHE_ALIAS', 'event_versions')]
+
+
+def versions_shared():
+    """
+    Method to tell whether the version stamps are shared by every worker process. Stamps kept in a local memory
+    (or dummy) cache are private to a process, a worker that did not handle a change never sees it.
+    EVENT_VERSIONS_SHARED overrides the guess, e.g. True for a single process deployment.
+    """
+    shared = getattr(settings, 'EVENT_VERSIONS_SHARED', None)
+    if shared is None:
+        return not isinstance(get_version_cache(), (LocMemCache, DummyCache))
+    return shared
+
+
+def _version_key(name):
+    return 'version:%s' % name
+
+
+def get_versions(*names):
+    """
+    Method to read the version stamps of the given scopes. A stamp changes every time something in
+    its scope changes, so keys built from stamps never have to be deleted. Missing stamps (cold or
+    evicted cache) are initialised, which simply invalidates what was built from the old ones.
+    Input:
+        names => scopes such as 'events', 'event:<pk>' or 'taxonomy'
+    Output:
+        dictionary of scope name to stamp (nanoseconds since epoch)
+    """
+    cache = get_version_cache()
+    keys = {_version_key(name): name for name in names}
+    found = cache.get_many(list(keys))
+    for key, name in keys.items():
+        if key not in found:
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+    return {name: found[key] for key, name in keys.items()}
+
+
+def bump_versions(*names):
+    """
+    Method to give the scopes new version stamps, invalidating everything built from the old ones.
+    The bump is repeated once the current transaction commits so that a response rebuilt from not yet
+    committed data in between is invalidated as well.
+    Input:
+        names => scopes to invalidate
+    Output:
+        None
+    """
+    def bump():
+        stamp = time.time_ns()
+        get_version_cache().set_many({_version_key(name): stamp for name in names}, timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def invalidate_events(event_pks, user_pks=()):
+    """
+    Method to invalidate the catalog after seats or tickets of the given events changed through
+    queryset updates / bulk inserts (which do not send model signals).
+    Input:
+        event_pks => iterable of event primary keys
+        user_pks => iterable of primary keys of the users whose tickets changed
+    Output:
+        None
+    """
+    bump_versions('events', *['event:%s' % pk for pk in event_pks], *['tickets:%s' % pk for pk in user_pks])
+
+
+def response_cache_key(request, scopes):
+    """
+    Method to build the cache key of a response from the full URL (path, expand, fields, filters,
+    cursor...) and the version stamps of the scopes the response depends on.
+    """
+    versions = get_versions(*scopes)
+    query = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+    raw = '|'.join([request.build_absolute_uri(request.path), repr(query), repr(sorted(versions.items()))])
+    return 'response:%s' % hashlib.sha1(raw.encode()).hexdigest()
+
+
+def cached_response(request, scopes, build):
+    """
+    Method to serve a GET response from the cache or build and store it. Concurrent misses for the same key
+    are coalesced: the first one takes a short lock in the cache and builds the response while the others
+    wait for it to appear, so a cold cache does not send every request to the database. Responses are only
+    cached when the version stamps are shared (see versions_shared), a worker holding its own stamps would
+    keep serving what it cached after another one changed the data.
+    Input:
+        request => incoming request
+        scopes => version scopes the response depends on
+        build => function returning the response on a miss
+    Output:
+        HTTP response
+    """
+    if not versions_shared():
+        return build()
+
+    cache = get_cache()
+    key = response_cache_key(request, scopes)
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+
+    lock_timeout = getattr(settings, 'EVENT_CACHE_LOCK_TIMEOUT', 5)
+    locked = cache.add(key + ':lock', 1, timeout=lock_timeout)
+    if not locked:
+        #someone else is building this response, wait for it instead of hitting the database as well
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+            if cache.get(key + ':lock') is None:
+                #the builder gave up (e.g. error response), build it here
+                break
+
+    try:
+        response = build()
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout=getattr(settings, 'EVENT_CACHE_TIMEOUT', 300))
+        return response
+    finally:
+        if locked:
+            cache.delete(key + ':lock')
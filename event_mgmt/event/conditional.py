@@ -0,0 +1,64 @@
+import hashlib
+from functools import partial
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from .cache import cached_response, get_versions, versions_shared
+
+
+def conditional_response(request, scopes, build):
+    """
+    Method to answer conditional GETs from the version stamps of the scopes the response depends on.
+    The ETag hashes the URL, the Accept header and the stamps, Last-Modified is the latest stamp. Both are
+    known before anything is queried or serialized, so If-None-Match / If-Modified-Since hits return a 304 straight away.
+    Validators are only given out when the stamps are shared by every worker (see versions_shared), a worker
+    holding its own stamps would keep answering 304 after another one changed the data.
+    Input:
+        request => incoming request
+        scopes => version scopes the response depends on
+        build => function returning the full response
+    Output:
+        HTTP response (304 when the client copy is still current)
+    """
+    if not versions_shared():
+        return build()
+
+    versions = get_versions(*scopes)
+    raw = repr((request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), sorted(versions.items())))
+    etag = quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+    #stamps are in nanoseconds, HTTP dates have a one second resolution
+    last_modified = max(versions.values()) // 10 ** 9 if versions else None
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    response = build()
+    if response.status_code == 200:
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag / Last-Modified handling (and optionally the response cache) to the list and retrieve
+    actions of a view set. View sets return the version scopes of a request from get_version_scopes.
+    """
+    #also serve list / retrieve responses from the event_catalog cache
+    cache_responses = False
+
+    def get_version_scopes(self):
+        raise NotImplementedError('%s must implement get_version_scopes()' % type(self).__name__)
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned_response(request, partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned_response(request, partial(super().retrieve, request, *args, **kwargs))
+
+    def versioned_response(self, request, build):
+        scopes = self.get_version_scopes()
+        if self.cache_responses:
+            build = partial(cached_response, request, scopes, build)
+        return conditional_response(request, scopes, build)
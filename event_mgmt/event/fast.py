@@ -0,0 +1,150 @@
+import datetime
+from functools import lru_cache
+from django.conf import settings
+from rest_framework import fields as drf_fields
+from rest_framework import ISO_8601
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_flex_fields import EXPAND_PARAM, FIELDS_PARAM, OMIT_PARAM, split_levels
+from rest_flex_fields.serializers import FlexFieldsSerializerMixin
+from .planner import get_expanded_fields, get_flex_options, _is_wildcard
+
+
+class FastSerializer:
+    """
+    Serializer for flat lists compiled from a flex fields serializer. Rows are read with values() and
+    turned into dictionaries by a precompiled (output name, column, converter) plan, skipping the per
+    field get_attribute / to_representation calls of DRF. The output is the same as the serializer's.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.columns = tuple(dict.fromkeys(column for _, column, _ in plan))
+
+    def values(self, queryset, extra=()):
+        """
+        Method to turn a (planned) query set into a values() query set holding the columns the plan reads.
+        Input:
+            queryset => query set of the serialized model
+            extra => additional columns to load (e.g. the ordering columns read by the paginator)
+        Output:
+            values() query set
+        """
+        return queryset.values(*dict.fromkeys(self.columns + tuple(extra)))
+
+    def serialize(self, rows):
+        """
+        Method to serialize values() rows.
+        Input:
+            rows => iterable of dictionaries holding (at least) the plan columns
+        Output:
+            list of dictionaries, in the serializer field order
+        """
+        plan = self.plan
+        return [
+            {name: None if row[column] is None else convert(row[column]) for name, column, convert in plan}
+            for row in rows
+        ]
+
+
+def _identity(value):
+    return value
+
+
+def _get_converter(field):
+    """
+    Method to return the function turning a database value into the representation of the given DRF field,
+    or None when the field is not supported by the fast path (relations, files, method fields...).
+    """
+    field_type = type(field)
+    if field_type is drf_fields.IntegerField:
+        return int
+    if field_type is drf_fields.CharField:
+        return str
+    if field_type is drf_fields.BooleanField:
+        return field.to_representation
+    if field_type is drf_fields.ReadOnlyField:
+        return _identity
+    if field_type is drf_fields.DateField:
+        output_format = getattr(field, 'format', api_settings.DATE_FORMAT)
+        if isinstance(output_format, str) and output_format.lower() == ISO_8601:
+            return datetime.date.isoformat
+        return field.to_representation
+    return None
+
+
+@lru_cache(maxsize=256)
+def compile_serializer(serializer_class, fields=(), omit=()):
+    """
+    Method to compile the fast serializer of a flex fields serializer for the given sparse fieldset.
+    Serializers overriding to_representation are only compiled when their Meta.fast_columns tells which
+    values() column (e.g. an annotation) gives the overridden fields.
+    Input:
+        serializer_class => flex fields model serializer
+        fields, omit => tuples with the flex fields options (no expand)
+    Output:
+        FastSerializer or None when the serializer cannot be served by the fast path
+    """
+    meta = getattr(serializer_class, 'Meta', None)
+    names = getattr(meta, 'fields', None)
+    if not isinstance(names, (list, tuple)):
+        return None
+    fast_columns = getattr(meta, 'fast_columns', None)
+    if serializer_class.to_representation is not FlexFieldsSerializerMixin.to_representation and fast_columns is None:
+        return None
+
+    sparse_fields, _ = split_levels(list(fields))
+    omit_fields, next_omit = split_levels(list(omit))
+    declared = serializer_class().fields
+
+    plan = []
+    for name in names:
+        if name in omit_fields and name not in next_omit:
+            continue
+        if sparse_fields and not _is_wildcard(sparse_fields) and name not in sparse_fields:
+            continue
+        field = declared[name]
+        if field.write_only:
+            continue
+        convert = _get_converter(field)
+        column = (fast_columns or {}).get(name, field.source)
+        if convert is None or column == '*' or '.' in column:
+            return None
+        plan.append((name, column, convert))
+    return FastSerializer(tuple(plan))
+
+
+class FastListMixin:
+    """
+    Serves the list action of a view set with the fast serializer when no relation is expanded
+    (EVENT_FAST_SERIALIZATION). Everything else goes through the regular serializer.
+    """
+
+    def get_fast_serializer(self):
+        """
+        Method to return the fast serializer for the current request or None.
+        """
+        if not getattr(settings, 'EVENT_FAST_SERIALIZATION', True):
+            return None
+        serializer_class = self.get_serializer_class()
+        options = get_flex_options(self.request, getattr(self, 'permit_list_expands', None))
+        if get_expanded_fields(serializer_class, options[EXPAND_PARAM], options[FIELDS_PARAM], options[OMIT_PARAM]):
+            return None
+        return compile_serializer(serializer_class, tuple(options[FIELDS_PARAM]), tuple(options[OMIT_PARAM]))
+
+    def list(self, request, *args, **kwargs):
+        fast = self.get_fast_serializer()
+        if fast is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        #the paginator reads the cursor position from the rows
+        ordering = []
+        if self.paginator is not None and hasattr(self.paginator, 'get_ordering'):
+            ordering = [name for name, _ in self.paginator.get_ordering(queryset.model)]
+        rows = fast.values(queryset, ordering)
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(fast.serialize(page))
+        return Response(fast.serialize(rows))
@@ -0,0 +1,108 @@
+import threading
+from django.conf import settings
+from django.db import IntegrityError
+from .booking import book_many, book_seat, BookingError
+
+
+class _PendingBooking:
+    """
+    A booking waiting in the group commit queue together with its result.
+    """
+    __slots__ = ('user', 'pk', 'result', 'done')
+
+    def __init__(self, user, pk):
+        self.user = user
+        self.pk = pk
+        self.result = None
+        self.done = threading.Event()
+
+
+class GroupCommitQueue:
+    """
+    Collects the bookings that arrive within a short window and books them together in one
+    transaction (see book_many), so that a burst of registrations pays for one commit instead of one each.
+    The first booking to arrive becomes the leader: it waits for the window to pass (or for the batch
+    to fill up), flushes the batch on its own thread and database connection and hands every
+    waiting booking its own result.
+    """
+
+    def __init__(self, window, max_batch, book=book_many):
+        self.window = window
+        self.max_batch = max_batch
+        self.book = book
+        self._lock = threading.Lock()
+        self._pending = []
+        self._full = threading.Event()
+
+    def submit(self, user, pk):
+        """
+        Method to queue a booking and wait for the batch it ends up in to be flushed.
+        Input:
+            user => user the ticket is issued to
+            pk => primary key of the event
+        Output:
+            ticket (newly created ticket) or BookingError if the seat cannot be booked
+        """
+        booking = _PendingBooking(user, pk)
+        with self._lock:
+            self._pending.append(booking)
+            leader = len(self._pending) == 1
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+
+        if leader:
+            self._full.wait(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._full.clear()
+            self._flush(batch)
+        else:
+            booking.done.wait()
+
+        if isinstance(booking.result, Exception):
+            raise booking.result
+        return booking.result
+
+    def _flush(self, batch):
+        """
+        Method to book a batch and publish the results to the waiting bookings.
+        Input:
+            batch => list of pending bookings
+        Output:
+            None
+        """
+        try:
+            try:
+                results = self.book([(booking.user.pk, int(booking.pk)) for booking in batch])
+            except IntegrityError:
+                #a booking from outside this queue raced with the batch, book one at a time instead
+                results = []
+                for booking in batch:
+                    try:
+                        results.append(book_seat(booking.user, booking.pk))
+                    except BookingError as e:
+                        results.append(e)
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            for booking, result in zip(batch, results):
+                booking.result = result
+                booking.done.set()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_group_commit_queue():
+    """
+    Method to return the group commit queue of this process, configured from settings.
+    Output:
+        GroupCommitQueue instance
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = GroupCommitQueue(getattr(settings, 'EVENT_GROUP_COMMIT_WINDOW', 0.005),
+                                      getattr(settings, 'EVENT_GROUP_COMMIT_MAX_BATCH', 200))
+        return _queue
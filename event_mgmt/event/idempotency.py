@@ -0,0 +1,104 @@
+import hashlib
+import json
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+
+def get_idempotency_cache():
+    """
+    Method to return the cache holding the stored responses (EVENT_IDEMPOTENCY_CACHE_ALIAS). It is kept apart
+    from the response cache and sized so that records are not culled before they expire, a record culled
+    early makes a retry do the work again.
+    """
+    return caches[getattr(settings, 'EVENT_IDEMPOTENCY_CACHE_ALIAS', 'event_idempotency')]
+
+
+def idempotency_cache_key(request, key):
+    """
+    Method to build the cache key of a stored response. Keys are scoped to the user and the endpoint,
+    so the same Idempotency-Key sent by another user or to another URL is a different request.
+    """
+    raw = '|'.join([str(request.user.pk), request.method, request.path, key])
+    return 'idempotency:%s' % hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _fingerprint(request):
+    return hashlib.sha1(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _replay(stored):
+    response = Response(stored['data'], status=stored['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent_response(request, build):
+    """
+    Method to answer a request carrying an Idempotency-Key header with the response stored for the key, or
+    build and store it the first time. A duplicate arriving while the first request is still running waits
+    for its response instead of doing the work again, and builds it itself when the first one ends without
+    storing one. Responses are kept EVENT_IDEMPOTENCY_TIMEOUT seconds
+    (server errors and 429 are not stored, they can be retried). Requests without the header, or from
+    anonymous users, are simply built.
+    Input:
+        request => incoming request
+        build => function returning the response
+    Output:
+        HTTP response
+    """
+    key = request.META.get(IDEMPOTENCY_HEADER)
+    if not key or request.user.is_authenticated == False:
+        return build()
+
+    cache = get_idempotency_cache()
+    cache_key = idempotency_cache_key(request, key)
+    fingerprint = _fingerprint(request)
+    lock_timeout = getattr(settings, 'EVENT_IDEMPOTENCY_LOCK_TIMEOUT', 30)
+
+    locked = cache.add(cache_key + ':lock', 1, timeout=lock_timeout)
+    stored = cache.get(cache_key)
+    deadline = time.monotonic() + lock_timeout
+    while not locked and stored is None:
+        #the first request with this key is still running, wait for its response
+        if time.monotonic() >= deadline:
+            return Response({"status":"error", "data":"A request with this Idempotency-Key is still in progress"},
+                            status=status.HTTP_409_CONFLICT)
+        time.sleep(0.01)
+        stored = cache.get(cache_key)
+        if stored is None and cache.get(cache_key + ':lock') is None:
+            #it ended without storing a response (server error), take over and build it here
+            locked = cache.add(cache_key + ':lock', 1, timeout=lock_timeout)
+            stored = cache.get(cache_key)
+
+    try:
+        if stored is not None:
+            if stored['fingerprint'] != fingerprint:
+                return Response({"status":"error", "data":"Idempotency-Key was already used with another request"},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return _replay(stored)
+
+        response = build()
+        if response.status_code < 500 and response.status_code != status.HTTP_429_TOO_MANY_REQUESTS:
+            cache.set(cache_key, {'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data},
+                      timeout=getattr(settings, 'EVENT_IDEMPOTENCY_TIMEOUT', 86400))
+        return response
+    finally:
+        if locked:
+            cache.delete(cache_key + ':lock')
+
+
+def idempotent(view):
+    """
+    Decorator making a function based view honour the Idempotency-Key header (see idempotent_response).
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return idempotent_response(request, lambda: view(request, *args, **kwargs))
+    return wrapper
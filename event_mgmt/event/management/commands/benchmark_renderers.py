@@ -0,0 +1,76 @@
+import datetime
+import time
+import tracemalloc
+from io import BytesIO
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from event.models import Event
+from event.renderers import FastJSONParser, FastJSONRenderer, orjson
+from event.serializers import EventSerializer
+
+
+class Command(BaseCommand):
+    """
+    Command to compare DRF's JSON renderer / parser with the orjson based ones (event/renderers.py)
+    on an event list payload. Events are built in memory, the database is not touched.
+    """
+    help = 'Benchmarks encode / decode time and allocations of the JSON renderers on an event list payload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=10000, help='number of events in the payload')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per renderer, the best one is reported')
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(self.style.WARNING('orjson is not installed, FastJSONRenderer falls back to DRF'))
+
+        today = datetime.date.today()
+        events = [Event(pk=i, name='event %d' % i, description='description of event %d' % i, seats=i % 50,
+                        expiration=today, created=today, updated=today) for i in range(options['events'])]
+        payload = {'next': None, 'previous': None, 'results': EventSerializer(events, many=True).data}
+        #expanded images carry one url per rendition
+        for event in payload['results']:
+            event['image'] = [{'pk': event['pk'], 'name': 'image', 'image': {
+                'full_size': 'http://localhost/media/images/%d.jpg' % event['pk'],
+                'thumbnail': 'http://localhost/media/__sized__/images/%d-thumbnail-100x100.jpg' % event['pk'],
+            }}]
+
+        results = {}
+        for name, renderer in (('JSONRenderer', JSONRenderer()), ('FastJSONRenderer', FastJSONRenderer())):
+            elapsed, body = self.best(options['repeat'], lambda: renderer.render(payload))
+            results[name] = body
+            self.stdout.write('%-18s encode %8.1f ms  peak allocations %8.1f KiB  %d bytes' % (
+                name, elapsed * 1000, self.peak(lambda: renderer.render(payload)) / 1024, len(body)))
+        self.stdout.write('identical output: %s' % (results['JSONRenderer'] == results['FastJSONRenderer']))
+
+        body = results['JSONRenderer']
+        for name, parser in (('JSONParser', JSONParser()), ('FastJSONParser', FastJSONParser())):
+            elapsed, _ = self.best(options['repeat'], lambda: parser.parse(BytesIO(body)))
+            self.stdout.write('%-18s decode %8.1f ms  peak allocations %8.1f KiB' % (
+                name, elapsed * 1000, self.peak(lambda: parser.parse(BytesIO(body))) / 1024))
+
+    def best(self, repeat, run):
+        """
+        Method to run a function several times.
+        Output:
+            tuple of (best time in seconds, result of the last run)
+        """
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def peak(self, run):
+        """
+        Method to measure the peak memory allocated (in bytes) while running a function.
+        """
+        tracemalloc.start()
+        try:
+            run()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
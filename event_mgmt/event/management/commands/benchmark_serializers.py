@@ -0,0 +1,56 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from event.fast import compile_serializer
+from event.models import Category, Event, Ticket
+from event.serializers import CategorySerializer, EventSerializer, TicketSerializer
+
+
+class Command(BaseCommand):
+    """
+    Command to compare the regular serializers with the fast list serializer (event/fast.py).
+    Rows are built in memory so only serialization is measured, the database is not touched.
+    """
+    help = 'Benchmarks the regular and fast list serializers of events, tickets and categories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='number of rows serialized per run')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per serializer, the best one is reported')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        today = datetime.date.today()
+        events = [Event(pk=i, name='event%d' % i, description='description %d' % i, seats=i % 50,
+                        expiration=today, created=today, updated=today) for i in range(rows)]
+        for event in events:
+            event.shard_seats = event.seats
+        tickets = [Ticket(pk=i, created=today, updated=today) for i in range(rows)]
+        categories = [Category(pk=i, name='category%d' % i) for i in range(rows)]
+
+        renderer = JSONRenderer()
+        for serializer_class, instances in ((EventSerializer, events), (TicketSerializer, tickets),
+                                            (CategorySerializer, categories)):
+            fast = compile_serializer(serializer_class)
+            values = [{column: getattr(instance, column) for column in fast.columns} for instance in instances]
+
+            regular_time, regular = self.best(repeat, lambda: serializer_class(instances, many=True).data)
+            fast_time, data = self.best(repeat, lambda: fast.serialize(values))
+            identical = renderer.render(regular) == renderer.render(data)
+
+            self.stdout.write('%-20s regular %8.1f ms  fast %8.1f ms  speedup x%.1f  identical output: %s' % (
+                serializer_class.__name__, regular_time * 1000, fast_time * 1000, regular_time / fast_time, identical))
+
+    def best(self, repeat, run):
+        """
+        Method to run a function several times.
+        Output:
+            tuple of (best time in seconds, result of the last run)
+        """
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
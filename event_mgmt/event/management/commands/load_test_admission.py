@@ -0,0 +1,118 @@
+import datetime
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from event.models import Event
+from event.views import EventViewSet, register_event
+
+
+class Command(BaseCommand):
+    """
+    Command to check that a registration spike on one event does not slow down the rest of the API.
+    Reader threads list events (a non booking endpoint) while booker threads all register at once,
+    first with the waiting room turned off, then with it on. Latencies of the reads are reported per phase.
+    A throwaway event and users are created for the run and deleted afterwards.
+    """
+    help = 'Load tests event listing latency during a registration spike, with and without admission control'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookers', type=int, default=200, help='users registering at the same time')
+        parser.add_argument('--readers', type=int, default=4, help='threads listing events during the spike')
+        parser.add_argument('--reads', type=int, default=100, help='minimum number of lists per reader and phase')
+        parser.add_argument('--rate', type=float, default=20, help='EVENT_ADMISSION_RATE of the admission phase')
+        parser.add_argument('--burst', type=int, default=10, help='EVENT_ADMISSION_BURST of the admission phase')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='EVENT_ADMISSION_CONCURRENCY of the admission phase')
+
+    def handle(self, *args, **options):
+        #requests are built for a host accepted by ALLOWED_HOSTS (pagination links are absolute)
+        self.factory = APIRequestFactory(SERVER_NAME=(settings.ALLOWED_HOSTS or ['localhost'])[0].lstrip('.*') or 'localhost')
+        self.list_view = EventViewSet.as_view({'get': 'list'})
+        prefix = 'loadtest-%d' % time.time_ns()
+        User.objects.bulk_create([User(username='%s-%d' % (prefix, i), password=make_password(None))
+                                  for i in range(options['bookers'] * 2)])
+        users = list(User.objects.filter(username__startswith=prefix).order_by('pk'))
+        events = []
+        try:
+            self.report('no spike', self.run_phase(users[:1], None, options))
+
+            event = Event.objects.create(name=prefix + '-off', seats=options['bookers'],
+                                         expiration=datetime.date.today() + datetime.timedelta(days=1))
+            events.append(event)
+            self.report('spike, admission off', self.run_phase(users[:options['bookers']], event, options))
+
+            event = Event.objects.create(name=prefix + '-on', seats=options['bookers'],
+                                         expiration=datetime.date.today() + datetime.timedelta(days=1))
+            events.append(event)
+            with override_settings(EVENT_ADMISSION_RATE=options['rate'], EVENT_ADMISSION_BURST=options['burst'],
+                                   EVENT_ADMISSION_CONCURRENCY=options['concurrency']):
+                self.report('spike, admission on', self.run_phase(users[options['bookers']:], event, options))
+        finally:
+            Event.objects.filter(pk__in=[event.pk for event in events]).delete()
+            User.objects.filter(username__startswith=prefix).delete()
+
+    def run_phase(self, users, event, options):
+        """
+        Method to run the readers, alongside one registration per user when an event is given.
+        Readers keep listing until every registration is answered (and at least --reads times).
+        Output:
+            tuple of (read latencies in seconds, dictionary of registration status code to count)
+        """
+        latencies, statuses = [], {}
+        lock = threading.Lock()
+        readers = options['readers']
+        start = threading.Barrier(readers + (len(users) if event else 0))
+        done = threading.Event()
+
+        def read(user):
+            start.wait()
+            reads = 0
+            while True:
+                request = self.factory.get('/event/')
+                force_authenticate(request, user=user)
+                began = time.perf_counter()
+                self.list_view(request)
+                reads += 1
+                with lock:
+                    latencies.append(time.perf_counter() - began)
+                if done.is_set() and reads >= options['reads']:
+                    return
+
+        def book(user):
+            start.wait()
+            request = self.factory.get('/event/register/%d/' % event.pk)
+            force_authenticate(request, user=user)
+            response = register_event(request, pk=event.pk)
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        def run(target, arg):
+            try:
+                target(arg)
+            finally:
+                connection.close()
+
+        reader_threads = [threading.Thread(target=run, args=(read, users[0])) for _ in range(readers)]
+        booker_threads = [threading.Thread(target=run, args=(book, user)) for user in users] if event else []
+        for thread in reader_threads + booker_threads:
+            thread.start()
+        for thread in booker_threads:
+            thread.join()
+        done.set()
+        for thread in reader_threads:
+            thread.join()
+        return latencies, statuses
+
+    def report(self, name, result):
+        latencies, statuses = result
+        latencies = sorted(latencies) or [0]
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+        self.stdout.write('%-22s list p50 %7.1f ms  p99 %7.1f ms  (%d reads)  registrations %s' % (
+            name, percentile(0.5), percentile(0.99), len(latencies),
+            ', '.join('%s: %d' % item for item in sorted(statuses.items())) or '-'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from event.booking import reconcile_seats
+
+
+class Command(BaseCommand):
+    """
+    Command to copy the seat shard totals of sharded events back to Event.seats.
+    Meant to be run periodically (e.g. from cron) while sharded events are on sale.
+    """
+    help = 'Reconciles Event.seats of sharded events with the total of their seat shards'
+
+    def handle(self, *args, **options):
+        reconciled = reconcile_seats()
+        self.stdout.write(self.style.SUCCESS('Reconciled seats of %d sharded event(s)' % reconciled))
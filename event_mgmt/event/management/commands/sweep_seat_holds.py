@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from event.booking import sweep_seat_holds
+
+
+class Command(BaseCommand):
+    """
+    Command to give back the seats of expired seat holds. Meant to be run every minute or so (e.g. from cron),
+    several sweepers can run at the same time.
+    """
+    help = 'Releases expired seat holds in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'EVENT_SEAT_HOLD_SWEEP_BATCH', 1000),
+                            help='holds released per transaction')
+
+    def handle(self, *args, **options):
+        released = sweep_seat_holds(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Released %d expired seat hold(s)' % released))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from event.booking import verify_event_counters
+
+
+class Command(BaseCommand):
+    """
+    Command to check Event.tickets_sold / Event.capacity against the tickets table and optionally repair them
+    (e.g. after tickets were removed by a user deletion, which cascades without giving the seats back).
+    """
+    help = 'Verifies (and with --repair fixes) the ticket counters of every event'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='rewrite the counters of the events that do not match')
+
+    def handle(self, *args, **options):
+        pks = verify_event_counters(repair=options['repair'])
+        if not pks:
+            self.stdout.write(self.style.SUCCESS('All event counters are consistent'))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS('Repaired the counters of %d event(s): %s' % (len(pks), ', '.join(map(str, pks)))))
+        else:
+            self.stdout.write(self.style.WARNING('Counters of %d event(s) do not match: %s' % (len(pks), ', '.join(map(str, pks)))))
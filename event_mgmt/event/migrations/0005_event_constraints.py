@@ -0,0 +1,40 @@
+# Generated by Django 4.0.3 on 2026-10-17 04:33
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_tickets(apps, schema_editor):
+    """
+    Lost updates in the old booking path could leave duplicate tickets and negative seat counts
+    behind, clean them up so the new constraints can be created.
+    """
+    Event = apps.get_model('event', 'Event')
+    Ticket = apps.get_model('event', 'Ticket')
+
+    duplicates = (Ticket.objects.values('user', 'event')
+                  .annotate(first=Min('pk'), total=Count('pk'))
+                  .filter(total__gt=1))
+    for duplicate in duplicates:
+        Ticket.objects.filter(user=duplicate['user'], event=duplicate['event']).exclude(pk=duplicate['first']).delete()
+
+    Event.objects.filter(seats__lt=0).update(seats=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0004_category_image_event_category_event_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_tickets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='event',
+            constraint=models.CheckConstraint(check=models.Q(('seats__gte', 0)), name='event_seats_gte_0'),
+        ),
+        migrations.AddConstraint(
+            model_name='ticket',
+            constraint=models.UniqueConstraint(fields=('user', 'event'), name='unique_ticket_user_event'),
+        ),
+    ]
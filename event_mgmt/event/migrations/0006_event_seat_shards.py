@@ -0,0 +1,36 @@
+# Generated by Django 4.0.3 on 2026-10-17 04:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0005_event_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='EventSeatShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('seats', models.IntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_shards', to='event.event')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='eventseatshard',
+            constraint=models.UniqueConstraint(fields=('event', 'shard'), name='unique_event_seat_shard'),
+        ),
+        migrations.AddConstraint(
+            model_name='eventseatshard',
+            constraint=models.CheckConstraint(check=models.Q(('seats__gte', 0)), name='event_seat_shard_seats_gte_0'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.3 on 2026-10-17 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0006_event_seat_shards'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='ticket',
+            options={'ordering': ['-created']},
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['-created', '-id'], name='event_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['expiration', 'created'], name='event_expiration_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['user', '-created', '-id'], name='ticket_user_created_idx'),
+        ),
+        #the auto created through tables only have (event_id, <other>_id) unique plus single column indexes,
+        #filtering events by category / image walks them the other way round
+        migrations.RunSQL(
+            'CREATE INDEX event_event_category_category_event_idx ON event_event_category (category_id, event_id)',
+            'DROP INDEX event_event_category_category_event_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX event_event_image_image_event_idx ON event_event_image (image_id, event_id)',
+            'DROP INDEX event_event_image_image_event_idx',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.3 on 2026-10-17 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0007_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('seats__gt', 0)), fields=['expiration'], name='event_open_expiration_idx'),
+        ),
+    ]
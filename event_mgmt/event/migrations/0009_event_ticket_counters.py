@@ -0,0 +1,52 @@
+# Generated by Django 4.0.3 on 2026-10-17 04:55
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+
+
+def count_tickets(apps, schema_editor):
+    """
+    Fill tickets_sold from the existing tickets and capacity from the seats left plus the tickets sold
+    (shard totals for sharded events, whose seats column is only reconciled lazily).
+    """
+    Event = apps.get_model('event', 'Event')
+    Ticket = apps.get_model('event', 'Ticket')
+    EventSeatShard = apps.get_model('event', 'EventSeatShard')
+
+    sold = Coalesce(Subquery(Ticket.objects.filter(event=OuterRef('pk')).order_by()
+                             .values('event').annotate(total=Count('pk')).values('total'),
+                             output_field=IntegerField()), 0)
+    shard_total = Coalesce(Subquery(EventSeatShard.objects.filter(event=OuterRef('pk')).order_by()
+                                    .values('event').annotate(total=Sum('seats')).values('total'),
+                                    output_field=IntegerField()), 0)
+    Event.objects.update(tickets_sold=sold)
+    Event.objects.update(
+        seats=Case(When(shard_count=0, then=F('seats')), default=shard_total),
+        capacity=Case(When(shard_count=0, then=F('seats')), default=shard_total) + F('tickets_sold'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('event', '0008_open_events_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='capacity',
+            field=models.IntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='tickets_sold',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_tickets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='event',
+            constraint=models.CheckConstraint(check=models.Q(('tickets_sold__gte', 0)), name='event_tickets_sold_gte_0'),
+        ),
+    ]
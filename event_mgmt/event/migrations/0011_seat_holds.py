@@ -0,0 +1,47 @@
+# Generated by Django 4.0.3 on 2026-10-17 05:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('event', '0010_waitlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='seats_held',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='event',
+            constraint=models.CheckConstraint(check=models.Q(('seats_held__gte', 0)), name='event_seats_held_gte_0'),
+        ),
+        migrations.AddField(
+            model_name='seathold',
+            name='event',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='event.event'),
+        ),
+        migrations.AddField(
+            model_name='seathold',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_holds', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='seathold',
+            constraint=models.UniqueConstraint(fields=('user', 'event'), name='unique_seat_hold_user_event'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from datetime import datetime
 from django.db import models
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from versatileimagefield.fields import VersatileImageField, PPOIField
 
@@ -12,6 +14,36 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class EventQuerySet(models.QuerySet):
+    """
+    Query set for events with helpers shared by the views
+    """
+
+    def with_remaining_seats(self):
+        """
+        Annotates shard_seats (sum of the seat shards) on sharded events so that remaining seats
+        can be shown without a query per event. Unsharded events just reuse the seats column.
+        shard_tickets_sold is the matching number of sold tickets (capacity - remaining seats - held seats, seats_held
+        of sharded events is reconciled lazily as well, until then new holds show up as sold).
+        """
+        shard_total = (EventSeatShard.objects.filter(event=OuterRef('pk'))
+                       .values('event').annotate(total=Sum('seats')).values('total'))
+        return self.annotate(shard_seats=Case(
+            When(shard_count=0, then=F('seats')),
+            default=Coalesce(Subquery(shard_total), 0),
+        )).annotate(shard_tickets_sold=Case(
+            When(shard_count=0, then=F('tickets_sold')),
+            default=F('capacity') - F('shard_seats') - F('seats_held'),
+        ))
+
+    def open(self):
+        """
+        Events still open for registration: expiring after today with seats left. Answered from the partial
+        event_open_expiration_idx, so expired and sold out events are never scanned. Event.seats of sharded
+        events is reconciled lazily, they drop out once reconcile_seats has run.
+        """
+        return self.filter(expiration__gt=datetime.now().date(), seats__gt=0)
+
 class Event(models.Model):
     """
     Event model represents an event. 
@@ -21,7 +53,11 @@ class Event(models.Model):
     created (created date)
     updated (updated date)
     expiration (specifies the date till event registration is open)
-    seats (maximum number of available seats)
+    seats (number of seats still available, for sharded events this is reconciled lazily from the shards)
+    capacity (total number of seats, always seats + tickets_sold + seats_held)
+    tickets_sold (number of tickets issued, maintained by bookings and cancellations, lazily for sharded events)
+    seats_held (number of seats held by seat holds, maintained like tickets_sold)
+    shard_count (number of seat shards, 0 means seats are booked directly on the event row)
     image (a many to many field having link to image table which store event related images)
     category (another many to many field capturing the event category)
     """
@@ -31,19 +67,86 @@ class Event(models.Model):
     updated = models.DateField(auto_now=True)
     expiration = models.DateField(default=datetime.now, editable=True)
     seats = models.IntegerField(default=10)
+    capacity = models.IntegerField(default=10)
+    tickets_sold = models.IntegerField(default=0)
+    seats_held = models.IntegerField(default=0)
+    shard_count = models.PositiveSmallIntegerField(default=0)
     image = models.ManyToManyField('event.Image', related_name='events')
     category = models.ManyToManyField(Category, related_name='events')
 
+    objects = EventQuerySet.as_manager()
+
     class Meta:
         
         #ordering -created will by default show recently created events first
         ordering = ['-created']
+        indexes = [
+            #keyset pagination of the event list (ORDER BY created DESC, id DESC)
+            models.Index(fields=['-created', '-id'], name='event_created_id_idx'),
+            #open events (expiration in the future), newest first
+            models.Index(fields=['expiration', 'created'], name='event_expiration_created_idx'),
+            #open events only (see EventQuerySet.open), stays small however many past events pile up
+            models.Index(fields=['expiration'], condition=models.Q(seats__gt=0), name='event_open_expiration_idx'),
+        ]
+        constraints = [
+            #bookings decrement seats with a conditional update, this guards against overbooking
+            models.CheckConstraint(check=models.Q(seats__gte=0), name='event_seats_gte_0'),
+            models.CheckConstraint(check=models.Q(tickets_sold__gte=0), name='event_tickets_sold_gte_0'),
+            models.CheckConstraint(check=models.Q(seats_held__gte=0), name='event_seats_held_gte_0'),
+        ]
     
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        #capacity is derived, bookings and holds move seats into tickets_sold / seats_held and admins change seats
+        self.capacity = self.seats + self.tickets_sold + self.seats_held
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'seats', 'tickets_sold', 'seats_held'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'capacity'}
+        super().save(*args, **kwargs)
+
+    @property
+    def remaining_seats(self):
+        """
+        Seats left for booking. Shard rows are the source of truth for sharded events.
+        """
+        if not self.shard_count:
+            return self.seats
+        if hasattr(self, 'shard_seats'):
+            return self.shard_seats
+        return self.seat_shards.aggregate(total=Sum('seats'))['total'] or 0
+
+    @property
+    def sold_tickets(self):
+        """
+        Tickets sold. Sharded events only reconcile tickets_sold lazily, it is derived from the shards and holds.
+        """
+        if not self.shard_count:
+            return self.tickets_sold
+        if hasattr(self, 'shard_tickets_sold'):
+            return self.shard_tickets_sold
+        return self.capacity - self.remaining_seats - self.seats_held
 
-    
+
+class EventSeatShard(models.Model):
+    """
+    Seat counter shard of an event. Hot events split their remaining seats over several shards
+    so that concurrent bookings update different rows instead of queueing on the event row lock.
+    Attributes:
+    event (a foreign key which points to event primary key)
+    shard (shard number, from 0 to event.shard_count - 1)
+    seats (seats left in this shard)
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='seat_shards')
+    shard = models.PositiveSmallIntegerField()
+    seats = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'shard'], name='unique_event_seat_shard'),
+            models.CheckConstraint(check=models.Q(seats__gte=0), name='event_seat_shard_seats_gte_0'),
+        ]
 
 class Ticket(models.Model):
     """
@@ -59,6 +162,69 @@ class Ticket(models.Model):
     created = models.DateField(auto_now_add=True)
     updated = models.DateField(auto_now=True)
 
+    class Meta:
+        #newest tickets first, the ticket list of a user is read through ticket_user_created_idx
+        ordering = ['-created']
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='ticket_user_created_idx'),
+        ]
+        constraints = [
+            #a user can hold only one ticket per event, also serves the (user, event) lookups of bookings
+            models.UniqueConstraint(fields=['user', 'event'], name='unique_ticket_user_event'),
+        ]
+
+class SeatHold(models.Model):
+    """
+    Seat held for a user during checkout. The seat is taken from the event when the hold is created and either
+    turned into a ticket (confirm) or given back (release, or the sweeper once expires_at has passed).
+    Attributes:
+    event (a foreign key which points to event primary key)
+    user (a foreign key which points to user primary key)
+    created (time the seat was held)
+    expires_at (time after which the hold can be reclaimed)
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='seat_holds')
+    created = models.DateTimeField(auto_now_add=True)
+    #the sweeper reads the oldest expired holds through this index
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'event'], name='unique_seat_hold_user_event'),
+        ]
+
+    @classmethod
+    def count_by_event(cls):
+        """
+        Subquery counting the holds of the outer event.
+        """
+        return (cls.objects.filter(event=OuterRef('pk')).order_by()
+                .values('event').annotate(total=Count('pk')).values('total'))
+
+class WaitlistEntry(models.Model):
+    """
+    Place of a user in the waitlist of a sold out event. Entries are promoted to tickets first in first out
+    (by primary key) as soon as seats are given back.
+    Attributes:
+    event (a foreign key which points to event primary key)
+    user (a foreign key which points to user primary key)
+    created (time the user joined the waitlist)
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='waitlist')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='waitlist_entries')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['pk']
+        indexes = [
+            #head of the queue of an event
+            models.Index(fields=['event', 'id'], name='waitlist_event_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'event'], name='unique_waitlist_user_event'),
+        ]
+
 class Image(models.Model):
     """
     Image object which represents image stored on server side.
@@ -0,0 +1,160 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor (keyset) pagination following the model ordering with pk as tiebreaker.
+    Pages are fetched with WHERE (ordering columns) beyond the cursor position ... LIMIT page size,
+    so no COUNT(*) or OFFSET is ever issued and deep pages cost the same as the first one.
+    The cursor is an opaque base64 token holding the position and the direction.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    #explicit ordering, when None it is taken from the model Meta.ordering
+    ordering = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Method to return one page of the query set.
+        Input:
+            queryset => query set to paginate (model instances or values() dictionaries)
+            request => incoming request holding the cursor and page_size params
+        Output:
+            list of rows in the page
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.fields = self.get_ordering(queryset.model)
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        #reverse pages walk the ordering backwards and flip the rows afterwards
+        order_by = [('-' if desc != reverse else '') + name for name, desc in self.fields]
+        queryset = queryset.order_by(*order_by)
+        names, defer = queryset.query.deferred_loading
+        if names and not defer:
+            #the cursor is read from the rows, keep the ordering columns loaded when only() was planned
+            queryset = queryset.only(*names, *[name for name, _ in self.fields if name != 'pk'])
+        if position is not None:
+            queryset = queryset.filter(self.beyond(position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.first_position = self.get_position(rows[0]) if rows else position
+        self.last_position = self.get_position(rows[-1]) if rows else position
+        return rows
+
+    def get_paginated_response(self, data):
+        """
+        Method to wrap a page of serialized rows with the links to the neighbour pages.
+        Input:
+            data => serialized rows
+        Output:
+            HTTP response with next, previous and results
+        """
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        """
+        Method to read the requested page size, bounded by max_page_size.
+        """
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, model):
+        """
+        Method to return the ordering as a list of (field name, descending) with pk appended as tiebreaker.
+        """
+        ordering = list(self.ordering or model._meta.ordering)
+        fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        if not any(name in ('pk', model._meta.pk.name) for name, _ in fields):
+            #the tiebreaker follows the direction of the main ordering
+            fields.append(('pk', fields[0][1] if fields else True))
+        return fields
+
+    def beyond(self, position, reverse):
+        """
+        Method to build the filter selecting the rows after the position in the (possibly reversed) ordering,
+        e.g. created <= c AND (created < c OR (created = c AND pk < p)) for ['-created', '-pk']. The leading
+        created <= c is redundant but lets the database bound its index scan with it, the OR alone cannot be
+        turned into an index range and deep pages would walk the index from the top.
+        """
+        condition, equal = Q(), {}
+        for (name, desc), value in zip(self.fields, position):
+            lookup = 'lt' if desc != reverse else 'gt'
+            condition |= Q(**equal, **{'%s__%s' % (name, lookup): value})
+            equal[name] = value
+        if len(self.fields) > 1:
+            (name, desc), value = self.fields[0], position[0]
+            condition = Q(**{'%s__%s' % (name, 'lte' if desc != reverse else 'gte'): value}) & condition
+        return condition
+
+    def get_position(self, row):
+        """
+        Method to read the ordering values of a row (model instance or values() dictionary).
+        """
+        if isinstance(row, dict):
+            return [row[name] for name, _ in self.fields]
+        return [getattr(row, name) for name, _ in self.fields]
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': [str(value) for value in position], 'r': int(reverse)})
+        return urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        """
+        Method to decode the cursor param into (position, reverse). Invalid cursors raise NotFound.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            if len(payload['p']) != len(self.fields):
+                raise ValueError(encoded)
+            position = [self.get_field(model, name).to_python(value) for (name, _), value in zip(self.fields, payload['p'])]
+            return position, bool(payload['r'])
+        except (TypeError, ValueError, KeyError, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_field(self, model, name):
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.last_position, False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first_position is None:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.first_position, True))
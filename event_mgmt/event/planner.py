@@ -0,0 +1,231 @@
+import importlib
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_flex_fields import EXPAND_PARAM, FIELDS_PARAM, OMIT_PARAM, WILDCARD_VALUES, split_levels
+from rest_flex_fields.serializers import FlexFieldsSerializerMixin
+
+
+def get_flex_options(request, permitted_expands=None):
+    """
+    Method to read the expand, fields and omit query params the same way drf-flex-fields does for
+    the root serializer.
+    Input:
+        request => incoming request
+        permitted_expands => expands allowed for the action (list actions of FlexFieldsMixin views) or None
+    Output:
+        dictionary with the expand, fields and omit lists
+    """
+    options = {}
+    for param in (EXPAND_PARAM, FIELDS_PARAM, OMIT_PARAM):
+        values = request.query_params.getlist(param) or request.query_params.getlist('%s[]' % param)
+        options[param] = values[0].split(',') if len(values) == 1 else values
+
+    if permitted_expands is not None:
+        if _is_wildcard(options[EXPAND_PARAM]):
+            options[EXPAND_PARAM] = list(permitted_expands)
+        else:
+            options[EXPAND_PARAM] = list(set(options[EXPAND_PARAM]) & set(permitted_expands))
+    return options
+
+
+def plan_queryset(queryset, serializer_class, expand=(), fields=(), omit=(), required=()):
+    """
+    Method to add the select_related / prefetch_related lookups needed to serialize the query set with the
+    given expands, at any nesting depth. Forward foreign keys are joined, many relations are prefetched with
+    a Prefetch whose query set is planned recursively, so every expand combination runs a fixed number of queries.
+    When a sparse fieldset is requested (fields / omit) only the columns the serializers need are loaded.
+    Input:
+        queryset => query set to plan
+        serializer_class => flex fields serializer used to serialize it
+        expand, fields, omit => flex fields options (dot notation for nested levels)
+        required => extra columns that must be loaded (e.g. the foreign key used to attach prefetched rows)
+    Output:
+        planned query set
+    """
+    select, prefetch, columns = [], [], []
+    restricted = _plan(queryset.model, serializer_class, list(expand), list(fields), list(omit), '', select, prefetch, columns)
+
+    prepare = getattr(serializer_class, 'prepare_queryset', None)
+    if prepare is not None:
+        queryset = prepare(queryset)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if restricted:
+        queryset = queryset.only(*columns, *required)
+    return queryset
+
+
+def plan_view_queryset(queryset, view):
+    """
+    Method to plan the query set of a view from its serializer class and the request query params.
+    Input:
+        queryset => query set returned by the view
+        view => view (list actions of FlexFieldsMixin views honour permit_list_expands)
+    Output:
+        planned query set
+    """
+    permitted = None
+    if getattr(view, 'action', None) == 'list' and hasattr(view, 'permit_list_expands'):
+        permitted = view.permit_list_expands
+    options = get_flex_options(view.request, permitted)
+    return plan_queryset(queryset, view.get_serializer_class(),
+                         options[EXPAND_PARAM], options[FIELDS_PARAM], options[OMIT_PARAM])
+
+
+def get_expanded_fields(serializer_class, expand, fields, omit):
+    """
+    Method to work out which expandable fields of the serializer are expanded at this level, mirroring
+    drf-flex-fields (a field removed by fields / omit is not expanded).
+    Output:
+        list of (name, nested serializer class, nested expand, nested fields, nested omit)
+    """
+    expandable = getattr(getattr(serializer_class, 'Meta', None), 'expandable_fields', None)
+    if expandable is None:
+        expandable = getattr(serializer_class, 'expandable_fields', {})
+
+    expand_fields, next_expand = split_levels(expand)
+    sparse_fields, next_fields = split_levels(fields)
+    omit_fields, next_omit = split_levels(omit)
+    if _is_wildcard(expand_fields):
+        expand_fields = expandable.keys()
+
+    expanded = []
+    for name in expand_fields:
+        if name not in expandable:
+            continue
+        if name in omit_fields and name not in next_omit:
+            continue
+        if sparse_fields and not _is_wildcard(sparse_fields) and name not in sparse_fields:
+            continue
+        options = expandable[name]
+        nested_class = options[0] if isinstance(options, tuple) else options
+        if isinstance(nested_class, str):
+            nested_class = _resolve_serializer(nested_class)
+        expanded.append((name, nested_class, next_expand.get(name, []), next_fields.get(name, []), next_omit.get(name, [])))
+    return expanded
+
+
+def get_columns(model, serializer_class, fields, omit, expanded):
+    """
+    Method to translate the sparse fieldset of one level into the model columns the serializer reads.
+    Input:
+        model => model serialized at this level
+        serializer_class => serializer used at this level
+        fields, omit => flex fields options of this level
+        expanded => names of the fields expanded at this level
+    Output:
+        list of column names or None when every column has to be loaded
+    """
+    sparse_fields, _ = split_levels(fields)
+    omit_fields, next_omit = split_levels(omit)
+    if (not sparse_fields or _is_wildcard(sparse_fields)) and not omit_fields:
+        return None
+
+    meta = getattr(serializer_class, 'Meta', None)
+    names = getattr(meta, 'fields', None)
+    if not isinstance(names, (list, tuple)):
+        return None
+    names = [name for name in names if name not in expanded] + list(expanded)
+    extra_columns = getattr(meta, 'extra_columns', {})
+
+    columns = []
+    for name in names:
+        if name in omit_fields and name not in next_omit:
+            continue
+        if sparse_fields and not _is_wildcard(sparse_fields) and name not in sparse_fields:
+            continue
+        columns.extend(extra_columns.get(name, ()))
+        if name == 'pk':
+            continue
+
+        relation = get_relation(model, name)
+        if relation is not None:
+            #only forward relations have a column on this model, many relations are prefetched
+            if relation.concrete and (relation.many_to_one or relation.one_to_one):
+                columns.append(name)
+            continue
+
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            #not backed by a column (e.g. a method field), the serializer may read anything
+            return None
+        columns.append(name)
+        #image fields need their point of interest column to build renditions
+        if getattr(field, 'ppoi_field', None):
+            columns.append(field.ppoi_field)
+    return columns
+
+
+def _plan(model, serializer_class, expand, fields, omit, prefix, select, prefetch, columns):
+    """
+    Method to plan one level (the root query set or a joined relation) and recurse into its expands.
+    Output:
+        True if the columns of this level or of a joined level are restricted
+    """
+    expanded = get_expanded_fields(serializer_class, expand, fields, omit)
+    level_columns = get_columns(model, serializer_class, fields, omit, [name for name, *_ in expanded])
+    restricted = level_columns is not None
+    if restricted:
+        columns.extend(prefix + column for column in level_columns)
+    elif not prefix:
+        #the root level lists every column so that joined levels can still be restricted
+        columns.extend(field.name for field in model._meta.concrete_fields)
+
+    for name, nested_class, nested_expand, nested_fields, nested_omit in expanded:
+        relation = get_relation(model, name)
+        if relation is None:
+            continue
+
+        is_flex = issubclass(nested_class, FlexFieldsSerializerMixin)
+        if relation.many_to_one or (relation.one_to_one and relation.concrete):
+            #single valued relation, join it and keep planning on the same query
+            select.append(prefix + name)
+            if is_flex:
+                restricted |= _plan(relation.related_model, nested_class, nested_expand, nested_fields, nested_omit,
+                                    prefix + name + '__', select, prefetch, columns)
+        else:
+            #many valued relation, prefetch it with its own planned query set
+            nested_queryset = relation.related_model._default_manager.all()
+            if is_flex:
+                #reverse foreign keys need their own foreign key column to attach the rows to their parent
+                required = [relation.field.name] if relation.one_to_many else []
+                nested_queryset = plan_queryset(nested_queryset, nested_class, nested_expand, nested_fields, nested_omit, required)
+            prefetch.append(Prefetch(prefix + name, queryset=nested_queryset))
+    return restricted
+
+
+def get_relation(model, name):
+    """
+    Method to find the relation a serializer field name refers to. Reverse relations are looked up by
+    their accessor (related_name), which is what serializers and prefetch_related use.
+    Output:
+        relation field or None if name is not a relation of the model
+    """
+    for field in model._meta.get_fields():
+        if not field.is_relation:
+            continue
+        accessor = field.get_accessor_name() if field.auto_created and not field.concrete else field.name
+        if accessor == name:
+            return field
+    return None
+
+
+def _resolve_serializer(path):
+    """
+    Method to import a serializer from a lazy string the way drf-flex-fields does ('event.EventSerializer'
+    resolves to event.serializers.EventSerializer).
+    """
+    module_path, class_name = path.rsplit('.', 1)
+    for candidate in (module_path, module_path + '.serializers'):
+        try:
+            return getattr(importlib.import_module(candidate), class_name)
+        except (ImportError, AttributeError):
+            continue
+    raise ImportError('Could not resolve serializer %s' % path)
+
+
+def _is_wildcard(values):
+    return WILDCARD_VALUES is not None and bool(set(values) & set(WILDCARD_VALUES))
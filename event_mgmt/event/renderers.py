@@ -0,0 +1,84 @@
+import codecs
+from io import BytesIO
+from django.conf import settings
+from rest_framework import renderers
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:
+    #orjson is optional, the renderer and parser below behave exactly like the DRF ones without it
+    orjson = None
+
+
+#JavaScript line terminators, escaped by DRF so that JSON can be embedded in <script> tags
+_LINE_SEPARATOR = ('\u2028'.encode(), b'\\u2028')
+_PARAGRAPH_SEPARATOR = ('\u2029'.encode(), b'\\u2029')
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    JSON renderer encoding with orjson when it is installed. Compact responses come out byte for byte as with
+    DRF's JSONRenderer: values orjson does not know natively (dates, Decimals, lazy strings...) go through
+    DRF's JSONEncoder, U+2028 / U+2029 are escaped the same way. Indented responses (browsable API,
+    ?indent in the Accept header) and payloads orjson rejects (e.g. integers beyond 64 bits) fall back to DRF.
+    Note that floats in exponent notation are written as 1e16 rather than 1e+16 (same number) and that
+    NaN / Infinity are written as null.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Method to render data into JSON bytes.
+        Input:
+            data => data to render
+            accepted_media_type => media type accepted by the client (may carry an indent param)
+            renderer_context => context of the view
+        Output:
+            JSON bytes
+        """
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        renderer_context = renderer_context or {}
+        #pretty printed, ASCII only or non compact output is left to DRF
+        if self.get_indent(accepted_media_type or '', renderer_context) or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            #let DRF encode it (and raise the usual error if it cannot either)
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if _LINE_SEPARATOR[0] in ret or _PARAGRAPH_SEPARATOR[0] in ret:
+            ret = ret.replace(*_LINE_SEPARATOR).replace(*_PARAGRAPH_SEPARATOR)
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSON parser decoding with orjson when it is installed. Bodies orjson rejects (or that are not UTF-8)
+    are handed to DRF's JSONParser, so error messages stay the same.
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """
+        Method to parse a JSON request body.
+        Input:
+            stream => request body stream
+            media_type => content type of the request
+            parser_context => context of the view
+        Output:
+            parsed data
+        """
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(BytesIO(body), media_type, parser_context)
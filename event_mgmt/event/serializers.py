@@ -21,12 +21,54 @@ class EventSerializer(FlexFieldsModelSerializer):
     """
     class Meta:
         model = Event
-        fields = ['pk', 'name', 'description', 'expiration', 'seats', 'created', 'updated']
+        fields = ['pk', 'name', 'description', 'expiration', 'seats', 'capacity', 'tickets_sold', 'created', 'updated']
+        #capacity and tickets_sold are maintained by bookings, admins set the seats left
+        read_only_fields = ['capacity', 'tickets_sold']
+        #unique names are enforced by the unique index on save (see EventViewSet.create_event), not looked up first
+        extra_kwargs = {'name': {'validators': []}, 'seats': {'min_value': 0}}
         expandable_fields = {
             'tickets': ('event.TicketSerializer', {'many':True}),
             'category': ('event.CategorySerializer', {'many': True}),
             'image': ('event.ImageSerializer', {'many': True}),
         }
+        #columns read by to_representation besides the field itself (used when only() is planned)
+        extra_columns = {
+            'seats': ('shard_count',),
+            'tickets_sold': ('shard_count', 'capacity', 'seats_held'),
+        }
+        #values() columns read by the fast list serializer instead of the field source (see event/fast.py)
+        fast_columns = {
+            'seats': 'shard_seats',
+            'tickets_sold': 'shard_tickets_sold',
+        }
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        """
+        Hook used by the query planner so that nested event lists also get their remaining seats annotated.
+        Input:
+            queryset ==> event query set
+        Output:
+            query set annotated with the shard seat totals
+        """
+        return queryset.with_remaining_seats()
+
+    def to_representation(self, instance):
+        """
+        Method to represent an event. Sharded events show the total of their shards as seats
+        (and the matching number of sold tickets).
+        Input:
+            instance ==> event instance
+        Output:
+            dictionary representing the event
+        """
+        data = super().to_representation(instance)
+        if instance.shard_count:
+            if 'seats' in data:
+                data['seats'] = instance.remaining_seats
+            if 'tickets_sold' in data:
+                data['tickets_sold'] = instance.sold_tickets
+        return data
 
 class TicketSerializer(FlexFieldsModelSerializer):
     """
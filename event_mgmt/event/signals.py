@@ -0,0 +1,51 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .cache import bump_versions
+from .models import Category, Event, Image, Ticket
+
+
+@receiver([post_save, post_delete], sender=Event)
+def invalidate_event(sender, instance, **kwargs):
+    """
+    Invalidates the cached event list and the cached details of the saved / deleted event
+    """
+    bump_versions('events', 'event:%s' % instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Ticket)
+def invalidate_ticket_event(sender, instance, **kwargs):
+    """
+    Tickets change the seats (and the expanded tickets) of their event and the ticket list of their user
+    """
+    bump_versions('events', 'event:%s' % instance.event_id, 'tickets:%s' % instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_taxonomy(sender, instance, **kwargs):
+    """
+    Categories can be expanded in any event, invalidate every cached event response
+    """
+    bump_versions('events', 'taxonomy')
+
+
+@receiver([post_save, post_delete], sender=Image)
+def invalidate_image(sender, instance, **kwargs):
+    """
+    Images can be expanded in any event and are listed on their own
+    """
+    bump_versions('events', 'taxonomy', 'images')
+
+
+@receiver(m2m_changed, sender=Event.category.through)
+@receiver(m2m_changed, sender=Event.image.through)
+def invalidate_event_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the events whose categories or images were added / removed
+    """
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        #changed from the category / image side, pk_set holds the events (None when cleared)
+        bump_versions('events', 'taxonomy', *['event:%s' % pk for pk in pk_set or ()])
+    else:
+        bump_versions('events', 'event:%s' % instance.pk)
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from .renderers import FastJSONRenderer
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for row in iterable:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class StreamingListMixin:
+    """
+    Lets admin clients export a whole list with ?stream=true. The rows are read with iterator(), serialized
+    chunk by chunk (EVENT_STREAM_CHUNK_SIZE rows) and written out as one JSON array through a
+    StreamingHttpResponse, so memory use does not grow with the number of rows. Streamed lists are
+    neither paginated nor cached.
+    """
+    stream_query_param = 'stream'
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.stream_query_param, '').lower() not in ('true', '1'):
+            return super().list(request, *args, **kwargs)
+
+        #check to ensure only admin is able to export whole tables
+        if request.user.is_superuser == False or request.user.is_staff == False:
+            return Response({"status":"error", "data":"You don't have permission to stream this list"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        #same order as the pages of the paginated list
+        if self.paginator is not None and hasattr(self.paginator, 'get_ordering'):
+            queryset = queryset.order_by(*[('-' if desc else '') + name
+                                           for name, desc in self.paginator.get_ordering(queryset.model)])
+        return StreamingHttpResponse(self.stream_rows(queryset), content_type='application/json')
+
+    def stream_rows(self, queryset):
+        """
+        Method to yield the JSON array of the serialized query set piece by piece.
+        Input:
+            queryset => filtered and planned query set
+        Output:
+            generator of JSON bytes
+        """
+        chunk_size = getattr(settings, 'EVENT_STREAM_CHUNK_SIZE', 2000)
+        renderer = FastJSONRenderer()
+        fast = self.get_fast_serializer() if hasattr(self, 'get_fast_serializer') else None
+
+        if fast is not None:
+            rows = fast.values(queryset).iterator(chunk_size=chunk_size)
+            serialize = fast.serialize
+        else:
+            #iterator() does not prefetch, the planned lookups are run for every chunk instead
+            lookups = queryset._prefetch_related_lookups
+            rows = queryset.iterator(chunk_size=chunk_size)
+
+            def serialize(chunk):
+                if lookups:
+                    prefetch_related_objects(chunk, *lookups)
+                return self.get_serializer(chunk, many=True).data
+
+        yield b'['
+        separator = b''
+        for chunk in _chunks(rows, chunk_size):
+            #each chunk is rendered as an array, only its items are written out
+            yield separator + renderer.render(serialize(chunk))[1:-1]
+            separator = b','
+        yield b']'
@@ -1,17 +1,57 @@
 import json
+import datetime
+import decimal
+import hashlib
+from io import BytesIO, StringIO
+from unittest import mock
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
 
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from .models import Event, Ticket
+from .models import Category, Event, EventSeatShard, SeatHold, Ticket, WaitlistEntry
+from .booking import (book_many, cancel_tickets, distribute_seats, hold_seat, reconcile_seats, verify_event_counters,
+                      BookingError)
+from .admission import get_admission_cache, get_booking_slots
+from .group_commit import GroupCommitQueue
+from .idempotency import get_idempotency_cache, idempotency_cache_key
+from .pagination import KeysetPagination
+from .throttling import TokenBucketStore, get_throttle_store
+from .cache import cached_response, get_cache, get_version_cache, get_versions, versions_shared
+from . import renderers
+from .fast import compile_serializer
+from .serializers import CategorySerializer, EventSerializer, TicketSerializer
 
 from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
-from .views import EventViewSet, TicketViewSet, register_event
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from .views import (EventViewSet, TicketViewSet, confirm_seat_hold, join_event_waitlist, register_event, register_events_bulk,
+                    seat_hold)
 
+#throttle buckets of the tests, clearing them must not refill the buckets of a server running on the host
+THROTTLE_FILE = os.path.join(tempfile.mkdtemp(), "throttle.bin")
+
+
+@override_settings(EVENT_THROTTLE_FILE=THROTTLE_FILE)
 class EventViewSetAPITestCase(APITestCase):
     url = reverse("auth_logout")
     def setUp(self):
+        get_throttle_store().clear()
         self.username = "tester"
         self.password = "tester123@"
         self.first_name = "test"
@@ -123,6 +163,42 @@ class EventViewSetAPITestCase(APITestCase):
         
         self.assertEqual(201, response.status_code)
         self.assertDictContainsSubset(data, response_contents["data"])
+
+    def test_event_creation_is_idempotent(self):
+        """
+        Test to verify that retries of an event creation with the same Idempotency-Key get the first response back
+        """
+        get_idempotency_cache().clear()
+        event_create = EventViewSet.as_view({'post':'create'})
+        data = {"name":"event", "description":"eventdesc", "seats":10, "expiration":"2022-03-10"}
+
+        def create(data, **headers):
+            request = self.factory.post("", data=data, format="json", **headers)
+            force_authenticate(request, user=self.adminuser)
+            return event_create(request)
+
+        first = create(data, HTTP_IDEMPOTENCY_KEY="create-1")
+        with self.assertNumQueries(0):
+            retry = create(data, HTTP_IDEMPOTENCY_KEY="create-1")
+        self.assertEqual((201, 201), (first.status_code, retry.status_code))
+        self.assertEqual(first.data["data"]["pk"], retry.data["data"]["pk"])
+        self.assertEqual("true", retry["Idempotent-Replayed"])
+        self.assertEqual(1, Event.objects.filter(name="event").count())
+
+        #the same key cannot be reused for another request
+        self.assertEqual(422, create(dict(data, seats=20), HTTP_IDEMPOTENCY_KEY="create-1").status_code)
+        #without a key a duplicate name is caught by the unique index
+        response = create(data)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual("Event already exists", response.data["data"])
+
+        #negative seats are a validation error, not a duplicate
+        response = create(dict(data, name="negative", seats=-3))
+        self.assertEqual(400, response.status_code)
+        self.assertIn("seats", response.data["data"])
+        #other constraint violations are not reported as duplicates
+        with mock.patch.object(EventSerializer, "save", side_effect=IntegrityError), self.assertRaises(IntegrityError):
+            create(dict(data, name="other"))
     def test_admin_can_update_event(self):
         """
         Test to verify that admin can update event
@@ -146,17 +222,294 @@ class EventViewSetAPITestCase(APITestCase):
         
         response_contents = json.loads(response.rendered_content.decode())
         self.assertEqual(200, response.status_code)
+
+    def test_event_list_is_cursor_paginated(self):
+        """
+        Test to verify that events are listed page by page with cursors and without counting the table
+        """
+        for i in range(4):
+            Event.objects.create(name="paged%d" % i, seats=10, expiration="2022-03-20")
+        event_list = EventViewSet.as_view({'get':'list'})
+        expected = list(Event.objects.order_by('-created', '-pk').values_list('pk', flat=True))
+
+        seen, url = [], "/event/?page_size=2"
+        while url:
+            request = self.factory.get(url)
+            force_authenticate(request, user=self.user)
+            with CaptureQueriesContext(connection) as queries:
+                response = event_list(request)
+            self.assertEqual(200, response.status_code)
+            self.assertFalse(any("COUNT(" in query["sql"].upper() or "OFFSET" in query["sql"].upper() for query in queries))
+            seen.extend(event["pk"] for event in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(expected, seen)
+
+        #walking back from the last page returns the previous one
+        request = self.factory.get(response.data["previous"])
+        force_authenticate(request, user=self.user)
+        response = event_list(request)
+        self.assertEqual(expected[2:4], [event["pk"] for event in response.data["results"]])
+
+    def test_event_list_page_size_is_bounded_and_cursor_validated(self):
+        """
+        Test to verify that page_size cannot exceed the maximum and a tampered cursor is rejected
+        """
+        request = self.factory.get("/event/?page_size=100000")
+        force_authenticate(request, user=self.user)
+        response = EventViewSet.as_view({'get':'list'})(request)
+        self.assertEqual(200, response.status_code)
+
+        request = self.factory.get("/event/?cursor=garbage")
+        force_authenticate(request, user=self.user)
+        response = EventViewSet.as_view({'get':'list'})(request)
+        self.assertEqual(404, response.status_code)
+
+
+    def _count_queries(self, view, url, **kwargs):
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request, **kwargs)
+            response.render()
+        self.assertEqual(200, response.status_code)
+        return len(queries)
+
+    def test_nested_expands_run_a_fixed_number_of_queries(self):
+        """
+        Test to verify that the number of queries does not grow with the number of expanded rows
+        """
+        event_detail = EventViewSet.as_view({'get':'retrieve'})
+        ticket_list = TicketViewSet.as_view({'get':'list'})
+        url = "/event/?expand=tickets.user,tickets.event,category,image"
+        self.event.category.add(Category.objects.create(name="music"))
+        Ticket.objects.create(user=self.user, event=self.event)
+        Ticket.objects.create(user=self.adminuser, event=self.event)
+        few_detail = self._count_queries(event_detail, url, pk=self.event.pk)
+        few_list = self._count_queries(ticket_list, "/ticket/?expand=event.category,user")
+
+        for i in range(5):
+            user = User.objects.create_user("attendee%d" % i, "attendee%d@test.com" % i, self.password)
+            Ticket.objects.create(user=user, event=self.event)
+            event = Event.objects.create(name="expand%d" % i, seats=10, expiration="2022-03-20")
+            event.category.add(Category.objects.create(name="category%d" % i))
+            Ticket.objects.create(user=self.user, event=event)
+        self.assertEqual(few_detail, self._count_queries(event_detail, url, pk=self.event.pk))
+        self.assertEqual(few_list, self._count_queries(ticket_list, "/ticket/?expand=event.category,user"))
+
+
+    def test_sparse_fieldsets_only_load_requested_columns(self):
+        """
+        Test to verify that ?fields= is pushed down to the SQL column list, including for expanded relations
+        """
+        Ticket.objects.create(user=self.user, event=self.event)
+        request = self.factory.get("/event/", {"fields": "pk,name,seats,tickets.pk", "expand": "tickets"})
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = EventViewSet.as_view({'get':'list'})(request)
+            response.render()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"pk", "name", "seats", "tickets"}, set(response.data["results"][0]))
+        self.assertEqual([{"pk": Ticket.objects.get().pk}], response.data["results"][0]["tickets"])
+
+        event_query, ticket_query = [query["sql"] for query in queries.captured_queries]
+        self.assertNotIn('"description"', event_query)
+        self.assertNotIn('"updated"', ticket_query)
+        self.assertEqual(2, len(queries))
+
+
+    def test_event_responses_are_cached_until_something_changes(self):
+        """
+        Test to verify that repeated event reads are served from the cache and invalidated by bookings and category changes
+        """
+        event_detail = EventViewSet.as_view({'get':'retrieve'})
+        url = "/event/%d/?expand=category" % self.event.pk
+        self._count_queries(event_detail, url, pk=self.event.pk)
+        self.assertEqual(0, self._count_queries(event_detail, url, pk=self.event.pk))
+
+        self.event.expiration = datetime.date.today() + datetime.timedelta(days=30)
+        self.event.save()
+        request = self.factory.get("")
+        force_authenticate(request, user=self.user)
+        self.assertEqual(200, register_event(request, pk=self.event.pk).status_code)
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        self.assertEqual(9, event_detail(request, pk=self.event.pk).data["seats"])
+
+        self.event.category.add(Category.objects.create(name="sports"))
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        self.assertEqual(["sports"], [category["name"] for category in event_detail(request, pk=self.event.pk).data["category"]])
+
+
+    def test_conditional_get_returns_not_modified(self):
+        """
+        Test to verify that events carry an ETag and Last-Modified and that unchanged events answer 304 without queries
+        """
+        event_detail = EventViewSet.as_view({'get':'retrieve'})
+        request = self.factory.get("/event/%d/" % self.event.pk)
+        force_authenticate(request, user=self.user)
+        response = event_detail(request, pk=self.event.pk)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        request = self.factory.get("/event/%d/" % self.event.pk, HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = event_detail(request, pk=self.event.pk)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(0, len(queries))
+
+        request = self.factory.get("/event/%d/" % self.event.pk, HTTP_IF_MODIFIED_SINCE=last_modified)
+        force_authenticate(request, user=self.user)
+        self.assertEqual(304, event_detail(request, pk=self.event.pk).status_code)
+
+        self.event.description = "changed"
+        self.event.save()
+        request = self.factory.get("/event/%d/" % self.event.pk, HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        response = event_detail(request, pk=self.event.pk)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response["ETag"])
+        self.assertEqual("changed", response.data["description"])
+
+
+    @override_settings(EVENT_VERSIONS_SHARED=False)
+    def test_responses_are_not_cached_without_shared_version_stamps(self):
+        """
+        Test to verify that while the version stamps are local to the process event details are built from the
+        database every time, a change made through another worker (which bumps its own stamps only) shows at once
+        """
+        event_detail = EventViewSet.as_view({'get':'retrieve'})
+
+        def retrieve():
+            request = self.factory.get("/event/%d/" % self.event.pk)
+            force_authenticate(request, user=self.user)
+            return event_detail(request, pk=self.event.pk)
+
+        self.assertEqual(10, retrieve().data["seats"])
+        #written by another worker: nothing is bumped in this process
+        Event.objects.filter(pk=self.event.pk).update(seats=4)
+        self.assertEqual(4, retrieve().data["seats"])
+
+    @override_settings(EVENT_VERSIONS_SHARED=False)
+    def test_no_validators_without_shared_version_stamps(self):
+        """
+        Test to verify that no ETag / Last-Modified is sent while the version stamps are local to the process
+        """
+        request = self.factory.get("/event/%d/" % self.event.pk)
+        force_authenticate(request, user=self.user)
+        response = EventViewSet.as_view({'get':'retrieve'})(request, pk=self.event.pk)
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header("ETag"))
+        self.assertFalse(response.has_header("Last-Modified"))
+
+    def test_fast_serializer_matches_serializers(self):
+        """
+        Test to verify that the fast serializer renders the same JSON as the regular serializers
+        """
+        sharded = Event.objects.create(name="sharded", description="caf\u00e9 \"quoted\"", seats=0, shard_count=2, expiration="2022-03-20")
+        EventSeatShard.objects.create(event=sharded, shard=0, seats=3)
+        EventSeatShard.objects.create(event=sharded, shard=1, seats=4)
+        Ticket.objects.create(user=self.user, event=self.event)
+        Category.objects.create(name="music")
+        cases = [
+            (EventSerializer, Event.objects.with_remaining_seats(), (), ()),
+            (EventSerializer, Event.objects.with_remaining_seats(), ("pk", "seats"), ()),
+            (EventSerializer, Event.objects.with_remaining_seats(), (), ("description", "updated")),
+            (TicketSerializer, Ticket.objects.all(), (), ()),
+            (CategorySerializer, Category.objects.all(), ("name",), ()),
+        ]
+        renderer = JSONRenderer()
+        for serializer_class, queryset, fields, omit in cases:
+            queryset = queryset.order_by('pk')
+            fast = compile_serializer(serializer_class, fields, omit)
+            expected = serializer_class(queryset, many=True, fields=list(fields), omit=list(omit)).data
+            self.assertEqual(renderer.render(expected), renderer.render(fast.serialize(fast.values(queryset))))
+
+    def test_event_list_fast_path_matches_regular_path(self):
+        """
+        Test to verify that flat event lists are served by the fast path with the same response body
+        """
+        event = Event.objects.create(name="sharded", seats=0, shard_count=1, expiration="2022-03-20")
+        EventSeatShard.objects.create(event=event, shard=0, seats=5)
+        event_list = EventViewSet.as_view({'get':'list'})
+        for url in ("/event/", "/event/?fields=pk,seats&page_size=1", "/event/?expand=category"):
+            bodies = []
+            for fast in (True, False):
+                get_cache().clear()
+                request = self.factory.get(url)
+                force_authenticate(request, user=self.user)
+                with override_settings(EVENT_FAST_SERIALIZATION=fast):
+                    response = event_list(request)
+                    response.render()
+                self.assertEqual(200, response.status_code)
+                bodies.append(response.content)
+            self.assertEqual(bodies[0], bodies[1])
+
+
+    def test_admin_can_stream_whole_event_list(self):
+        """
+        Test to verify that ?stream=true returns every event as one JSON array, chunk by chunk, and only to admins
+        """
+        for i in range(4):
+            event = Event.objects.create(name="streamed%d" % i, seats=10, expiration="2022-03-20")
+            event.category.add(Category.objects.create(name="category%d" % i))
+        expected = list(Event.objects.order_by('-created', '-pk').values_list('pk', flat=True))
+        event_list = EventViewSet.as_view({'get':'list'})
+
+        request = self.factory.get("/event/?stream=true")
+        force_authenticate(request, user=self.user)
+        self.assertEqual(401, event_list(request).status_code)
+
+        for url in ("/event/?stream=true", "/event/?stream=true&expand=category"):
+            request = self.factory.get(url)
+            force_authenticate(request, user=self.adminuser)
+            with override_settings(EVENT_STREAM_CHUNK_SIZE=2):
+                response = event_list(request)
+                self.assertTrue(response.streaming)
+                with CaptureQueriesContext(connection) as queries:
+                    events = json.loads(b"".join(response.streaming_content))
+            self.assertEqual(expected, [event["pk"] for event in events])
+            self.assertEqual(EventSerializer(Event.objects.get(pk=expected[0])).data["name"], events[0]["name"])
+        self.assertEqual(["category3"], [category["name"] for category in events[0]["category"]])
+        #one query for the rows plus one category prefetch per chunk
+        self.assertEqual(4, len(queries))
+
+
+    def test_open_listing_only_shows_events_open_for_registration(self):
+        """
+        Test to verify that ?open=true leaves out expired and sold out events
+        """
+        upcoming = datetime.date.today() + datetime.timedelta(days=30)
+        live = Event.objects.create(name="live", seats=5, expiration=upcoming)
+        Event.objects.create(name="soldout", seats=0, expiration=upcoming)
+        Event.objects.create(name="today", seats=5, expiration=datetime.date.today())
+        event_list = EventViewSet.as_view({'get':'list'})
+
+        request = self.factory.get("/event/?open=true")
+        force_authenticate(request, user=self.user)
+        response = event_list(request)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([live.pk], [event["pk"] for event in response.data["results"]])
+
+        request = self.factory.get("/event/")
+        force_authenticate(request, user=self.user)
+        self.assertEqual(4, len(event_list(request).data["results"]))
+
     
+@override_settings(EVENT_THROTTLE_FILE=THROTTLE_FILE)
 class TicketModelViewSetAPITestCase(APITestCase):
     
     def setUp(self):
+        get_throttle_store().clear()
         self.username = "tester"
         self.password = "tester123@"
         self.first_name = "test"
         self.last_name = "test"
         self.email = "test@test.com"
         self.user = User.objects.create_user(self.username, self.email, self.password)
-        self.event = Event.objects.create(name="testevent", seats=10, expiration="2022-03-20")
+        #registration is only open for events expiring after today
+        self.upcoming = datetime.date.today() + datetime.timedelta(days=30)
+        self.event = Event.objects.create(name="testevent", seats=10, expiration=self.upcoming)
         self.url = reverse( "event_register" , kwargs={"pk":self.user.pk})
 
         self.factory = APIRequestFactory()
@@ -215,11 +568,12 @@ class TicketModelViewSetAPITestCase(APITestCase):
         response = self.client.post(reverse("token_obtain_pair"), {"username": self.username, "password": self.password})
         contents = json.loads(response.content.decode())
         request = self.factory.get(self.url)
-        force_authenticate(request, user=self.adminuser, token=contents["access"])
-        event = Event.objects.create(name="testevent3", seats=10, expiration="2022-03-14")
+        force_authenticate(request, user=self.user, token=contents["access"])
+        event = Event.objects.create(name="testevent3", seats=10, expiration=self.upcoming)
         ticket = Ticket.objects.create(user=self.user, event=event)
-        response = register_event(request, pk=self.user.pk)
+        response = register_event(request, pk=event.pk)
         self.assertEqual(400, response.status_code)
+        self.assertEqual("Event already regsitered", response.data["data"])
     
     def test_authenticated_users_can_register_for_new_event(self):
         """
@@ -259,4 +613,776 @@ class TicketModelViewSetAPITestCase(APITestCase):
         response = ticket_list(request)
         response_contents = json.loads(response.rendered_content.decode())
        
-        self.assertEqual(200, response.status_code)
\ No newline at end of file
+        self.assertEqual(200, response.status_code)
+
+    def test_registration_never_overbooks_event(self):
+        """
+        Test to verify that once the last seat is taken further registrations are rejected and seats never go negative
+        """
+        event = Event.objects.create(name="lastseat", seats=1, expiration=self.upcoming)
+        request = self.factory.get(self.url)
+        force_authenticate(request, user=self.user)
+        response = register_event(request, pk=event.pk)
+        self.assertEqual(200, response.status_code)
+
+        request = self.factory.get(self.url)
+        force_authenticate(request, user=self.adminuser)
+        response = register_event(request, pk=event.pk)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual("Event registration full", response.data["data"])
+
+        event.refresh_from_db()
+        self.assertEqual(0, event.seats)
+        self.assertEqual(1, Ticket.objects.filter(event=event).count())
+
+    def test_duplicate_registration_does_not_consume_seat(self):
+        """
+        Test to verify that registering twice for the same event is rejected and the seat is given back
+        """
+        for expected_status in (200, 400):
+            request = self.factory.get(self.url)
+            force_authenticate(request, user=self.user)
+            response = register_event(request, pk=self.event.pk)
+            self.assertEqual(expected_status, response.status_code)
+
+        self.event.refresh_from_db()
+        self.assertEqual(9, self.event.seats)
+        self.assertEqual(1, Ticket.objects.filter(user=self.user, event=self.event).count())
+
+    def test_ticket_is_unique_per_user_and_event(self):
+        """
+        Test to verify that the database rejects a second ticket for the same user and event
+        """
+        Ticket.objects.create(user=self.user, event=self.event)
+        with self.assertRaises(IntegrityError):
+            Ticket.objects.create(user=self.user, event=self.event)
+
+    def test_sharded_event_bookings_are_reflected_in_seats(self):
+        """
+        Test to verify that an admin can shard the seats of an event and bookings draw from the shards
+        """
+        data = {"description": "eventdesc", "seats": 10, "expiration": self.upcoming.isoformat(), "shard_count": 4}
+        request = self.factory.put("", data=data, format="json")
+        force_authenticate(request, user=self.adminuser)
+        response = EventViewSet.as_view({'put':'update'})(request, pk=self.event.pk)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([3, 3, 2, 2], list(EventSeatShard.objects.filter(event=self.event).order_by('shard').values_list('seats', flat=True)))
+
+        request = self.factory.get(self.url)
+        force_authenticate(request, user=self.user)
+        response = register_event(request, pk=self.event.pk)
+        self.assertEqual(200, response.status_code)
+
+        request = self.factory.get("")
+        force_authenticate(request, user=self.user)
+        response = EventViewSet.as_view({'get':'retrieve'})(request, pk=self.event.pk)
+        self.assertEqual(9, response.data["seats"])
+
+        #Event.seats only catches up once the shards are reconciled, cached responses of the event are invalidated
+        versions = get_versions("events", "event:%s" % self.event.pk)
+        self.assertEqual(1, reconcile_seats())
+        new_versions = get_versions("events", "event:%s" % self.event.pk)
+        self.assertTrue(all(versions[scope] != new_versions[scope] for scope in versions))
+        self.event.refresh_from_db()
+        self.assertEqual(9, self.event.seats)
+
+    def test_invalid_shard_count_is_rejected(self):
+        """
+        Test to verify that an update with a negative, too large or non numeric shard count fails with 400
+        """
+        for shard_count in (-1, settings.EVENT_MAX_SHARDS + 1, 40000, "many"):
+            data = {"description": "eventdesc", "seats": 10, "expiration": self.upcoming.isoformat(), "shard_count": shard_count}
+            request = self.factory.put("", data=data, format="json")
+            force_authenticate(request, user=self.adminuser)
+            response = EventViewSet.as_view({'put':'update'})(request, pk=self.event.pk)
+            self.assertEqual(400, response.status_code)
+            self.assertEqual("error", response.data["status"])
+        self.event.refresh_from_db()
+        self.assertEqual(0, self.event.shard_count)
+
+    def test_sharded_event_cannot_be_overbooked(self):
+        """
+        Test to verify that bookings fall back to other shards and stop once every shard is empty
+        """
+        event = Event.objects.create(name="shardedevent", seats=0, shard_count=3, expiration=self.upcoming)
+        EventSeatShard.objects.bulk_create([EventSeatShard(event=event, shard=0, seats=0),
+                                            EventSeatShard(event=event, shard=1, seats=0),
+                                            EventSeatShard(event=event, shard=2, seats=1)])
+        for user, expected_status in ((self.user, 200), (self.adminuser, 400)):
+            request = self.factory.get(self.url)
+            force_authenticate(request, user=user)
+            response = register_event(request, pk=event.pk)
+            self.assertEqual(expected_status, response.status_code)
+
+        self.assertEqual(0, event.remaining_seats)
+
+    def test_registration_queue_admits_users_at_configured_rate(self):
+        """
+        Test to verify that the waiting room admits EVENT_ADMISSION_RATE users per second and answers the others with 429
+        """
+        get_admission_cache().clear()
+        users = [User.objects.create_user("queued%d" % i, "", self.password) for i in range(7)]
+
+        def register(user):
+            request = self.factory.get(self.url)
+            force_authenticate(request, user=user)
+            return register_event(request, pk=self.event.pk)
+
+        with override_settings(EVENT_ADMISSION_RATE=1, EVENT_ADMISSION_BURST=2), \
+                mock.patch("event.admission.time") as clock:
+            clock.time.return_value = 1000.0
+            self.assertEqual([200, 200], [register(user).status_code for user in users[:2]])
+            response = register(users[2])
+            self.assertEqual(429, response.status_code)
+            self.assertEqual("1", response["Retry-After"])
+            self.assertEqual(3, response.data["data"]["position"])
+            #retries keep their position
+            self.assertEqual(3, register(users[2]).data["data"]["position"])
+            self.assertEqual((4, 2), (register(users[3]).data["data"]["position"], register(users[3]).data["data"]["retry_after"]))
+
+            clock.time.return_value = 1001.0
+            self.assertEqual(200, register(users[2]).status_code)
+
+            #admissions left unused while the queue was idle are not saved up beyond the burst
+            clock.time.return_value = 2000.0
+            self.assertEqual([200, 200, 429], [register(user).status_code for user in users[4:]])
+        self.assertEqual(5, Ticket.objects.filter(event=self.event).count())
+
+    def test_lost_queue_counter_does_not_let_newcomers_ahead(self):
+        """
+        Test to verify that when the position counter of a running queue is lost, new users are queued after
+        every position still in use instead of from 1 again
+        """
+        get_admission_cache().clear()
+        users = [User.objects.create_user("queued%d" % i, "", self.password) for i in range(4)]
+
+        def register(user):
+            request = self.factory.get(self.url)
+            force_authenticate(request, user=user)
+            return register_event(request, pk=self.event.pk)
+
+        with override_settings(EVENT_ADMISSION_RATE=1, EVENT_ADMISSION_BURST=1, EVENT_ADMISSION_POSITION_TIMEOUT=60), \
+                mock.patch("event.admission.time") as clock:
+            clock.time.return_value = 1000.0
+            self.assertEqual([200, 429, 429], [register(user).status_code for user in users[:3]])
+            get_admission_cache().delete("admission:%s:issued" % self.event.pk)
+
+            response = register(users[3])
+            self.assertEqual(429, response.status_code)
+            #positions due after the 60 seconds a position lives cannot be in use
+            self.assertEqual(61, response.data["data"]["position"])
+            self.assertEqual(3, register(users[2]).data["data"]["position"])
+
+    @override_settings(EVENT_ADMISSION_CONCURRENCY=1, EVENT_ADMISSION_SLOT_WAIT=0)
+    def test_registration_is_turned_away_when_booking_slots_are_busy(self):
+        """
+        Test to verify that registrations get 429 at once when every booking slot of the process is taken
+        """
+        request = self.factory.get(self.url)
+        force_authenticate(request, user=self.user)
+        slots = get_booking_slots()
+        slots.acquire()
+        try:
+            response = register_event(request, pk=self.event.pk)
+        finally:
+            slots.release()
+        self.assertEqual(429, response.status_code)
+        self.assertEqual("1", response["Retry-After"])
+        self.assertEqual(200, register_event(request, pk=self.event.pk).status_code)
+
+    def test_bookings_are_throttled_per_user(self):
+        """
+        Test to verify that a user gets 429 on the booking views once their token bucket is empty
+        """
+        rates = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={"booking.user": "2/min", "booking.ip": "100/min"})
+        with self.settings(REST_FRAMEWORK=rates):
+            request = self.factory.get(self.url)
+            force_authenticate(request, user=self.user)
+            self.assertEqual([200, 400], [register_event(request, pk=self.event.pk).status_code for _ in range(2)])
+            response = register_event(request, pk=self.event.pk)
+            self.assertEqual(429, response.status_code)
+            self.assertTrue(int(response["Retry-After"]) > 0)
+
+            #buckets are per user
+            request = self.factory.get(self.url)
+            force_authenticate(request, user=self.adminuser)
+            self.assertEqual(200, register_event(request, pk=self.event.pk).status_code)
+
+    def test_registration_retries_replay_the_first_response(self):
+        """
+        Test to verify that a retried registration is answered from the stored response, and that a duplicate
+        arriving while the first one runs waits for its response
+        """
+        get_idempotency_cache().clear()
+
+        def register(key):
+            request = self.factory.get(self.url, HTTP_IDEMPOTENCY_KEY=key)
+            force_authenticate(request, user=self.user)
+            return register_event(request, pk=self.event.pk)
+
+        first = register("register-1")
+        with self.assertNumQueries(0):
+            retry = register("register-1")
+        self.assertEqual((200, 200), (first.status_code, retry.status_code))
+        self.assertEqual(first.data, retry.data)
+        self.event.refresh_from_db()
+        self.assertEqual(1, self.event.tickets_sold)
+
+        #in flight duplicate: the lock of the key is taken and the response appears a moment later
+        cache = get_idempotency_cache()
+        cache_key = idempotency_cache_key(mock.Mock(user=self.user, method="GET", path=self.url), "register-2")
+        cache.add(cache_key + ":lock", 1)
+
+        def finish():
+            time.sleep(0.05)
+            cache.set(cache_key, {"fingerprint": retry_fingerprint, "status": 200, "data": {"status": "success"}})
+            cache.delete(cache_key + ":lock")
+
+        retry_fingerprint = hashlib.sha1(b"{}").hexdigest()
+        thread = threading.Thread(target=finish)
+        thread.start()
+        with self.assertNumQueries(0):
+            response = register("register-2")
+        thread.join()
+        self.assertEqual((200, {"status": "success"}), (response.status_code, response.data))
+
+        #the first request fails (nothing stored, lock released): the waiting duplicate books the seat itself
+        cache_key = idempotency_cache_key(mock.Mock(user=self.adminuser, method="GET", path=self.url), "register-3")
+        cache.add(cache_key + ":lock", 1)
+
+        def fail():
+            time.sleep(0.05)
+            cache.delete(cache_key + ":lock")
+
+        thread = threading.Thread(target=fail)
+        thread.start()
+        request = self.factory.get(self.url, HTTP_IDEMPOTENCY_KEY="register-3")
+        force_authenticate(request, user=self.adminuser)
+        response = register_event(request, pk=self.event.pk)
+        thread.join()
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(Ticket.objects.filter(user=self.adminuser, event=self.event).exists())
+        self.assertIsNone(cache.get(cache_key + ":lock"))
+
+    def test_stored_responses_outlive_the_response_cache(self):
+        """
+        Test to verify that stored responses are not culled by a burst of other keys or cached responses
+        """
+        get_idempotency_cache().clear()
+        request = self.factory.get(self.url, HTTP_IDEMPOTENCY_KEY="register-1")
+        force_authenticate(request, user=self.user)
+        self.assertEqual(200, register_event(request, pk=self.event.pk).status_code)
+        for i in range(1000):
+            get_idempotency_cache().set("other:%d" % i, i)
+            get_cache().set("response:%d" % i, i)
+
+        request = self.factory.get(self.url, HTTP_IDEMPOTENCY_KEY="register-1")
+        force_authenticate(request, user=self.user)
+        self.assertEqual("true", register_event(request, pk=self.event.pk)["Idempotent-Replayed"])
+
+    def test_book_many_returns_result_per_registration(self):
+        """
+        Test to verify that batched bookings validate every registration and decrement seats once per event
+        """
+        event = Event.objects.create(name="batchevent", seats=1, expiration=self.upcoming)
+        expired = Event.objects.create(name="expiredevent", seats=10, expiration="2022-03-04")
+        results = book_many([(self.user.pk, self.event.pk), (self.user.pk, self.event.pk), (self.user.pk, event.pk),
+                             (self.adminuser.pk, event.pk), (self.user.pk, expired.pk), (self.user.pk, 1000)])
+
+        self.assertIsInstance(results[0], Ticket)
+        self.assertEqual("Event already regsitered", str(results[1]))
+        self.assertIsInstance(results[2], Ticket)
+        self.assertEqual("Event registration full", str(results[3]))
+        self.assertEqual("Event already over or ongoing. Cannot register now", str(results[4]))
+        self.assertEqual("Event does not exists", str(results[5]))
+
+        self.event.refresh_from_db()
+        event.refresh_from_db()
+        self.assertEqual((9, 0), (self.event.seats, event.seats))
+        self.assertEqual(2, Ticket.objects.filter(user=self.user).count())
+
+    @override_settings(EVENT_GROUP_COMMIT=True, EVENT_GROUP_COMMIT_WINDOW=0)
+    def test_register_event_in_group_commit_mode(self):
+        """
+        Test to verify that registration still works end to end when bookings go through the group commit queue
+        """
+        for expected_status in (200, 400):
+            request = self.factory.get(self.url)
+            force_authenticate(request, user=self.user)
+            response = register_event(request, pk=self.event.pk)
+            self.assertEqual(expected_status, response.status_code)
+
+        self.event.refresh_from_db()
+        self.assertEqual(9, self.event.seats)
+
+
+    def test_only_admin_can_register_in_bulk(self):
+        """
+        Test to verify that regular users cannot use the bulk registration endpoint
+        """
+        data = {"registrations": [{"user": self.user.pk, "event": self.event.pk}]}
+        request = self.factory.post(reverse("event_register_bulk"), data=data, format="json")
+        force_authenticate(request, user=self.user)
+        response = register_events_bulk(request)
+        self.assertEqual(401, response.status_code)
+        self.assertFalse(Ticket.objects.exists())
+
+    def test_admin_can_register_many_users_in_bulk(self):
+        """
+        Test to verify that the bulk endpoint books valid registrations and reports a result for every item
+        """
+        users = [User.objects.create_user("bulk%d" % i, "bulk%d@test.com" % i, self.password) for i in range(3)]
+        data = {"registrations": [{"user": user.pk, "event": self.event.pk} for user in users]
+                + [{"user": users[0].pk, "event": self.event.pk}, {"user": "x"}]}
+        request = self.factory.post(reverse("event_register_bulk"), data=data, format="json")
+        force_authenticate(request, user=self.adminuser)
+        response = register_events_bulk(request)
+        self.assertEqual(200, response.status_code)
+
+        statuses = [result["status"] for result in response.data["data"]]
+        self.assertEqual(["success", "success", "success", "error", "error"], statuses)
+        self.assertEqual("Event already regsitered", response.data["data"][3]["data"])
+        self.assertEqual(set(Ticket.objects.values_list("pk", flat=True)),
+                         {result["pk"] for result in response.data["data"][:3]})
+        self.event.refresh_from_db()
+        self.assertEqual(7, self.event.seats)
+
+    def test_event_counters_follow_bookings_cancellations_and_edits(self):
+        """
+        Test to verify that capacity and tickets_sold stay in step with registrations, cancellations and admin edits
+        """
+        request = self.factory.get("")
+        force_authenticate(request, user=self.user)
+        ticket_pk = register_event(request, pk=self.event.pk).data["data"]["pk"]
+        book_many([(self.adminuser.pk, self.event.pk)])
+        self.event.refresh_from_db()
+        self.assertEqual((8, 2, 10), (self.event.seats, self.event.tickets_sold, self.event.capacity))
+
+        request = self.factory.delete("")
+        force_authenticate(request, user=self.user)
+        response = TicketViewSet.as_view({'delete':'destroy'})(request, pk=ticket_pk)
+        self.assertEqual(204, response.status_code)
+        self.event.refresh_from_db()
+        self.assertEqual((9, 1, 10), (self.event.seats, self.event.tickets_sold, self.event.capacity))
+
+        data = {"description": "eventdesc", "seats": 20, "expiration": self.upcoming.isoformat()}
+        request = self.factory.put("", data=data, format="json")
+        force_authenticate(request, user=self.adminuser)
+        EventViewSet.as_view({'put':'update'})(request, pk=self.event.pk)
+        request = self.factory.get("")
+        force_authenticate(request, user=self.user)
+        response = EventViewSet.as_view({'get':'retrieve'})(request, pk=self.event.pk)
+        self.assertEqual((20, 1, 21), (response.data["seats"], response.data["tickets_sold"], response.data["capacity"]))
+        self.assertEqual([], verify_event_counters())
+
+    def test_verify_event_counters_repairs_drift(self):
+        """
+        Test to verify that counters which drifted from the tickets table are reported and repaired
+        """
+        sharded = Event.objects.create(name="sharded", seats=6, expiration=self.upcoming)
+        distribute_seats(sharded, 2, 6)
+        book_many([(self.user.pk, sharded.pk)])
+        self.assertEqual([], verify_event_counters())
+
+        #tickets inserted behind the booking code's back
+        Ticket.objects.create(user=self.user, event=self.event)
+        Ticket.objects.create(user=self.adminuser, event=self.event)
+        self.assertEqual([self.event.pk], verify_event_counters())
+
+        out = StringIO()
+        call_command("verify_event_counters", "--repair", stdout=out)
+        self.assertIn("Repaired the counters of 1 event(s)", out.getvalue())
+        self.event.refresh_from_db()
+        self.assertEqual((10, 2, 12), (self.event.seats, self.event.tickets_sold, self.event.capacity))
+        self.assertEqual([], verify_event_counters())
+
+    def test_waitlist_is_promoted_when_tickets_are_cancelled(self):
+        """
+        Test to verify that users join the waitlist of a sold out event and get the cancelled seats first come first served
+        """
+        event = Event.objects.create(name="soldout", seats=2, expiration=self.upcoming)
+        attendees = [User.objects.create_user("attendee%d" % i, "attendee%d@test.com" % i, self.password) for i in range(2)]
+        waiting = [User.objects.create_user("waiting%d" % i, "waiting%d@test.com" % i, self.password) for i in range(3)]
+        tickets = book_many([(user.pk, event.pk) for user in attendees])
+
+        positions = []
+        for user in waiting + [waiting[0]]:
+            request = self.factory.get("")
+            force_authenticate(request, user=user)
+            response = join_event_waitlist(request, pk=event.pk)
+            self.assertEqual(200, response.status_code)
+            positions.append(response.data["data"]["position"])
+        self.assertEqual([1, 2, 3, 1], positions)
+
+        #ticket holders and events with seats left cannot be waited for
+        for user, pk in ((attendees[0], event.pk), (self.user, self.event.pk)):
+            request = self.factory.get("")
+            force_authenticate(request, user=user)
+            self.assertEqual(400, join_event_waitlist(request, pk=pk).status_code)
+
+        self.assertEqual(2, cancel_tickets([ticket.pk for ticket in tickets]))
+        self.assertEqual({waiting[0].pk, waiting[1].pk}, set(Ticket.objects.filter(event=event).values_list("user", flat=True)))
+        self.assertEqual([waiting[2].pk], list(WaitlistEntry.objects.filter(event=event).values_list("user", flat=True)))
+        event.refresh_from_db()
+        self.assertEqual((0, 2, 2), (event.seats, event.tickets_sold, event.capacity))
+
+        #seats added by an admin go to the waitlist as well
+        data = {"description": "eventdesc", "seats": 3, "expiration": self.upcoming.isoformat()}
+        request = self.factory.put("", data=data, format="json")
+        force_authenticate(request, user=self.adminuser)
+        EventViewSet.as_view({'put':'update'})(request, pk=event.pk)
+        self.assertFalse(WaitlistEntry.objects.exists())
+        event.refresh_from_db()
+        self.assertEqual((2, 3, 5), (event.seats, event.tickets_sold, event.capacity))
+
+    def test_mass_cancellation_runs_a_fixed_number_of_queries(self):
+        """
+        Test to verify that cancelling a group of tickets and promoting the waitlist does not cost a query per seat
+        """
+        def cancel_group(size):
+            event = Event.objects.create(name="group%d" % size, seats=size, expiration=self.upcoming)
+            users = [User.objects.create_user("group%d-%d" % (size, i), "", self.password) for i in range(2 * size)]
+            tickets = book_many([(user.pk, event.pk) for user in users[:size]])
+            WaitlistEntry.objects.bulk_create([WaitlistEntry(user=user, event=event) for user in users[size:]])
+            with CaptureQueriesContext(connection) as queries:
+                cancel_tickets([ticket.pk for ticket in tickets])
+            self.assertEqual(size, Ticket.objects.filter(event=event, user__in=users[size:]).count())
+            return len(queries)
+
+        self.assertEqual(cancel_group(2), cancel_group(6))
+
+    def test_seat_hold_conflict_with_a_vanished_hold_is_a_booking_error(self):
+        """
+        Test to verify that a hold colliding with a concurrent hold of the same user that is released before it can
+        be read fails with BookingError instead of a server error, and takes no seat
+        """
+        with mock.patch.object(SeatHold.objects, "create", side_effect=IntegrityError):
+            with self.assertRaises(BookingError):
+                hold_seat(self.user, self.event.pk)
+        self.event.refresh_from_db()
+        self.assertEqual((10, 0), (self.event.seats, self.event.seats_held))
+
+    def test_seat_hold_can_be_confirmed_or_released(self):
+        """
+        Test to verify that a held seat is taken from the event until it is confirmed into a ticket or released
+        """
+        hold_url = reverse("event_hold", kwargs={"pk": self.event.pk})
+        request = self.factory.post(hold_url)
+        force_authenticate(request, user=self.user)
+        response = seat_hold(request, pk=self.event.pk)
+        self.assertEqual(200, response.status_code)
+        expires_at = response.data["data"]["expires_at"]
+        self.event.refresh_from_db()
+        self.assertEqual((9, 0, 1, 10), (self.event.seats, self.event.tickets_sold, self.event.seats_held, self.event.capacity))
+
+        #holding again keeps the same hold
+        request = self.factory.post(hold_url)
+        force_authenticate(request, user=self.user)
+        self.assertEqual(expires_at, seat_hold(request, pk=self.event.pk).data["data"]["expires_at"])
+
+        request = self.factory.post(reverse("event_hold_confirm", kwargs={"pk": self.event.pk}))
+        force_authenticate(request, user=self.user)
+        response = confirm_seat_hold(request, pk=self.event.pk)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(Ticket.objects.get(user=self.user).pk, response.data["data"]["pk"])
+        self.event.refresh_from_db()
+        self.assertEqual((9, 1, 0, 10), (self.event.seats, self.event.tickets_sold, self.event.seats_held, self.event.capacity))
+        self.assertEqual(400, confirm_seat_hold(request, pk=self.event.pk).status_code)
+
+        request = self.factory.post(hold_url)
+        force_authenticate(request, user=self.adminuser)
+        seat_hold(request, pk=self.event.pk)
+        request = self.factory.delete(hold_url)
+        force_authenticate(request, user=self.adminuser)
+        self.assertEqual(200, seat_hold(request, pk=self.event.pk).status_code)
+        self.assertEqual(400, seat_hold(request, pk=self.event.pk).status_code)
+        self.event.refresh_from_db()
+        self.assertEqual((9, 1, 0), (self.event.seats, self.event.tickets_sold, self.event.seats_held))
+
+    def test_expired_seat_holds_are_swept_in_batches(self):
+        """
+        Test to verify that the sweeper gives back the seats of expired holds only, to the waitlist first
+        """
+        sharded = Event.objects.create(name="sharded", seats=5, expiration=self.upcoming)
+        distribute_seats(sharded, 2, 5)
+        users = [User.objects.create_user("holder%d" % i, "", self.password) for i in range(5)]
+        for user in users:
+            hold_seat(user, self.event.pk)
+            hold_seat(user, sharded.pk)
+        SeatHold.objects.exclude(user=users[0]).update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        WaitlistEntry.objects.create(user=self.user, event=sharded)
+        self.assertEqual([], verify_event_counters())
+
+        out = StringIO()
+        call_command("sweep_seat_holds", "--batch-size", "3", stdout=out)
+        self.assertIn("Released 8 expired seat hold(s)", out.getvalue())
+        self.assertEqual({users[0].pk}, set(SeatHold.objects.values_list("user", flat=True)))
+        self.assertTrue(Ticket.objects.filter(user=self.user, event=sharded).exists())
+        self.event.refresh_from_db()
+        self.assertEqual((9, 0, 1), (self.event.seats, self.event.tickets_sold, self.event.seats_held))
+        self.assertEqual([], verify_event_counters())
+        reconcile_seats()
+        sharded.refresh_from_db()
+        self.assertEqual((3, 1, 1, 5), (sharded.seats, sharded.tickets_sold, sharded.seats_held, sharded.capacity))
+
+    def test_ticket_list_etag_changes_with_new_tickets(self):
+        """
+        Test to verify that a user's ticket list answers 304 until the user books another ticket
+        """
+        ticket_list = TicketViewSet.as_view({'get':'list'})
+        request = self.factory.get("/ticket/")
+        force_authenticate(request, user=self.user)
+        etag = ticket_list(request)["ETag"]
+
+        request = self.factory.get("/ticket/", HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        self.assertEqual(304, ticket_list(request).status_code)
+
+        book_many([(self.user.pk, self.event.pk)])
+        request = self.factory.get("/ticket/", HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        response = ticket_list(request)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(response.data["results"]))
+
+class TokenBucketStoreTestCase(SimpleTestCase):
+
+    def test_buckets_are_shared_across_processes(self):
+        """
+        Test to verify that worker processes mapping the same file take exactly the tokens of one bucket between them
+        """
+        path = os.path.join(tempfile.mkdtemp(), "buckets")
+        context = multiprocessing.get_context("fork")
+        taken = context.Queue()
+
+        def worker():
+            store = TokenBucketStore(path, 1024)
+            taken.put(sum(store.consume("booking.user:1", 0.001, 100) == 0 for _ in range(50)))
+
+        workers = [context.Process(target=worker) for _ in range(4)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+        self.assertEqual(100, sum(taken.get() for _ in workers))
+        self.assertTrue(TokenBucketStore(path, 1024).consume("booking.user:1", 0.001, 100) > 0)
+        self.assertEqual(0, TokenBucketStore(path, 1024).consume("booking.user:2", 0.001, 100))
+
+    def test_bucket_refills_at_rate(self):
+        """
+        Test to verify that an empty bucket gives a token back after 1 / rate seconds
+        """
+        store = TokenBucketStore(None, 16)
+        with mock.patch("event.throttling.time") as clock:
+            clock.time.return_value = 1000.0
+            self.assertEqual([0, 0], [store.consume("key", 0.5, 2) for _ in range(2)])
+            self.assertEqual(2, store.consume("key", 0.5, 2))
+            clock.time.return_value = 1002.0
+            self.assertEqual(0, store.consume("key", 0.5, 2))
+            store.clear()
+            self.assertEqual(0, store.consume("key", 0.5, 2))
+
+    def test_colliding_keys_never_reset_a_bucket_in_use(self):
+        """
+        Test to verify that keys of the same set get buckets of their own while ways are free, share one when
+        every bucket is in use, and only take over buckets that have refilled
+        """
+        store = TokenBucketStore(None, 2, ways=2)
+        with mock.patch("event.throttling.time") as clock:
+            clock.time.return_value = 1000.0
+            self.assertEqual([0, 0], [store.consume("a", 1, 2) for _ in range(2)])
+            self.assertEqual([0, 0], [store.consume("b", 1, 2) for _ in range(2)])
+            #both buckets are empty, c is counted against the first one instead of resetting it
+            self.assertEqual(1, store.consume("c", 1, 2))
+            self.assertEqual(1, store.consume("a", 1, 2))
+            self.assertEqual(1, store.consume("b", 1, 2))
+
+            clock.time.return_value = 1010.0
+            self.assertEqual(0, store.consume("c", 1, 2))
+            self.assertEqual([False, True], [store.consume("c", 1, 2) > 0 for _ in range(2)])
+
+class GroupCommitQueueTestCase(SimpleTestCase):
+
+    def test_concurrent_bookings_are_flushed_together(self):
+        """
+        Test to verify that bookings submitted concurrently end up in one batch and each gets its own result
+        """
+        batches = []
+
+        def book(registrations):
+            batches.append(registrations)
+            return [BookingError("Event registration full") if event_id == 2 else "ticket-%d" % user_id
+                    for user_id, event_id in registrations]
+
+        queue = GroupCommitQueue(window=5, max_batch=4, book=book)
+        results = {}
+
+        def submit(user_id, event_id):
+            user = User(pk=user_id)
+            try:
+                results[user_id] = queue.submit(user, event_id)
+            except BookingError as e:
+                results[user_id] = str(e)
+
+        threads = [threading.Thread(target=submit, args=(user_id, 2 if user_id == 3 else 1)) for user_id in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(batches))
+        self.assertEqual(4, len(batches[0]))
+        self.assertEqual({0: "ticket-0", 1: "ticket-1", 2: "ticket-2", 3: "Event registration full"}, results)
+
+
+class CachedResponseTestCase(SimpleTestCase):
+
+    def test_shipped_version_cache_is_shared(self):
+        """
+        Test to verify that the default configuration keeps the version stamps where every worker process of the
+        host sees them, so that ETags and the response cache are on out of the box
+        """
+        self.assertTrue(versions_shared())
+        get_version_cache().set("version:shared-test", 1)
+        process = multiprocessing.get_context("fork").Process(target=lambda: get_version_cache().set("version:shared-test", 2))
+        process.start()
+        process.join()
+        self.assertEqual(2, get_version_cache().get("version:shared-test"))
+        get_version_cache().delete("version:shared-test")
+
+    def test_concurrent_misses_build_the_response_once(self):
+        """
+        Test to verify that concurrent requests for the same uncached response are coalesced
+        """
+        get_cache().clear()
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return Response({"pk": 1})
+
+        results = []
+
+        def read():
+            request = Request(APIRequestFactory().get("/event/1/"))
+            results.append(cached_response(request, ["event:1"], build).data)
+
+        threads = [threading.Thread(target=read) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(builds))
+        self.assertEqual([{"pk": 1}] * 5, results)
+
+
+class FastJSONTestCase(SimpleTestCase):
+
+    payload = {
+        "pk": 1,
+        "name": "caf\u00e9 \u2028 \u2029 \"quoted\" \x01",
+        "expiration": datetime.date(2022, 3, 20),
+        "created": datetime.datetime(2022, 3, 20, 10, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+        "price": decimal.Decimal("10.50"),
+        "image": {"full_size": "http://testserver/media/a.jpg", "thumbnail": "http://testserver/media/__sized__/a.jpg"},
+        "tickets": [{"pk": 2, "updated": datetime.date(2022, 3, 21)}],
+        "big": 2 ** 70,
+        1: None,
+    }
+
+    def test_renderer_output_matches_drf(self):
+        """
+        Test to verify that the fast renderer produces the same bytes as DRF with and without orjson
+        """
+        #integers beyond 64 bits are not supported by orjson and go through the fallback
+        for payload in (self.payload, dict(self.payload, big=2 ** 60)):
+            expected = JSONRenderer().render(payload)
+            self.assertEqual(expected, renderers.FastJSONRenderer().render(payload))
+            with mock.patch.object(renderers, "orjson", None):
+                self.assertEqual(expected, renderers.FastJSONRenderer().render(payload))
+        indented = JSONRenderer().render(self.payload, "application/json; indent=4")
+        self.assertEqual(indented, renderers.FastJSONRenderer().render(self.payload, "application/json; indent=4"))
+
+    def test_parser_matches_drf(self):
+        """
+        Test to verify that the fast parser parses like DRF and rejects the same bodies
+        """
+        body = json.dumps({"registrations": [{"user": 1, "event": 2}], "name": "caf\u00e9"}).encode()
+        self.assertEqual(JSONParser().parse(BytesIO(body)), renderers.FastJSONParser().parse(BytesIO(body)))
+        for invalid in (b'{"seats": NaN}', b'{"seats": '):
+            with self.assertRaises(ParseError):
+                renderers.FastJSONParser().parse(BytesIO(invalid))
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Query plan regression tests: the hot lookups must be answered from an index on a seeded dataset
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        cls.users = User.objects.bulk_create([User(username="planner%d" % i) for i in range(50)])
+        cls.categories = Category.objects.bulk_create([Category(name="category%d" % i) for i in range(10)])
+        Event.objects.bulk_create([Event(name="planned%d" % i, expiration=today + datetime.timedelta(days=i - 100))
+                                  for i in range(200)])
+        cls.events = list(Event.objects.order_by('pk'))
+        Event.category.through.objects.bulk_create([Event.category.through(event=event, category=cls.categories[i % 10])
+                                                    for i, event in enumerate(cls.events)])
+        Ticket.objects.bulk_create([Ticket(user=user, event=event) for user in cls.users for event in cls.events[:20]])
+
+    def assertUsesIndex(self, queryset, index=None):
+        """
+        Asserts that no table of the query is scanned without an index (and that the given index is used)
+        """
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                #the seeded tables are tiny, make sure the planner still considers the indexes
+                cursor.execute('SET enable_seqscan = off')
+            plan = queryset.explain()
+            if connection.vendor == 'postgresql':
+                cursor.execute('RESET enable_seqscan')
+        #Seq Scan on PostgreSQL, a SCAN without USING INDEX on SQLite
+        self.assertNotIn('Seq Scan', plan)
+        self.assertNotRegex(plan, r'(?m)SCAN \w+\s*$')
+        self.assertRegex(plan, 'INDEX|Index')
+        if index is not None:
+            self.assertIn(index, plan)
+
+    def test_booking_lookups_use_indexes(self):
+        """
+        Test to verify that duplicate ticket checks and event name lookups are index searches
+        """
+        self.assertUsesIndex(Ticket.objects.filter(user=self.users[0], event=self.events[0]))
+        self.assertUsesIndex(Event.objects.filter(name="planned5"))
+
+    def test_list_queries_use_indexes(self):
+        """
+        Test to verify that the ticket and event lists, the category filter and open events are read through indexes
+        """
+        self.assertUsesIndex(Ticket.objects.filter(user=self.users[0]).order_by('-created', '-pk')[:21], 'ticket_user_created_idx')
+        self.assertUsesIndex(Event.objects.order_by('-created', '-pk')[:21], 'event_created_id_idx')
+        self.assertUsesIndex(Event.objects.filter(category=self.categories[0]), 'event_event_category_category_event_idx')
+        self.assertUsesIndex(Event.objects.filter(expiration__gt=datetime.date.today()))
+        self.assertUsesIndex(Event.objects.open().order_by('-created', '-pk')[:21], 'event_open_expiration_idx')
+
+    def test_cursor_pages_bound_the_index_scan(self):
+        """
+        Test to verify that a page after a cursor starts its index scan at the cursor instead of walking the index
+        from the top (the cost of a page must not grow with its depth)
+        """
+        paginator = KeysetPagination()
+        paginator.fields = paginator.get_ordering(Event)
+        cursor = self.events[100]
+        for reverse in (False, True):
+            queryset = Event.objects.filter(paginator.beyond(paginator.get_position(cursor), reverse))
+            queryset = queryset.order_by(*[('-' if desc != reverse else '') + name for name, desc in paginator.fields])[:21]
+            self.assertUsesIndex(queryset, 'event_created_id_idx')
+            plan = queryset.explain()
+            if connection.vendor == 'postgresql':
+                self.assertRegex(plan, r'Index Cond: \(created [<>]=')
+            elif connection.vendor == 'sqlite':
+                self.assertRegex(plan, r'SEARCH \w+ USING INDEX event_created_id_idx \(created[<>]\?\)')
+
@@ -0,0 +1,181 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+
+try:
+    import fcntl
+except ImportError:
+    #no byte range locks (Windows), buckets are then kept per process
+    fcntl = None
+
+
+#one bucket: hash of its key, tokens left, time of the last update, time it is full again
+_BUCKET = struct.Struct('=Qddd')
+
+
+class TokenBucketStore:
+    """
+    Token buckets kept in a memory mapped file, so that every worker process of the host shares them
+    without an external service. The file is a fixed size table of sets of buckets (ways per set) addressed
+    by a hash of their key. A key missing from its set takes over a bucket that is unused or already full
+    again (its key lost nothing), and shares the bucket of the first way of the set when every bucket is in
+    use, so a bucket in use is never reset. Each update holds a thread lock of its stripe and a byte range
+    lock (fcntl) on its set only, so a check costs a few microseconds and checks of different keys do not
+    wait on each other.
+    """
+
+    def __init__(self, path, slots, stripes=64, ways=4):
+        self.ways = ways
+        self.sets = max(1, slots // ways)
+        self._span = ways * _BUCKET.size
+        size = self.sets * self._span
+        self._fd = None
+        if path and fcntl is not None:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        else:
+            self._map = mmap.mmap(-1, size)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def consume(self, key, rate, capacity):
+        """
+        Method to take a token from the bucket of a key.
+        Input:
+            key => bucket key, e.g. scope and user
+            rate => tokens added back per second
+            capacity => size of the bucket (burst)
+        Output:
+            0 if a token was taken, otherwise seconds until the next token
+        """
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        index = digest % self.sets
+        offset = index * self._span
+        with self._locks[index % len(self._locks)]:
+            if self._fd is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, self._span, offset)
+            try:
+                now = time.time()
+                buckets = [_BUCKET.unpack_from(self._map, offset + way * _BUCKET.size) for way in range(self.ways)]
+                way = next((way for way, bucket in enumerate(buckets) if bucket[0] == digest), None)
+                if way is None:
+                    way = next((way for way, bucket in enumerate(buckets) if bucket[3] <= now), None)
+                if way is None:
+                    way, digest = 0, buckets[0][0]
+                stored, tokens, updated, _ = buckets[way]
+                if stored != digest:
+                    tokens, updated = capacity, now
+                tokens = min(capacity, tokens + max(0, now - updated) * rate)
+                wait = 0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / rate
+                _BUCKET.pack_into(self._map, offset + way * _BUCKET.size, digest, tokens, now,
+                                  now + (capacity - tokens) / rate)
+                return wait
+            finally:
+                if self._fd is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, self._span, offset)
+
+    def clear(self):
+        """
+        Method to refill every bucket.
+        """
+        self._map[:] = bytes(len(self._map))
+
+
+_store = (None, None)
+_store_lock = threading.Lock()
+
+
+def get_throttle_store():
+    """
+    Method to return the token bucket store of this process, configured from settings
+    (EVENT_THROTTLE_FILE, EVENT_THROTTLE_SLOTS).
+    Output:
+        TokenBucketStore instance
+    """
+    global _store
+    config = (getattr(settings, 'EVENT_THROTTLE_FILE', None), getattr(settings, 'EVENT_THROTTLE_SLOTS', 65536))
+    with _store_lock:
+        if _store[0] != config:
+            _store = (config, TokenBucketStore(*config))
+        return _store[1]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle letting each client make bursts of up to N requests, refilled at N per period, with the rate
+    of the scope set in DEFAULT_THROTTLE_RATES ("N/period", period being s, m, h or d). Buckets live in the
+    shared TokenBucketStore so the limit holds across worker processes. Scopes without a rate are not throttled.
+    """
+    scope = None
+    parse_rate = SimpleRateThrottle.parse_rate
+
+    def get_key(self, request):
+        """
+        Method to return the key of the client the request is counted against, None to let it through.
+        """
+        raise NotImplementedError('get_key() must be implemented')
+
+    def allow_request(self, request, view):
+        self.wait_time = None
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        key = self.get_key(request)
+        if rate is None or key is None:
+            return True
+
+        num, duration = self.parse_rate(rate)
+        self.wait_time = get_throttle_store().consume('%s:%s' % (self.scope, key), num / duration, num)
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Token bucket per authenticated user (anonymous requests are left to the per IP throttle).
+    """
+
+    def get_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return None
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Token bucket per client IP address (see NUM_PROXIES for clients behind proxies).
+    """
+
+    def get_key(self, request):
+        return self.get_ident(request)
+
+
+class BookingUserThrottle(UserTokenBucketThrottle):
+    scope = 'booking.user'
+
+
+class BookingIPThrottle(IPTokenBucketThrottle):
+    scope = 'booking.ip'
+
+
+class AuthUserThrottle(UserTokenBucketThrottle):
+    scope = 'auth.user'
+
+
+class AuthIPThrottle(IPTokenBucketThrottle):
+    scope = 'auth.ip'
+
+
+BOOKING_THROTTLES = [BookingUserThrottle, BookingIPThrottle]
+AUTH_THROTTLES = [AuthUserThrottle, AuthIPThrottle]
@@ -1,48 +1,72 @@
 import datetime
 from .serializers import EventSerializer, ImageSerializer, TicketSerializer
 from .models import Event, Image, Ticket
+from .booking import (book_many, book_seat, cancel_ticket, confirm_hold, distribute_seats, hold_seat, join_waitlist,
+                      promote_waitlist, release_hold, sync_locked_counters, BookingError)
+from .admission import admission_control
+from .idempotency import idempotent, idempotent_response
+from .throttling import BOOKING_THROTTLES
+from .group_commit import get_group_commit_queue
+from .pagination import KeysetPagination
+from .planner import plan_view_queryset
+from .conditional import ConditionalGetMixin
+from .fast import FastListMixin
+from .streaming import StreamingListMixin
 from rest_framework.viewsets import ModelViewSet
 from rest_flex_fields.views import FlexFieldsMixin, FlexFieldsModelViewSet
-from rest_flex_fields import is_expanded
 from rest_framework import serializers
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view, action
+from rest_framework.decorators import api_view, action, throttle_classes
 from rest_framework.renderers import JSONRenderer, TemplateHTMLRenderer
 from rest_framework import status
 from rest_framework.response import Response
-from threading import Lock, Thread
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from django.db import IntegrityError, transaction
+from django.conf import settings
 
 
-class EventViewSet(FlexFieldsMixin, ModelViewSet):
+class EventViewSet(StreamingListMixin, ConditionalGetMixin, FastListMixin, FlexFieldsMixin, ModelViewSet):
     """
     View set for event related operations. Can only be accessed by authenticated users.
     """
+    cache_responses = True      #list / retrieve responses are cached until something they show changes
 
     serializer_class = EventSerializer
-    permit_list_expands = ['category', 'tickets']   #will expand as and when needed (if specified)
+    permit_list_expands = ['category', 'tickets', 'image']   #will expand as and when needed (if specified)
     filterset_fields = ('category',)    #used to filter the events
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination     #cursor based, ordered by -created then -pk
 
     def get_queryset(self):
         """
-        GET method to fetch all the events and conditionally expand the nested objects in it (category or tickets)
+        GET method to fetch all the events and conditionally expand the nested objects in it (category, tickets or image)
         Input:
             None (nothing except self)
         Output:
             query set which represents the entire event set
         """
-        queryset = Event.objects.all()
+        events = Event.objects.all()
+        #?open=true lists only the events still open for registration
+        if self.action == 'list' and self.is_open_listing():
+            events = Event.objects.open()
+        #joins / prefetches whatever the requested expands need (at any depth)
+        return plan_view_queryset(events, self)
 
-        if is_expanded(self.request, 'category'):
-            queryset = queryset.prefetch_related('category')
-            
+    def is_open_listing(self):
+        return self.request.query_params.get('open', '').lower() in ('true', '1')
 
-        if is_expanded(self.request, 'tickets'):
-            queryset = queryset.prefetch_related('tickets')
-
-        return queryset
 
+    def get_version_scopes(self):
+        """
+        Method to return the cache / ETag version scopes of the current request.
+        Lists change with any event, category, image or seat count, details only with their own event.
+        """
+        if self.action == 'retrieve':
+            return ['taxonomy', 'event:%s' % self.kwargs.get('pk')]
+        if self.is_open_listing():
+            #open events also change when the date does, a new day starts a new scope
+            return ['events', 'date:%s' % datetime.date.today().isoformat()]
+        return ['events']
 
     def create(self, request):
         """
@@ -56,15 +80,29 @@ class EventViewSet(FlexFieldsMixin, ModelViewSet):
         if request.user.is_superuser == False or request.user.is_staff == False:
             return Response({"status":"error", "data":"You don't have permission to create event"}, status=status.HTTP_401_UNAUTHORIZED)
         
-        #if event with this name already exists then return error
-        if Event.objects.filter(name=request.data["name"]).exists():
-            return Response({"status":"error","data":"Event already exists"},status=status.HTTP_400_BAD_REQUEST)
+        return idempotent_response(request, lambda: self.create_event(request))
 
+    def create_event(self, request):
+        """
+        Method to validate and save a new event. Names are unique, a duplicate is caught by the unique
+        index when it is saved instead of being looked up first.
+        Input:
+            request => incoming HTTP Request
+        Output:
+            HTTP response with corresponding status code
+        """
         serializer = EventSerializer(data=request.data)
 
         #performs serializer validations
         if serializer.is_valid():
-            serializer.save()
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except IntegrityError:
+                #if event with this name already exists then return error, other violations are not expected here
+                if not Event.objects.filter(name=serializer.validated_data['name']).exists():
+                    raise
+                return Response({"status":"error","data":"Event already exists"},status=status.HTTP_400_BAD_REQUEST)
             return Response({"status": "success", "data": serializer.data}, status=status.HTTP_201_CREATED)
 
         else:
@@ -85,23 +123,53 @@ class EventViewSet(FlexFieldsMixin, ModelViewSet):
         if request.user.is_superuser == False or request.user.is_staff == False:
             return Response({"status":"error", "data":"You don't have permission to create event"}, status=status.HTTP_401_UNAUTHORIZED)
 
-        #check if such an event actually exists
-        if Event.objects.filter(id=pk).exists():
+        #optional number of shards the seats are split over (0 turns sharding off)
+        shard_count = request.data.get("shard_count")
+        if shard_count is not None:
+            max_shards = getattr(settings, 'EVENT_MAX_SHARDS', 64)
+            try:
+                shard_count = int(shard_count)
+            except (TypeError, ValueError):
+                shard_count = -1
+            if shard_count < 0 or shard_count > max_shards:
+                return Response({"status":"error", "data":"shard_count must be a number between 0 and %d" % max_shards},
+                                status=status.HTTP_400_BAD_REQUEST)
 
-            event = Event.objects.filter(id=pk).first()
+        #row is locked so that concurrent bookings are not overwritten by this save
+        with transaction.atomic():
+            event = Event.objects.select_for_update().filter(id=pk).first()
+
+            #check if such an event actually exists
+            if event is None:
+                return Response({"status": "error", "data": "event does not exists!"}, status=status.HTTP_400_BAD_REQUEST)
+
+            #counters of sharded events lag behind the shards, recount them before capacity is derived again
+            seats = sync_locked_counters(event)
             event.description = request.data['description']
             event.expiration = request.data['expiration']
             #update the number of seats only if incoming object has non zero seats
             if int(request.data["seats"]) > 0:
-                event.seats = int(request.data["seats"])
+                seats = int(request.data["seats"])
+            event.seats = seats
 
             event.save()
-            return  Response({"status":"success","data":"Event successfully updated"},status=status.HTTP_200_OK)
-        return Response({"status": "error", "data": "event does not exists!"}, status=status.HTTP_400_BAD_REQUEST)
+
+            #optionally split the seats over several shards for hot events (0 turns sharding off)
+            if shard_count is None:
+                shard_count = event.shard_count
+            if shard_count or event.shard_count:
+                distribute_seats(event, shard_count, seats)
+
+            #added seats go to the waitlist first
+            promote_waitlist([event.pk])
+        return  Response({"status":"success","data":"Event successfully updated"},status=status.HTTP_200_OK)
     
 
 
 @api_view(['GET'])
+@throttle_classes(BOOKING_THROTTLES)
+@idempotent
+@admission_control(methods=['GET'])
 def register_event(request, pk):
     """
     GET method to register the event specified by pk for current user
@@ -115,50 +183,153 @@ def register_event(request, pk):
     if request.user.is_authenticated == False:
         return Response({"status":"error", "data":"Please login"}, status=status.HTTP_401_UNAUTHORIZED)
 
-    event = Event.objects.filter(pk=pk).first()
+    try:
+        #in group commit mode concurrent registrations of this process are booked together in one transaction
+        if getattr(settings, 'EVENT_GROUP_COMMIT', False):
+            ticket = get_group_commit_queue().submit(request.user, pk)
+        else:
+            ticket = book_seat(request.user, pk)
+    except BookingError as e:
+        return Response({"status":"error", "data":str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    #check if event with the given pk exists
-    if event is None:
-        return Response({"status":"error","data":"Event does not exists"},status=status.HTTP_400_BAD_REQUEST)
-    
-    expiration_date = event.expiration
+    return Response({"status": "success", "data":
+    {"pk":ticket.pk, "event name":ticket.event.name, "event description":ticket.event.description}}, status=status.HTTP_200_OK)
 
-    #if event expiration date is today or has already gone
-    if expiration_date <= datetime.datetime.now().date():
-        return Response({"status":"error", "data":"Event already over or ongoing. Cannot register now"}, status=status.HTTP_400_BAD_REQUEST)
 
-    #if event has no seats left
-    if event.seats == 0:
-            return Response({"status":"error", "data":"Event registration full"}, status=status.HTTP_400_BAD_REQUEST)
-    
-    #if user has already registered for the event
-    if Ticket.objects.filter(user=request.user, event=event).exists():
-        return Response({"status":"error", "data":"Event already regsitered"}, status=status.HTTP_400_BAD_REQUEST)
-    
-    #lock to atomically update event
-    lock = Lock()
-    lock.acquire()
-    event.seats -= 1
-    event.save()
-    lock.release()
-    
-    #register the current user for event and generate a ticket
-    ticket = Ticket.objects.create(user=request.user, event=event)
+@api_view(['GET'])
+@throttle_classes(BOOKING_THROTTLES)
+def join_event_waitlist(request, pk):
+    """
+    GET method to put the current user in the waitlist of the sold out event specified by pk.
+    Waiting users get a ticket (first come first served) as soon as seats are given back.
+    Input:
+        request => Incoming HTTP request
+        pk => primary key of the event
+    Output:
+        HTTP response with the position of the user in the waitlist
+    """
+    #If user is not authenticated then return error
+    if request.user.is_authenticated == False:
+        return Response({"status":"error", "data":"Please login"}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        position = join_waitlist(request.user, pk)
+    except BookingError as e:
+        return Response({"status":"error", "data":str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"status": "success", "data": {"event": int(pk), "position": position}}, status=status.HTTP_200_OK)
+
+
+@api_view(['POST', 'DELETE'])
+@throttle_classes(BOOKING_THROTTLES)
+@admission_control(methods=['POST'])
+def seat_hold(request, pk):
+    """
+    POST method to hold a seat of the event specified by pk for the current user during checkout,
+    DELETE method to give the held seat back. Holds expire after EVENT_SEAT_HOLD_SECONDS.
+    Input:
+        request => Incoming HTTP request
+        pk => primary key of the event
+    Output:
+        HTTP response with the expiry time of the hold
+    """
+    #If user is not authenticated then return error
+    if request.user.is_authenticated == False:
+        return Response({"status":"error", "data":"Please login"}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if request.method == 'DELETE':
+        if not release_hold(request.user, pk):
+            return Response({"status":"error", "data":"No seat held for this event"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"status":"success", "data":"Seat released"}, status=status.HTTP_200_OK)
 
-    if ticket is None:
-        return Response({"status": "error", "data": "some error occured"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        hold = hold_seat(request.user, pk)
+    except BookingError as e:
+        return Response({"status":"error", "data":str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    else:
-        return Response({"status": "success", "data": 
-        {"pk":ticket.pk, "event name":event.name, "event description":event.description}}, status=status.HTTP_200_OK)
+    return Response({"status": "success", "data": {"event": hold.event_id, "expires_at": hold.expires_at}}, status=status.HTTP_200_OK)
 
 
-class TicketViewSet(ModelViewSet):
+@api_view(['POST'])
+@throttle_classes(BOOKING_THROTTLES)
+def confirm_seat_hold(request, pk):
+    """
+    POST method to turn the seat held by the current user for the event specified by pk into a ticket
+    Input:
+        request => Incoming HTTP request
+        pk => primary key of the event
+    Output:
+        HTTP response with the ticket, like a registration
+    """
+    #If user is not authenticated then return error
+    if request.user.is_authenticated == False:
+        return Response({"status":"error", "data":"Please login"}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        ticket = confirm_hold(request.user, pk)
+    except BookingError as e:
+        return Response({"status":"error", "data":str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"status": "success", "data":
+    {"pk":ticket.pk, "event name":ticket.event.name, "event description":ticket.event.description}}, status=status.HTTP_200_OK)
+
+
+#maximum number of registrations accepted by one bulk request and booked per transaction
+BULK_REGISTRATION_LIMIT = 10000
+BULK_REGISTRATION_CHUNK_SIZE = 1000
+
+
+@api_view(['POST'])
+@idempotent
+def register_events_bulk(request):
+    """
+    POST method to register many users for events in one call. Only superuser/admin can access it.
+    Input:
+        request => Incoming HTTP request with "registrations", a list of {"user": user pk, "event": event pk}
+    Output:
+        HTTP response with one result per registration (in request order)
+    """
+    #If user is not authenticated then return error
+    if request.user.is_authenticated == False:
+        return Response({"status":"error", "data":"Please login"}, status=status.HTTP_401_UNAUTHORIZED)
+
+    #check to ensure only admin is able to register other users
+    if request.user.is_superuser == False or request.user.is_staff == False:
+        return Response({"status":"error", "data":"You don't have permission to register other users"}, status=status.HTTP_401_UNAUTHORIZED)
+
+    registrations = request.data.get("registrations") if isinstance(request.data, dict) else None
+    if not isinstance(registrations, list) or len(registrations) > BULK_REGISTRATION_LIMIT:
+        return Response({"status":"error", "data":"registrations must be a list of at most %d items" % BULK_REGISTRATION_LIMIT},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    results = [None] * len(registrations)
+    valid = []
+    for index, registration in enumerate(registrations):
+        try:
+            valid.append((index, int(registration["user"]), int(registration["event"])))
+        except (TypeError, KeyError, ValueError):
+            results[index] = {"status":"error", "data":"user and event must be primary keys"}
+
+    #each chunk is validated and booked with set based queries in its own transaction
+    for start in range(0, len(valid), BULK_REGISTRATION_CHUNK_SIZE):
+        chunk = valid[start:start + BULK_REGISTRATION_CHUNK_SIZE]
+        booked = book_many([(user_id, event_id) for _, user_id, event_id in chunk])
+        for (index, user_id, event_id), result in zip(chunk, booked):
+            if isinstance(result, BookingError):
+                results[index] = {"user":user_id, "event":event_id, "status":"error", "data":str(result)}
+            else:
+                results[index] = {"user":user_id, "event":event_id, "status":"success", "pk":result.pk}
+
+    return Response({"status":"success", "data":results}, status=status.HTTP_200_OK)
+
+
+class TicketViewSet(StreamingListMixin, ConditionalGetMixin, FastListMixin, ModelViewSet):
     """
     View set for ticket (ticket represents a registration of a user for a particular event)
     """
     serializer_class = TicketSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination     #newest first (-created then -pk)
     
     def get_queryset(self):
         """
@@ -170,15 +341,50 @@ class TicketViewSet(ModelViewSet):
         """
 
         tickets = Ticket.objects.filter(user=self.request.user)
-        if tickets is not None:
-            return tickets
-        return Response({"status":"error", "data":"No tickets for current user"})
+        return plan_view_queryset(tickets, self)
+
+    def get_version_scopes(self):
+        """
+        Method to return the ETag version scopes of the current request (the tickets of the current user,
+        plus the events when they are expanded).
+        """
+        scopes = ['tickets:%s' % self.request.user.pk]
+        if self.request.query_params.get('expand'):
+            scopes += ['events', 'taxonomy']
+        return scopes
+
+    def perform_destroy(self, instance):
+        """
+        Method to cancel a ticket (DELETE), the seat is given back to the event (or the head of its waitlist)
+        in the same transaction.
+        Input:
+            instance => ticket of the current user
+        Output:
+            None
+        """
+        cancel_ticket(instance)
 
-class ImageViewSet(FlexFieldsModelViewSet):
+class ImageViewSet(ConditionalGetMixin, FlexFieldsModelViewSet):
     """
     View set to represent the images associated with events
     """
     serializer_class = ImageSerializer
     queryset = Image.objects.all()
     permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """
+        GET method to return all the images, planned for the requested expands.
+        Input:
+            None (nothing except self)
+        Output:
+            query set which represents all the images
+        """
+        return plan_view_queryset(Image.objects.all(), self)
+
+    def get_version_scopes(self):
+        """
+        Method to return the ETag version scopes of the current request.
+        """
+        return ['images']
     
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -46,7 +47,8 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt.token_blacklist',
     'django_nose',
     'rest_framework_swagger',
-    'event'
+    'event',
+    'auth.apps.AuthConfig',
 ]
 
 TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
@@ -93,10 +95,32 @@ WSGI_APPLICATION = 'event_mgmt.wsgi.application'
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        #simplejwt's JWTAuthentication with the users resolved from a per process cache
+        'auth.authentication.CachedJWTAuthentication',
     ],
+    #orjson based JSON (same output as DRF's renderer / parser, which are used when orjson is not installed)
+    'DEFAULT_RENDERER_CLASSES': [
+        'event.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'event.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    #token buckets of the booking / auth views (see event.throttling): bursts of N, refilled at N per period
+    'DEFAULT_THROTTLE_RATES': {
+        'booking.user': '30/min',
+        'booking.ip': '300/min',
+        'auth.user': '30/min',
+        'auth.ip': '60/min',
+    },
 }
 
+#file holding the throttle token buckets, shared by the worker processes of the host
+EVENT_THROTTLE_FILE = os.path.join(tempfile.gettempdir(), 'event_mgmt_throttle.bin')
+EVENT_THROTTLE_SLOTS = 65536
+
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
@@ -111,6 +135,16 @@ DATABASES = {
     }
 }
 
+#Booking mode. With group commit enabled the registrations a process receives within
+#EVENT_GROUP_COMMIT_WINDOW seconds are booked together in one transaction (at most
+#EVENT_GROUP_COMMIT_MAX_BATCH per transaction). Useful during on-sale spikes.
+EVENT_GROUP_COMMIT = False
+EVENT_GROUP_COMMIT_WINDOW = 0.005
+EVENT_GROUP_COMMIT_MAX_BATCH = 200
+
+#upper bound of the shard_count an admin can set on an event (see event.booking.distribute_seats)
+EVENT_MAX_SHARDS = 64
+
 VERSATILEIMAGEFIELD_RENDITION_KEY_SETS = {
     'event_headshot': [
         ('full_size', 'url'),
@@ -120,6 +154,84 @@ VERSATILEIMAGEFIELD_RENDITION_KEY_SETS = {
     ]
 }
 
+# Caches
+# The event_catalog cache holds cached event responses and their version stamps. Local memory is
+# per process, with several worker processes use a shared backend that works offline such as
+# 'django.core.cache.backends.filebased.FileBasedCache' (LOCATION: a directory) or
+# 'django.core.cache.backends.db.DatabaseCache' (LOCATION: a table, see createcachetable).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'event_catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'event-catalog',
+    },
+    #version stamps of the catalog, the users and the token blacklist (see event.cache), tiny entries that must
+    #not be culled, a culled stamp invalidates everything built from it. A file cache is shared by the worker
+    #processes of the host, use Redis / Memcached when the workers run on several hosts
+    'event_versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'event_mgmt_versions'),
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+    #queues of the waiting room (see event.admission), entries must never be culled before they expire
+    'event_admission': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'event-admission',
+        'OPTIONS': {'MAX_ENTRIES': 10 ** 9},
+    },
+    #responses stored for Idempotency-Key retries (see event.idempotency), sized so that records live until they
+    #expire (EVENT_IDEMPOTENCY_TIMEOUT), size it for a day of keyed requests
+    'event_idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'event-idempotency',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
+EVENT_CACHE_ALIAS = 'event_catalog'
+EVENT_CACHE_TIMEOUT = 300       #seconds a cached response lives even if nothing changes
+EVENT_CACHE_LOCK_TIMEOUT = 5    #seconds concurrent misses wait for the first one to fill the cache
+EVENT_VERSION_CACHE_ALIAS = 'event_versions'
+#ETag / Last-Modified, the response cache and the user cache rely on the version stamps and are only used when
+#every worker shares them: None guesses from the backend of EVENT_VERSION_CACHE_ALIAS (local memory is not
+#shared, the file cache above is), True for single process deployments, False for several hosts sharing a file cache
+EVENT_VERSIONS_SHARED = None
+
+#flat event / ticket lists (no expand) are serialized straight from values() rows
+EVENT_FAST_SERIALIZATION = True
+
+#rows serialized at a time by ?stream=true list exports (admin only)
+EVENT_STREAM_CHUNK_SIZE = 2000
+
+#seconds a seat stays held during checkout, expired holds are reclaimed by
+#"python manage.py sweep_seat_holds" (EVENT_SEAT_HOLD_SWEEP_BATCH holds per transaction)
+EVENT_SEAT_HOLD_SECONDS = 600
+EVENT_SEAT_HOLD_SWEEP_BATCH = 1000
+
+#waiting room in front of registrations (register and seat holds): every event admits
+#EVENT_ADMISSION_RATE users per second (0 turns it off), EVENT_ADMISSION_BURST of them at once,
+#the others get 429 with their queue position and a Retry-After header. Queue positions live in
+#the EVENT_ADMISSION_CACHE_ALIAS cache, use a shared backend that does not evict (e.g. Redis with the
+#noeviction policy) with several worker processes.
+EVENT_ADMISSION_CACHE_ALIAS = 'event_admission'
+EVENT_ADMISSION_RATE = 0
+EVENT_ADMISSION_BURST = 50
+EVENT_ADMISSION_POSITION_TIMEOUT = 3600
+#bookings running at the same time per process (0 turns the limit off), requests wait at most
+#EVENT_ADMISSION_SLOT_WAIT seconds for a slot before getting 429
+EVENT_ADMISSION_CONCURRENCY = 0
+EVENT_ADMISSION_SLOT_WAIT = 0.1
+
+#responses of requests sent with an Idempotency-Key header (registration, bulk registration, event
+#creation) are replayed to retries for EVENT_IDEMPOTENCY_TIMEOUT seconds, duplicates arriving while the
+#first request runs wait up to EVENT_IDEMPOTENCY_LOCK_TIMEOUT seconds for its response
+EVENT_IDEMPOTENCY_CACHE_ALIAS = 'event_idempotency'
+EVENT_IDEMPOTENCY_TIMEOUT = 86400
+EVENT_IDEMPOTENCY_LOCK_TIMEOUT = 30
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -172,6 +284,33 @@ CSRF_TRUSTED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+#users resolved by auth.authentication.CachedJWTAuthentication are cached per process (at most
+#AUTH_USER_CACHE_SIZE of them) for AUTH_USER_CACHE_TIMEOUT seconds, or until they are saved
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_USER_CACHE_TIMEOUT = 300
+
+#refresh tokens are checked against a per process Bloom filter of the blacklist (auth.blacklist) before the
+#database: 2**23 bits hold about 900k blacklisted tokens at 1% false positives. Tokens blacklisted by other
+#processes are synced every AUTH_BLACKLIST_FILTER_SYNC_INTERVAL seconds (at once with a shared cache),
+#the filter is rebuilt every AUTH_BLACKLIST_FILTER_REBUILD_INTERVAL seconds. Syncs read the tokens blacklisted
+#since AUTH_BLACKLIST_FILTER_SYNC_MARGIN seconds before the previous sync, keep it above the longest transaction
+#blacklisting tokens (and the clock skew between hosts)
+AUTH_BLACKLIST_FILTER_BITS = 1 << 23
+AUTH_BLACKLIST_FILTER_HASHES = 7
+AUTH_BLACKLIST_FILTER_SYNC_INTERVAL = 5
+AUTH_BLACKLIST_FILTER_REBUILD_INTERVAL = 3600
+AUTH_BLACKLIST_FILTER_SYNC_MARGIN = 60
+
+#expired outstanding / blacklisted tokens deleted per transaction by "python manage.py compact_tokens"
+AUTH_TOKEN_COMPACT_BATCH = 1000
+
+#users per validated / hashed / inserted chunk of a bulk user import
+AUTH_USER_IMPORT_CHUNK = 1000
+#uploads to POST /auth/import/ are limited to AUTH_USER_IMPORT_MAX_SIZE bytes and hashed on
+#AUTH_USER_IMPORT_WEB_WORKERS processes, one import at a time per server process
+AUTH_USER_IMPORT_MAX_SIZE = 5 * 1024 * 1024
+AUTH_USER_IMPORT_WEB_WORKERS = 2
+
 SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=15),
     'ROTATE_REFRESH_TOKENS': False,
@@ -15,7 +15,8 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from event.views import EventViewSet, ImageViewSet, register_event, TicketViewSet
+from event.views import (EventViewSet, ImageViewSet, confirm_seat_hold, join_event_waitlist, register_event, register_events_bulk,
+                         seat_hold, TicketViewSet)
 from rest_framework.routers import DefaultRouter
 from django.conf import settings
 
@@ -36,6 +37,10 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('auth.urls')),
     path('event/register/<int:pk>/', register_event, name="event_register"),
+    path('event/register/bulk/', register_events_bulk, name="event_register_bulk"),
+    path('event/waitlist/<int:pk>/', join_event_waitlist, name="event_waitlist"),
+    path('event/hold/<int:pk>/', seat_hold, name="event_hold"),
+    path('event/hold/<int:pk>/confirm/', confirm_seat_hold, name="event_hold_confirm"),
     path('', include(router.urls)),
 ]
 